@@ -0,0 +1,233 @@
+# src/archive.py
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from src import reader
+
+# Columnar, time-indexed archive of one station table.
+#
+# Layout of an archive directory:
+#   archive.json                 - schema, generator configuration and the chunk index
+#   chunks/<YYYY-MM>.<v>/        - one directory per calendar month (time chunk),
+#       TIMESTAMP.npy              sorted, unique record timestamps
+#       RECORD.npy, <column>.npy   one array per column, aligned with TIMESTAMP
+#
+# The index in archive.json lists each chunk's first and last timestamp and
+# record count, so a range query opens only the chunks it overlaps and, with
+# np.load(mmap_mode="r"), only the columns it asks for. Ingesting writes each
+# touched chunk into a new version directory and then replaces archive.json,
+# so an interrupted ingest leaves the archive as it was.
+
+INDEX_FILE = "archive.json"
+CHUNKS_DIR = "chunks"
+CHUNK_UNIT = "M" # Calendar month
+FORMAT_VERSION = 1
+
+# Column dtypes other than reader.VALUE_DTYPE
+COLUMN_DTYPES = {reader.TIMESTAMP_FIELD: np.dtype("M8[ns]"), reader.RECORD_FIELD: np.dtype(np.int64)}
+
+
+def _chunk_key(timestamps):
+    """Time chunk ('YYYY-MM') of each timestamp."""
+    return np.datetime_as_string(timestamps.astype(f"M8[{CHUNK_UNIT}]"))
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- Creating and opening ---
+
+def create_archive(root, logger_type, table_name, num_sensors, measure_interval_min, **generator_args):
+    """
+    Creates an empty archive for one table, with the schema of the program
+    generated from this configuration (see reader.table_schema()).
+
+    Returns:
+        dict: The archive index.
+
+    Raises:
+        ValueError: If 'root' already holds an archive.
+    """
+    if os.path.exists(os.path.join(root, INDEX_FILE)):
+        raise ValueError(f"'{root}' already holds an archive.")
+    schema = reader.table_schema(logger_type, table_name, num_sensors, measure_interval_min, **generator_args)
+    index = {
+        "format_version": FORMAT_VERSION,
+        "config": {"logger_type": logger_type, "table_name": table_name, "num_sensors": num_sensors,
+                   "measure_interval_min": measure_interval_min, **generator_args},
+        "columns": schema["columns"],
+        "units": {field["name"]: field["unit"] for field in schema["fields"]},
+        "chunks": {},
+    }
+    os.makedirs(os.path.join(root, CHUNKS_DIR), exist_ok=True)
+    _write_json(os.path.join(root, INDEX_FILE), index)
+    return index
+
+
+def open_archive(root):
+    """Reads an archive's index (archive.json)."""
+    with open(os.path.join(root, INDEX_FILE)) as f:
+        index = json.load(f)
+    if index.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"'{root}' has archive format {index.get('format_version')}; "
+                         f"expected {FORMAT_VERSION}.")
+    return index
+
+
+def archive_schema(index):
+    """The reader schema of the archived table, from the stored generator configuration."""
+    return reader.table_schema(**index["config"])
+
+
+# --- Ingest ---
+
+def _load_chunk(root, entry, columns):
+    path = os.path.join(root, CHUNKS_DIR, entry["dir"])
+    return {column: np.load(os.path.join(path, f"{column}.npy")) for column in columns}
+
+
+def _store_chunk(root, key, entry, data, columns):
+    """Writes a chunk's columns into a new version directory; returns the new index entry."""
+    version = entry["version"] + 1 if entry else 1
+    chunk_dir = f"{key}.{version}"
+    path = os.path.join(root, CHUNKS_DIR, chunk_dir)
+    if os.path.exists(path): # Left behind by an interrupted ingest
+        shutil.rmtree(path)
+    os.makedirs(path)
+    for column in columns:
+        np.save(os.path.join(path, f"{column}.npy"), data[column])
+    timestamps = data[reader.TIMESTAMP_FIELD]
+    return {"dir": chunk_dir, "version": version, "records": len(timestamps),
+            "first": str(timestamps[0].astype("M8[s]")), "last": str(timestamps[-1].astype("M8[s]"))}
+
+
+def ingest(root, paths, chunk_rows=reader.DEFAULT_CHUNK_ROWS, on_added=None):
+    """
+    Appends data files (TOA5 or TOB1) to an archive. Records whose TIMESTAMP is
+    already archived (e.g. from overlapping downloads) are skipped.
+
+    Args:
+        on_added (callable): Called with the records each time chunk gains
+            (column -> array, in time order), chunk by chunk in time order;
+            e.g. qc.check(). Called before the archive index is replaced.
+
+    Returns:
+        dict: 'records' read, 'added', 'duplicates', and 'chunks' (keys of the
+        time chunks written).
+    """
+    index = open_archive(root)
+    schema = archive_schema(index)
+    columns = index["columns"]
+    if schema["columns"] != columns:
+        raise ValueError(f"The archive's columns no longer match the generator configuration "
+                         f"{index['config']}; re-create the archive.")
+
+    pending = {} # key -> list of new record arrays, written once per ingest
+    stats = {"records": 0, "added": 0, "duplicates": 0, "chunks": []}
+    for path in paths:
+        for chunk in reader.iter_table_chunks(path, schema, chunk_rows):
+            stats["records"] += len(chunk)
+            keys = _chunk_key(chunk[reader.TIMESTAMP_FIELD])
+            for key in np.unique(keys):
+                pending.setdefault(str(key), []).append(chunk[keys == key])
+
+    old_dirs = []
+    for key in sorted(pending):
+        entry = index["chunks"].get(key)
+        new = np.concatenate(pending[key])
+        parts = [new[column] for column in columns]
+        if entry:
+            old = _load_chunk(root, entry, columns)
+            parts = [np.concatenate((old[column], part)) for column, part in zip(columns, parts)]
+        timestamps = parts[0]
+        # Stable sort keeps the first occurrence (archived before new) of a timestamp
+        order = np.argsort(timestamps, kind="stable")
+        sorted_timestamps = timestamps[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = sorted_timestamps[1:] != sorted_timestamps[:-1]
+        order = order[keep]
+        added = len(order) - (entry["records"] if entry else 0)
+        stats["duplicates"] += len(new) - added
+        if added == 0:
+            continue
+        data = {column: part[order] for column, part in zip(columns, parts)}
+        if on_added is not None:
+            is_new = order >= (entry["records"] if entry else 0)
+            on_added({column: values[is_new] for column, values in data.items()})
+        index["chunks"][key] = _store_chunk(root, key, entry, data, columns)
+        stats["added"] += added
+        stats["chunks"].append(key)
+        if entry:
+            old_dirs.append(entry["dir"])
+
+    _write_json(os.path.join(root, INDEX_FILE), index)
+    for chunk_dir in old_dirs:
+        shutil.rmtree(os.path.join(root, CHUNKS_DIR, chunk_dir), ignore_errors=True)
+    return stats
+
+
+# --- Range reads ---
+
+def read_range(root, start=None, end=None, columns=None):
+    """
+    Reads records with start <= TIMESTAMP < end, memory-mapping only the chunks
+    the range overlaps and only the requested columns.
+
+    Args:
+        root (str): Archive directory.
+        start, end (str or numpy.datetime64): Range bounds; None is open-ended.
+        columns (list): Column names (default: all). TIMESTAMP is always included.
+
+    Returns:
+        dict: column -> numpy array, in time order.
+    """
+    index = open_archive(root)
+    columns = [reader.TIMESTAMP_FIELD] + [column for column in (columns or index["columns"])
+                                          if column != reader.TIMESTAMP_FIELD]
+    unknown = [column for column in columns if column not in index["columns"]]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+    start = np.datetime64(start, "ns") if start is not None else None
+    end = np.datetime64(end, "ns") if end is not None else None
+
+    parts = {column: [] for column in columns}
+    for key in sorted(index["chunks"]):
+        entry = index["chunks"][key]
+        if (start is not None and np.datetime64(entry["last"], "ns") < start) or \
+                (end is not None and np.datetime64(entry["first"], "ns") >= end):
+            continue
+        path = os.path.join(root, CHUNKS_DIR, entry["dir"])
+        timestamps = np.load(os.path.join(path, f"{reader.TIMESTAMP_FIELD}.npy"), mmap_mode="r")
+        lo = 0 if start is None else np.searchsorted(timestamps, start, side="left")
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, side="left")
+        if lo >= hi:
+            continue
+        for column in columns:
+            values = np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+            parts[column].append(np.asarray(values[lo:hi]))
+    return {column: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMN_DTYPES.get(column, reader.VALUE_DTYPE))
+            for column, arrays in parts.items()}
+
+
+def archive_summary(index):
+    """Renders an archive index as one line per time chunk plus totals."""
+    config = index["config"]
+    lines = [f"Archive of {config['logger_type']} {config['table_name']} "
+             f"({config['num_sensors']} sensors, {config['measure_interval_min']} min, "
+             f"{len(index['columns'])} columns):",
+             f"  {'Chunk':<9}{'Records':>9}  {'First':<21}{'Last'}"]
+    total = 0
+    for key in sorted(index["chunks"]):
+        entry = index["chunks"][key]
+        lines.append(f"  {key:<9}{entry['records']:>9}  {entry['first']:<21}{entry['last']}")
+        total += entry["records"]
+    lines.append(f"  {'Total':<9}{total:>9}")
+    return "\n".join(lines)
@@ -0,0 +1,232 @@
+# src/bench.py
+
+import difflib
+import json
+import os
+import time
+import tracemalloc
+
+from src import scan_budget
+
+# Benchmark and regression suite for the generators.
+#
+# A sweep generates every configuration of logger type x sensor count x
+# interval. For each one it records the cost of generating (best wall time of a
+# few runs, peak traced memory) and the size of what is generated (lines,
+# bytes, DataTable fields, worst-case scan time). The results are compared with
+# a committed baseline (BASELINE_PATH). A metric that grows past its tolerance,
+# or a field count that changes at all, is a regression. The example programs in generated_programs/ serve as golden
+# outputs and must be reproduced byte for byte.
+
+BASELINE_PATH = "benchmarks/baseline.json"
+BASELINE_FORMAT_VERSION = 1
+
+# Sensor counts swept per logger type (the generators' limits)
+SENSOR_RANGES = {"CR200X": range(1, 9), "CR300": range(1, 63)}
+DEFAULT_INTERVALS = (15, 30, 60)
+DEFAULT_REPEAT = 3
+
+# metric -> (allowed ratio to the baseline, allowed absolute growth). A metric is
+# a regression when it exceeds both. The emitted code and scan time are exact;
+# wall time and memory depend on the machine and get some slack.
+METRIC_TOLERANCES = {
+    "ms": (2.0, 2.0),
+    "peak_kib": (1.25, 64.0),
+    "lines": (1.0, 0),
+    "bytes": (1.0, 0),
+    "fields": (1.0, 0),
+    "scan_s": (1.0, 0.05),
+}
+# Metrics that must not change in either direction: the fields are the logged
+# columns, which the readers and analyses downstream depend on
+EXACT_METRICS = ("fields",)
+
+# Lines of a golden-output diff shown per mismatching file
+GOLDEN_DIFF_LINES = 40
+
+
+def run_key(logger_type, num_sensors, interval_min):
+    """Baseline key of one configuration, e.g. 'CR300/5/30'."""
+    return f"{logger_type}/{num_sensors}/{interval_min}"
+
+
+def sweep_configs(logger_types, intervals=DEFAULT_INTERVALS):
+    """
+    Lists the configurations of a sweep.
+
+    Returns:
+        list: (logger_type, num_sensors, interval_min) tuples.
+    """
+    return [(logger_type, num_sensors, interval_min)
+            for logger_type in logger_types
+            for num_sensors in SENSOR_RANGES[logger_type]
+            for interval_min in intervals]
+
+
+def _consume(lines):
+    """Counts the lines and bytes of a program as write_output() would store it."""
+    num_lines = num_bytes = 0
+    for line in lines:
+        num_lines += line.count("\n") + 1 # An item may hold several lines
+        num_bytes += len(line.encode()) + 1
+    return num_lines, max(0, num_bytes - 1) # Lines are joined without a trailing newline
+
+
+def measure(module, logger_type, generator_args, repeat=DEFAULT_REPEAT):
+    """
+    Benchmarks one configuration of a generator module.
+
+    Args:
+        module: Generator module (iter_code, table_layout, scan_commands).
+        logger_type (str): Key into scan_budget.LATENCY_PROFILES.
+        generator_args (dict): Keyword arguments for iter_code.
+        repeat (int): Generation runs to time; the fastest counts.
+
+    Returns:
+        dict: 'ms' (best wall time), 'peak_kib' (peak memory traced while
+        generating), 'lines', 'bytes', 'fields' (DataTable fields over all tables),
+        'tables' and 'scan_s' (worst-case scan time).
+    """
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        num_lines, num_bytes = _consume(module.iter_code(**generator_args))
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        _consume(module.iter_code(**generator_args))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    tables = module.table_layout(**generator_args)
+    budget = scan_budget.estimate_scan(logger_type, module.scan_commands(**generator_args),
+                                       generator_args["measure_interval_min"])
+    return {
+        "ms": round(best * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "lines": num_lines,
+        "bytes": num_bytes,
+        "fields": sum(len(table["fields"]) for table in tables),
+        "tables": len(tables),
+        "scan_s": round(budget["total_s"], 2),
+    }
+
+
+def run_sweep(load_generator, configs, repeat=DEFAULT_REPEAT):
+    """
+    Benchmarks every configuration.
+
+    Args:
+        load_generator (callable): logger_type -> generator module.
+        configs (list): (logger_type, num_sensors, interval_min) tuples.
+
+    Returns:
+        dict: run_key() -> measure() result.
+    """
+    results = {}
+    for logger_type, num_sensors, interval_min in configs:
+        generator_args = {"num_sensors": num_sensors, "measure_interval_min": interval_min}
+        results[run_key(logger_type, num_sensors, interval_min)] = measure(
+            load_generator(logger_type), logger_type, generator_args, repeat)
+    return results
+
+
+# --- Baselines ---
+
+def load_baseline(path=BASELINE_PATH):
+    """Reads a baseline file; an empty dict if there is none yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("format_version") != BASELINE_FORMAT_VERSION:
+        raise ValueError(f"'{path}' has baseline format {baseline.get('format_version')}; "
+                         f"expected {BASELINE_FORMAT_VERSION}.")
+    return baseline["runs"]
+
+
+def save_baseline(results, path=BASELINE_PATH, merge_with=None):
+    """Writes results (over the runs of 'merge_with', if given) as the baseline."""
+    runs = {**(merge_with or {}), **results}
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"format_version": BASELINE_FORMAT_VERSION, "runs": dict(sorted(runs.items()))}, f, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def compare(results, baseline, timing=True):
+    """
+    Compares sweep results with a baseline.
+
+    Args:
+        timing (bool): Also check wall time (machine dependent; off on shared CI).
+
+    Returns:
+        tuple: (regressions, improvements, missing): lists of (key, metric,
+        baseline value, new value) and the keys without a baseline run. Smaller
+        programs and scan times are improvements; wall time and memory only regress.
+    """
+    regressions, improvements, missing = [], [], []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            missing.append(key)
+            continue
+        for metric, (ratio, absolute) in METRIC_TOLERANCES.items():
+            if metric == "ms" and not timing:
+                continue
+            old, new = base[metric], result[metric]
+            if (new > old * ratio and new - old > absolute) or (metric in EXACT_METRICS and new != old):
+                regressions.append((key, metric, old, new))
+            elif new < old and metric not in ("ms", "peak_kib"):
+                improvements.append((key, metric, old, new))
+    return regressions, improvements, missing
+
+
+def golden_diff(expected_path, lines):
+    """
+    Diffs a generated program against its committed golden file.
+
+    Returns:
+        list: Unified diff lines (empty if the output matches byte for byte).
+    """
+    generated = "\n".join(lines)
+    try:
+        with open(expected_path) as f:
+            expected = f.read()
+    except FileNotFoundError:
+        return [f"'{expected_path}' does not exist."]
+    if generated == expected:
+        return []
+    return list(difflib.unified_diff(expected.splitlines(), generated.splitlines(),
+                                     fromfile=expected_path, tofile="generated", lineterm=""))
+
+
+# --- Reports ---
+
+def format_results(results):
+    """Renders sweep results as one line per configuration."""
+    lines = [f"{'Run':<16}{'ms':>9}{'Peak KiB':>10}{'Lines':>8}{'Bytes':>9}{'Fields':>8}{'Tables':>8}{'Scan (s)':>10}"]
+    for key, r in results.items():
+        lines.append(f"{key:<16}{r['ms']:>9.2f}{r['peak_kib']:>10.1f}{r['lines']:>8}{r['bytes']:>9}"
+                     f"{r['fields']:>8}{r['tables']:>8}{r['scan_s']:>10.1f}")
+    return "\n".join(lines)
+
+
+def format_comparison(regressions, improvements, missing):
+    """Renders compare() output: regressions first, then improvements and runs without a baseline."""
+    lines = []
+    for title, changes in (("Regressions", regressions), ("Improvements", improvements)):
+        if changes:
+            lines.append(f"{title} ({len(changes)}):")
+            lines += [f"  {key:<16}{metric:<10}{old:>12g} -> {new:g}" for key, metric, old, new in changes]
+    if missing:
+        lines.append(f"No baseline for {len(missing)} run(s): {', '.join(missing[:10])}"
+                     + (", ..." if len(missing) > 10 else ""))
+    return "\n".join(lines)
@@ -0,0 +1,198 @@
+# src/cache.py
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# Content-addressed cache of generated programs.
+#
+# A program is keyed on a hash of (source of every module in the generator's
+# package, generate_code arguments, measurement configuration). The whole package
+# counts because generators emit values from the modules they import, e.g. the
+# SDI-12 waits in scan_budget and the limits in profiles and verifier. Cached
+# programs are stored as blobs
+# under objects/, and index.json remembers which output files were last written
+# from which key (with their size/mtime), so an unchanged station costs one
+# os.stat() instead of a regeneration and a rewrite.
+
+DEFAULT_CACHE_DIR = ".sapflux_cache"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024 # Total size of cached program blobs
+DEFAULT_MAX_ENTRIES = 4096
+INDEX_FILENAME = "index.json"
+
+# Module-level measurement configurations that feed the cache key when present
+MEASUREMENT_CONFIG_ATTRIBUTES = ("STANDARD_MEASUREMENTS", "DESIRED_MEASUREMENTS_CONFIG")
+
+_package_source_digests = {} # package directory -> sha256 of its module sources
+
+
+def _package_source_digest(module):
+    """Hashes the source files of every module in a generator's package, once per process."""
+    package_dir = os.path.dirname(os.path.abspath(module.__file__))
+    digest = _package_source_digests.get(package_dir)
+    if digest is None:
+        h = hashlib.sha256()
+        for name in sorted(os.listdir(package_dir)):
+            if name.endswith(".py"):
+                h.update(name.encode())
+                with open(os.path.join(package_dir, name), "rb") as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+        digest = h.hexdigest()
+        _package_source_digests[package_dir] = digest
+    return digest
+
+
+def cache_key(module, generator_args):
+    """
+    Computes the cache key for one generate_code call.
+
+    Args:
+        module: The generator module (e.g., src.cr300_generator).
+        generator_args (dict): All keyword arguments passed to generate_code.
+
+    Returns:
+        str: A hex sha256 digest.
+    """
+    h = hashlib.sha256()
+    h.update(module.__name__.encode())
+    h.update(_package_source_digest(module).encode())
+    h.update(json.dumps(generator_args, sort_keys=True, default=str).encode())
+    for attribute in MEASUREMENT_CONFIG_ATTRIBUTES:
+        if hasattr(module, attribute):
+            h.update(json.dumps(getattr(module, attribute), default=str).encode())
+    return h.hexdigest()
+
+
+def _stat_signature(path):
+    """(size, mtime_ns) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _atomic_write(path, data):
+    """Writes bytes to 'path' via a temporary file so readers never see partial content."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ProgramCache:
+    """
+    LRU, size-bounded store of generated programs and the outputs written from them.
+
+    Blob writes (put, put_file) are safe to call from batch worker processes; the index is
+    only read and written by the process that owns this object (call save()).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = None # Loaded lazily from index.json
+        self._dirty = False
+
+    # --- Index ---
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(os.path.join(self.cache_dir, INDEX_FILENAME)) as f:
+                    self._entries = json.load(f).get("entries", {})
+            except (FileNotFoundError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _touch(self, key):
+        self.entries[key]["last_used"] = time.time()
+        self._dirty = True
+
+    def save(self):
+        """Evicts down to the size bounds and writes the index, if anything changed."""
+        if not self._dirty:
+            return
+        self.evict()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        _atomic_write(os.path.join(self.cache_dir, INDEX_FILENAME),
+                      json.dumps({"entries": self.entries}, indent=1).encode())
+        self._dirty = False
+
+    def evict(self):
+        """Drops least recently used entries until both the byte and entry bounds hold."""
+        total_bytes = sum(entry["size"] for entry in self.entries.values())
+        by_age = sorted(self.entries, key=lambda k: self.entries[k]["last_used"])
+        for key in by_age:
+            if total_bytes <= self.max_bytes and len(self.entries) <= self.max_entries:
+                break
+            total_bytes -= self.entries.pop(key)["size"]
+            try:
+                os.remove(self.blob_path(key))
+            except FileNotFoundError:
+                pass
+            self._dirty = True
+
+    # --- Blobs ---
+
+    def blob_path(self, key):
+        return os.path.join(self.cache_dir, "objects", f"{key}.cr")
+
+    def put(self, key, generated_code):
+        """Stores a program blob. Returns its size in bytes (pass it to add())."""
+        os.makedirs(os.path.dirname(self.blob_path(key)), exist_ok=True)
+        data = generated_code.encode()
+        _atomic_write(self.blob_path(key), data)
+        return len(data)
+
+    def put_file(self, key, path):
+        """Stores an already written program file as the blob for 'key'. Returns its size."""
+        os.makedirs(os.path.dirname(self.blob_path(key)), exist_ok=True)
+        tmp_path = f"{self.blob_path(key)}.{os.getpid()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, self.blob_path(key))
+        return os.path.getsize(self.blob_path(key))
+
+    def add(self, key, size):
+        """Registers a blob written by put() or put_file() (possibly in another process)."""
+        self.entries.setdefault(key, {"size": size, "outputs": {}})["size"] = size
+        self._touch(key)
+
+    def get(self, key):
+        """Returns the cached program for 'key', or None on a miss."""
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.blob_path(key)) as f:
+                generated_code = f.read()
+        except FileNotFoundError:
+            del self.entries[key]
+            self._dirty = True
+            return None
+        self._touch(key)
+        return generated_code
+
+    # --- Outputs ---
+
+    def output_is_current(self, key, path):
+        """True if 'path' was last written from 'key' and has not changed since."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        recorded = entry["outputs"].get(os.path.abspath(path))
+        if recorded is None or recorded != _stat_signature(path):
+            return False
+        self._touch(key)
+        return True
+
+    def record_output(self, key, path):
+        """Remembers that 'path' now holds the program cached under 'key'."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry["outputs"][os.path.abspath(path)] = _stat_signature(path)
+            self._touch(key)
@@ -1,125 +1,660 @@
 # src/cr200x_generator.py
 
-# Constants specific to CR200X generation strategy
-MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR = 8
-MIN_MEASURE_INTERVAL_MINUTES_IMPLEX_CR200X = 15
+import functools
+import math
+
+from src.profiles import LOGGER_PROFILES
+from src.verifier import LIMIT_PROFILES
+
+# Constants specific to CR200X generation strategy (limits from the logger profile)
+PROFILE = LOGGER_PROFILES["CR200X"]
+MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR = PROFILE["max_sensors"]
+MAX_SENSORS_CR200X_PACKED = PROFILE["layout_max_sensors"]["packed"] # plan_tables() decides what fits
+MIN_MEASURE_INTERVAL_MINUTES_IMPLEX_CR200X = PROFILE["min_interval_min"]
+SDI12_PORT_CR200X = "SDI12" # SDI12Recorder on the CR200X takes no port argument (single SDI-12 terminal)
+
+# Scan-timing instrumentation (instrument=True): each sensor's SDI12Recorder call
+# is timed into Lat_S{n}, and the scan's process time and the logger's skipped-scan
+# and watchdog counters are logged with them to INSTRUMENT_TABLE_NAME on every
+# scan. The table takes one of the 8 table slots.
+INSTRUMENT_TABLE_NAME = "ScanDiag"
+SCAN_TIMER = 1
+SDI12_TIMER = 2
+INSTRUMENT_STATUS_FIELDS = {"SkippedScan": "Status.SkippedScan(1,1)", "WatchdogErr": "Status.WatchdogErrors(1,1)"}
+
+# The 9 standard values returned by the Implexx "M!" command: (alias_prefix, unit)
+STANDARD_MEASUREMENTS = [
+    ("SapFlwTot", "literPerHour"), ("VhOuter", "heatVelocity"),
+    ("VhInner", "heatVelocity"), ("AlphaOut", "logTRatio"),
+    ("AlphaIn", "logTRatio"), ("BetaOut", "logTRatio"),
+    ("BetaIn", "logTRatio"), ("tMaxTout", "second"),
+    ("tMaxTin", "second"),
+]
+
+# Program layouts:
+#   unrolled - one Table_S{n} per sensor: BattV_Min, id, SensorAddress{n} and the
+#              9 M! values. The table limit caps the program at 8 sensors.
+#   packed   - the measurements chosen with 'measurements' (any of the M!, M1!,
+#              M2! and M5! values) are bin-packed into as few tables as the
+#              16-field limit allows; BattV_Min and id are logged once. See plan_tables().
+#              As sensors share tables, more than 8 sensors fit when their values do
+#              (e.g. 14 sensors of the 9 M! values).
+LAYOUTS = ["unrolled", "packed"]
+TABLE_LIMITS = LIMIT_PROFILES["CR200X"]
+
+# The values of the other Implexx measurement commands, which only the packed
+# layout logs: command -> [(alias_prefix, unit)] in the order the command returns them.
+# Their alias prefixes are the CR300's SapFlowAll suffixes.
+EXTRA_MEASUREMENTS = {
+    "M1!": [("TpDsOut", "degC"), ("dTDsOut", "degC"), ("TsDsOut", "degC"),
+            ("TpUsOut", "degC"), ("dTUsOut", "degC"), ("TsUsOut", "degC")],
+    "M2!": [("TpDsInn", "degC"), ("dTDsInn", "degC"), ("TsDsInn", "degC"),
+            ("TpUsInn", "degC"), ("dTUsInn", "degC"), ("TsUsInn", "degC")],
+    "M5!": [("tMxTUsO", "second"), ("tMxTUsI", "second")],
+}
+MEASUREMENT_COMMANDS = {"M!": STANDARD_MEASUREMENTS, **EXTRA_MEASUREMENTS}
+# alias_prefix -> (command, 1-based index in the command's values, unit)
+MEASUREMENT_SOURCES = {alias_prefix: (sdi_cmd, j, unit)
+                       for sdi_cmd, values in MEASUREMENT_COMMANDS.items()
+                       for j, (alias_prefix, unit) in enumerate(values, start=1)}
+
+# Packed-layout tables: PACKED_TABLE_PREFIX1, 2, ... at the scan rate, and
+# Diag{K}_1, 2, ... for measurement groups decimated to every Kth scan. M! fires
+# the heat pulse that M1!/M2!/M5! report on, so it runs on every scan.
+PACKED_TABLE_PREFIX = "SapFlow"
+UNDECIMATED_COMMANDS = ["M!"]
+
+def get_sdi12_address_char(index):
+    addresses = PROFILE["sdi12_addresses"]
+    if 0 <= index < len(addresses): return addresses[index]
+    raise ValueError(f"Sensor index {index} out of range (0-{len(addresses) - 1}).") # Should be caught by main validation
+
+
+def _command_name(name):
+    """'m1' or 'M1!' -> 'M1!'."""
+    sdi_cmd = str(name).upper()
+    return sdi_cmd if sdi_cmd.endswith("!") else sdi_cmd + "!"
+
+
+def resolve_measurements(names=None):
+    """
+    Resolves the packed layout's 'measurements' option: alias prefixes (e.g.
+    SapFlwTot, TpDsOut), whole commands (M!, M1, ...) or 'all', in any case (the
+    CLI upper-cases them). Default: the 9 M! values.
+
+    Returns:
+        tuple: (list of alias prefixes in MEASUREMENT_SOURCES order, error message or None).
+    """
+    if not names:
+        return [alias_prefix for alias_prefix, _ in STANDARD_MEASUREMENTS], None
+    wanted = set()
+    by_upper = {alias_prefix.upper(): alias_prefix for alias_prefix in MEASUREMENT_SOURCES}
+    for name in names:
+        if str(name).lower() == "all":
+            wanted.update(MEASUREMENT_SOURCES)
+        elif str(name).upper() in by_upper:
+            wanted.add(by_upper[str(name).upper()])
+        elif _command_name(name) in MEASUREMENT_COMMANDS:
+            wanted.update(alias_prefix for alias_prefix, _ in MEASUREMENT_COMMANDS[_command_name(name)])
+        else:
+            return [], (f"Unknown measurement '{name}'. Choose among: all, {', '.join(MEASUREMENT_COMMANDS)} "
+                        f"or {', '.join(MEASUREMENT_SOURCES)}.")
+    return [alias_prefix for alias_prefix in MEASUREMENT_SOURCES if alias_prefix in wanted], None
+
+
+def resolve_decimation(decimation):
+    """
+    Normalizes a decimation mapping ({"M1": 4} or {"m1!": 4}) to every command's
+    collection period in scans (1 for every scan).
+
+    Returns:
+        tuple: (dict of command -> every K scans, error message or None).
+    """
+    every_scans = {sdi_cmd: 1 for sdi_cmd in MEASUREMENT_COMMANDS}
+    for name, every in (decimation or {}).items():
+        sdi_cmd = _command_name(name)
+        if sdi_cmd not in every_scans:
+            return every_scans, (f"Unknown measurement group '{name}' for decimation. "
+                                 f"Choose among: {', '.join(MEASUREMENT_COMMANDS)}.")
+        if isinstance(every, bool) or not isinstance(every, int) or every < 1:
+            return every_scans, f"Decimation of {sdi_cmd} must be a whole number of scans >= 1. Requested: {every}."
+        if sdi_cmd in UNDECIMATED_COMMANDS and every != 1:
+            return every_scans, f"{sdi_cmd} fires the heat pulse and must run on every scan."
+        every_scans[sdi_cmd] = every
+    return every_scans, None
+
+
+def sensor_commands(measurements=None):
+    """
+    The SDI-12 commands a packed-layout program issues to each sensor: M! (the
+    heat pulse) and each other command with a logged value.
+    """
+    logged, _ = resolve_measurements(measurements)
+    needed = {MEASUREMENT_SOURCES[alias_prefix][0] for alias_prefix in logged}
+    return [sdi_cmd for sdi_cmd in MEASUREMENT_COMMANDS if sdi_cmd == "M!" or sdi_cmd in needed]
+
+
+def scan_commands(num_sensors, measure_interval_min, layout="unrolled", measurements=None, **kwargs):
+    """
+    Lists the SDI-12 commands one scan of the generated program issues, in order,
+    as (port, address_char, command) tuples. Used by the scan-time budget model.
+    """
+    per_sensor = sensor_commands(measurements) if layout == "packed" else ["M!"]
+    return [(SDI12_PORT_CR200X, get_sdi12_address_char(i), sdi_cmd)
+            for i in range(num_sensors) for sdi_cmd in per_sensor]
+
+
+def command_every_scans(layout="unrolled", decimation=None, **kwargs):
+    """
+    How often each command of scan_commands() runs, in scans: M! on every scan,
+    the packed layout's other commands as decimated. An invalid decimation counts as none.
+    """
+    if layout != "packed":
+        return {"M!": 1}
+    return resolve_decimation(decimation)[0]
+
+
+def packed_table_name(every, number):
+    """Name of the number-th packed table of the measurements collected every 'every' scans."""
+    return f"{PACKED_TABLE_PREFIX}{number}" if every == 1 else f"Diag{every}_{number}"
+
+
+def _first_fit_decreasing(blocks, capacity):
+    """Packs (key, fields) blocks of at most 'capacity' fields into as few bins as first fit finds."""
+    bins = []
+    for block in sorted(blocks, key=lambda block: -len(block[1])):
+        for packed in bins:
+            if sum(len(fields) for _, fields in packed) + len(block[1]) <= capacity:
+                packed.append(block)
+                break
+        else:
+            bins.append([block])
+    return bins
+
+
+def _fill(blocks, capacity):
+    """Packs (key, fields) blocks in key order into full bins, splitting blocks across bins."""
+    fields = [(key, field) for key, block in sorted(blocks, key=lambda block: block[0]) for field in block]
+    return [[(key, [field]) for key, field in fields[start:start + capacity]]
+            for start in range(0, len(fields), capacity)]
+
+
+def packed_variable_count(num_sensors, measurements=None, decimation=None, instrument=False):
+    """
+    Values a packed-layout program declares with Public/Dim, counted the way the
+    verifier counts them (each array element is one): N, BattV, id, each sensor's
+    command arrays, the decimation counter and flags, and the instrumentation timers.
+    """
+    commands = sensor_commands(measurements)
+    every_scans, _ = resolve_decimation(decimation)
+    decimated = [sdi_cmd for sdi_cmd in commands if every_scans[sdi_cmd] > 1]
+    count = 3 + num_sensors * sum(len(MEASUREMENT_COMMANDS[sdi_cmd]) for sdi_cmd in commands)
+    if decimated:
+        count += 1 + len(decimated)
+    if instrument:
+        count += 1 + len(INSTRUMENT_STATUS_FIELDS) + num_sensors
+    return count
+
+
+def plan_tables(num_sensors, measure_interval_min, measurements=None, decimation=None, instrument=False):
+    """
+    Plans the tables of a packed-layout program.
+
+    The logged values of each sensor form one block per collection period; BattV_Min
+    and id form a block of their own in the scan-rate group. Each period's blocks
+    are packed into tables of TABLE_LIMITS['max_fields_per_table'] fields by first
+    fit decreasing, which keeps a sensor's values together (a block larger than a
+    table is split first). If that needs more tables than the logger holds, the
+    blocks are instead split across completely filled tables. An instrumented
+    program's INSTRUMENT_TABLE_NAME table takes one of the tables and must fit
+    its own fields (one latency per sensor) in one table. A configuration whose
+    declared values (packed_variable_count()) or Alias lines (one per logged
+    sensor value) exceed TABLE_LIMITS is rejected before any table is planned.
+
+    Returns:
+        tuple: (tables in table_layout() form, error message or None). Within a
+        table the fields are in sensor order, the logger's own values first.
+    """
+    logged, error = resolve_measurements(measurements)
+    every_scans, decimation_error = resolve_decimation(decimation)
+    error = error or decimation_error
+    if error:
+        return [], error
+    capacity = TABLE_LIMITS["max_fields_per_table"]
+    max_tables = TABLE_LIMITS["max_tables"] - (1 if instrument else 0)
+    if instrument and len(instrument_fields(num_sensors)) > capacity:
+        fixed = len(instrument_fields(0))
+        return [], (f"The {INSTRUMENT_TABLE_NAME} table of an instrumented program holds {fixed} fields plus a "
+                    f"latency per sensor, {fixed + num_sensors} in all; a CR200X table holds {capacity}. "
+                    f"Use at most {capacity - fixed} sensors with instrument.")
+    num_variables = packed_variable_count(num_sensors, measurements, decimation, instrument)
+    if num_variables > TABLE_LIMITS["max_variables"]:
+        return [], (f"{num_sensors} sensors need {num_variables} variables (every value of each SDI-12 command "
+                    f"they run); the CR200X holds {TABLE_LIMITS['max_variables']}. "
+                    "Log fewer sensors or the values of fewer commands.")
+    if num_sensors * len(logged) > TABLE_LIMITS["max_aliases"]:
+        return [], (f"{num_sensors} sensors of {len(logged)} logged values need {num_sensors * len(logged)} "
+                    f"Alias declarations; the CR200X holds {TABLE_LIMITS['max_aliases']}. "
+                    "Log fewer measurements or sensors.")
+
+    groups = {} # every K scans -> [(key, fields)]
+    for alias_prefix in logged:
+        groups.setdefault(every_scans[MEASUREMENT_SOURCES[alias_prefix][0]], [])
+    periods = sorted(groups)
+    groups[periods[0]].append(((-1, 0), [
+        {"name": "BattV_Min", "data_type": "IEEE4", "unit": "Volts", "sensor": None, "measurement": None},
+        {"name": "id", "data_type": "IEEE4", "unit": None, "sensor": None, "measurement": None},
+    ]))
+    for i in range(num_sensors):
+        sdi_address_char = get_sdi12_address_char(i)
+        fields = {}
+        for alias_prefix in logged:
+            sdi_cmd, _, unit = MEASUREMENT_SOURCES[alias_prefix]
+            fields.setdefault(every_scans[sdi_cmd], []).append(
+                {"name": f"{alias_prefix}{sdi_address_char}", "data_type": "IEEE4", "unit": unit,
+                 "sensor": sdi_address_char, "measurement": alias_prefix})
+        for every, block in fields.items():
+            groups[every] += [((i, start), block[start:start + capacity]) for start in range(0, len(block), capacity)]
+
+    bins = {every: _first_fit_decreasing(groups[every], capacity) for every in periods}
+    if sum(len(packed) for packed in bins.values()) > max_tables:
+        bins = {every: _fill(groups[every], capacity) for every in periods}
+    needed = sum(len(packed) for packed in bins.values())
+    if needed > max_tables:
+        num_fields = sum(len(fields) for blocks in groups.values() for _, fields in blocks)
+        return [], (f"{num_fields} fields need {needed} tables of {capacity}; the CR200X holds "
+                    f"{TABLE_LIMITS['max_tables']}" + (f" (one is the {INSTRUMENT_TABLE_NAME} table)" if instrument else "")
+                    + ". Log fewer measurements or sensors, or decimate groups into shared tables.")
+
+    tables = []
+    for every in periods:
+        ordered = sorted((sorted(packed, key=lambda block: block[0]) for packed in bins[every]),
+                         key=lambda packed: packed[0][0])
+        for number, packed in enumerate(ordered, start=1):
+            tables.append({"name": packed_table_name(every, number), "interval_min": measure_interval_min * every,
+                           "fields": [field for _, fields in packed for field in fields]})
+    return tables, None
+
+
+def instrument_fields(num_sensors):
+    """Fields of the INSTRUMENT_TABLE_NAME table, in table_layout() form."""
+    fields = [{"name": "ProcTime_ms", "data_type": "IEEE4", "unit": "ms", "sensor": None, "measurement": None}]
+    fields += [{"name": name, "data_type": "IEEE4", "unit": "count", "sensor": None, "measurement": None}
+               for name in INSTRUMENT_STATUS_FIELDS]
+    for i in range(num_sensors):
+        sdi_address_char = get_sdi12_address_char(i)
+        fields.append({"name": f"Lat_S{sdi_address_char}", "data_type": "IEEE4", "unit": "ms",
+                       "sensor": sdi_address_char, "measurement": "Lat"})
+    return fields
+
+
+def table_layout(num_sensors, measure_interval_min, instrument=False, layout="unrolled", measurements=None,
+                 decimation=None, **kwargs):
+    """
+    Describes the data tables the generated program writes: one Table_S{n} per
+    sensor, or the tables of plan_tables() in the packed layout (none if the
+    plan fails). The CR200X has no storage type option; every field takes 4 bytes.
+
+    Returns:
+        list: One dict per table with 'name', 'interval_min' and 'fields', a list of
+        {'name', 'data_type', 'unit', 'sensor', 'measurement'} dicts in column order.
+    """
+    tables = []
+    if layout == "packed":
+        tables, error = plan_tables(num_sensors, measure_interval_min, measurements, decimation, instrument)
+        if error:
+            return []
+    else:
+        for i in range(num_sensors):
+            sdi_address_char = get_sdi12_address_char(i)
+            fields = [
+                {"name": "BattV_Min", "data_type": "IEEE4", "unit": "Volts", "sensor": None, "measurement": None},
+                {"name": "id", "data_type": "IEEE4", "unit": None, "sensor": None, "measurement": None},
+                {"name": f"SensorAddress{sdi_address_char}", "data_type": "IEEE4", "unit": None,
+                 "sensor": sdi_address_char, "measurement": None},
+            ]
+            for alias_prefix, unit in STANDARD_MEASUREMENTS:
+                fields.append({"name": f"{alias_prefix}{sdi_address_char}", "data_type": "IEEE4",
+                               "unit": unit, "sensor": sdi_address_char, "measurement": alias_prefix})
+            tables.append({"name": f"Table_S{sdi_address_char}", "interval_min": measure_interval_min,
+                           "fields": fields})
+    if instrument:
+        tables.append({"name": INSTRUMENT_TABLE_NAME, "interval_min": measure_interval_min,
+                       "fields": instrument_fields(num_sensors)})
+    return tables
+
+
+@functools.cache
+def emission_templates():
+    """
+    The per-sensor blocks of the program as format strings, compiled once per
+    process (see profiles.load_profile()). Fields: {a} (SDI-12 address), {i}
+    (sensor index), {n} (error-handling loop counter) and {interval}.
+
+    Returns:
+        dict: Block name -> format string; 'collect' is the SDI-12 call alone and
+        'collect_instrumented' adds the Timer lines that log its latency to Lat_S{a}.
+    """
+    aliases = [f"{alias_prefix}{{a}}" for alias_prefix, _ in STANDARD_MEASUREMENTS]
+    collect = [
+        "\t\t' --- Collect standard data for Sensor {a} (Address \"{a}\") ---",
+        "\t\tSDI12Recorder(SDIData_Sensor{a}(), \"{a}M!\", 1, 0)",
+        "\t\t'Reset all Generic SDI-12 Sensor measurements if NAN is returned to the first element",
+        "\t\tIf SDIData_Sensor{a}(1) = NAN Then",
+        "\t\t\tFor {n} = 1 To 9",
+        "\t\t\t\tSDIData_Sensor{a}({n}) = NAN",
+        "\t\t\tNext",
+        "\t\tEndIf\n",
+    ]
+    collect_instrumented = collect[:1] + [f"\t\tTimer({SDI12_TIMER},mSec,2)", collect[1],
+                                          f"\t\tLat_S{{a}} = Timer({SDI12_TIMER},mSec,4)"] + collect[2:]
+    return {
+        "loop_counter": "Dim N_{a} ' Loop counter for Sensor {a} error handling",
+        "variables": "Public SDIData_Sensor{a}(9)\nPublic SensorAddress{a}",
+        "aliases": "\n".join(f"Alias SDIData_Sensor{{a}}({j}) = {alias}" for j, alias in enumerate(aliases, start=1)),
+        "units": "\n".join(f"Units {alias}={unit}" for alias, (_, unit) in zip(aliases, STANDARD_MEASUREMENTS)),
+        "table": "\n".join(["DataTable(Table_S{a},True,-1)",
+                            "\tDataInterval(0,{interval},Min)",
+                            "\tMinimum(1,BattV,False,False)",
+                            "\tSample(1,id)",
+                            "\tSample(1,SensorAddress{a})",
+                            *(f"\tSample(1,{alias})" for alias in aliases),
+                            "EndTable\n"]),
+        "address": "\t\tSensorAddress{a} = {i}",
+        "collect": "\n".join(collect),
+        "collect_instrumented": "\n".join(collect_instrumented),
+        "call_table": "\t\tCallTable Table_S{a}",
+    }
+
 
 # This is the function that main.py will call
-def generate_code(num_sensors, measure_interval_min, **kwargs):
+def iter_code(num_sensors, measure_interval_min, **kwargs):
     """
-    Generates CRBasic code for CR200/CR200X dataloggers.
+    Generates CRBasic code for CR200/CR200X dataloggers, yielding it line by line
+    (a yielded item may hold several lines). Join the items with "\n" for the full
+    program. On invalid input a single "' Error ..." line is yielded instead.
+    layout="packed" (with 'measurements' and 'decimation') logs into the tables
+    planned by plan_tables() instead of one table per sensor.
     """
     # --- Module-specific Validation ---
-    if not (1 <= num_sensors <= MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR):
-        return (f"' Error in cr200x_generator: Number of sensors must be between 1 and "
+    layout = kwargs.get("layout", "unrolled")
+    if layout == "packed" and not (1 <= num_sensors <= MAX_SENSORS_CR200X_PACKED):
+        yield (f"' Error in cr200x_generator: Number of sensors must be between 1 and "
+               f"{MAX_SENSORS_CR200X_PACKED} for CR200X with the packed layout.")
+        return
+    if layout != "packed" and not (1 <= num_sensors <= MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR):
+        yield (f"' Error in cr200x_generator: Number of sensors must be between 1 and "
                 f"{MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} for CR200X with one table per sensor strategy.")
+        return
+    if kwargs.get("sdi12_mode", "sequential") != "sequential":
+        yield "' Error in cr200x_generator: Only the sequential SDI-12 mode is supported on the CR200X."
+        return
+    if kwargs.get("sdi12_ports"):
+        yield "' Error in cr200x_generator: The CR200X has a single SDI-12 port; sdi12_ports is not supported."
+        return
+    if layout not in LAYOUTS:
+        yield f"' Error in cr200x_generator: Unknown layout '{layout}'. Choose one of: {', '.join(LAYOUTS)}."
+        return
+    if kwargs.get("fp2_measurements"):
+        yield "' Error in cr200x_generator: CR200X tables have no storage type option; fp2_measurements is not supported."
+        return
+    instrument = kwargs.get("instrument", False)
+    if layout == "packed":
+        tables, error = plan_tables(num_sensors, measure_interval_min, kwargs.get("measurements"),
+                                    kwargs.get("decimation"), instrument)
+        if error:
+            yield f"' Error in cr200x_generator: {error}"
+            return
+        yield from _iter_packed_code(num_sensors, measure_interval_min, tables, kwargs.get("measurements"),
+                                     kwargs.get("decimation"), instrument)
+        return
+    if kwargs.get("measurements"):
+        yield "' Error in cr200x_generator: The unrolled layout logs the 9 M! values; measurements needs the packed layout."
+        return
+    if any(every != 1 for every in (kwargs.get("decimation") or {}).values()):
+        yield ("' Error in cr200x_generator: The unrolled layout only runs M!, which must run every scan; "
+               "decimation needs the packed layout.")
+        return
+    if instrument and num_sensors >= MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR:
+        yield (f"' Error in cr200x_generator: The {INSTRUMENT_TABLE_NAME} table of an instrumented program takes one of "
+               f"the {MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} tables; use at most "
+               f"{MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR - 1} sensors with instrument.")
+        return
     # Note: Interval warning/error is handled by main_cli.py for consistency,
     # but could also be strictly enforced here.
 
     # --- Start of CR200X Generation Logic (from your previous working script) ---
-    standard_measurements = [
-        ("SapFlwTot", "literPerHour"), ("VhOuter", "heatVelocity"),
-        ("VhInner", "heatVelocity"), ("AlphaOut", "logTRatio"),
-        ("AlphaIn", "logTRatio"), ("BetaOut", "logTRatio"),
-        ("BetaIn", "logTRatio"), ("tMaxTout", "second"),
-        ("tMaxTin", "second"),
-    ]
+    # The per-sensor blocks come from the compiled templates
+    templates = emission_templates()
+    addresses = [get_sdi12_address_char(i) for i in range(num_sensors)]
 
-    def get_sdi12_address_char(index):
-        if 0 <= index <= 7: return str(index)
-        raise ValueError(f"Sensor index {index} out of range (0-7).") # Should be caught by main validation
-
-    crbasic_code_list = []
-    crbasic_code_list.append("' CR200/CR200X Series")
-    crbasic_code_list.append("' Program to log standard data from Implexx Sap Flow Sensors")
-    crbasic_code_list.append("' Generated by Python Script (cr200x_generator.py)")
-    crbasic_code_list.append(f"' Number of Sensors: {num_sensors}")
-    crbasic_code_list.append(f"' Measurement Interval: {measure_interval_min} minutes")
-    crbasic_code_list.append("' NOTE: This program uses one DataTable per sensor.")
-    crbasic_code_list.append(f"' CR200X supports a maximum of {MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} DataTables with this strategy.")
-    crbasic_code_list.append("")
-
-    crbasic_code_list.append("'--- Declare Variables and Units ---")
+    yield "' CR200/CR200X Series"
+    yield "' Program to log standard data from Implexx Sap Flow Sensors"
+    yield "' Generated by Python Script (cr200x_generator.py)"
+    yield f"' Number of Sensors: {num_sensors}"
+    yield f"' Measurement Interval: {measure_interval_min} minutes"
+    yield "' NOTE: This program uses one DataTable per sensor."
+    yield f"' CR200X supports a maximum of {MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} DataTables with this strategy."
+    if instrument:
+        yield f"' Instrumented: SDI-12 call latency and scan timing logged to {INSTRUMENT_TABLE_NAME}"
+    yield ""
+
+    yield "'--- Declare Variables and Units ---"
     if num_sensors == 1:
-        crbasic_code_list.append("Dim N")
+        yield "Dim N"
     else:
+        for a in addresses:
+            yield templates["loop_counter"].format(a=a)
+    yield "Public BattV"
+    yield "Public id"
+    for a in addresses:
+        yield templates["variables"].format(a=a)
+    if instrument:
+        yield "Public ProcTime_ms"
+        for name in INSTRUMENT_STATUS_FIELDS:
+            yield f"Public {name}"
         for i in range(num_sensors):
-            sdi_address_char = get_sdi12_address_char(i)
-            crbasic_code_list.append(f"Dim N_{sdi_address_char} ' Loop counter for Sensor {sdi_address_char} error handling")
-    crbasic_code_list.append("Public BattV")
-    crbasic_code_list.append("Public id")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        crbasic_code_list.append(f"Public SDIData_Sensor{sdi_address_char}(9)")
-        crbasic_code_list.append(f"Public SensorAddress{sdi_address_char}")
+            yield f"Public Lat_S{get_sdi12_address_char(i)}"
 
-    crbasic_code_list.append("\n'--- Alias Declarations (Maps array elements to meaningful names) ---")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        for j in range(len(standard_measurements)):
-            alias_name = f"{standard_measurements[j][0]}{sdi_address_char}"
-            crbasic_code_list.append(f"Alias SDIData_Sensor{sdi_address_char}({j+1}) = {alias_name}")
+    yield "\n'--- Alias Declarations (Maps array elements to meaningful names) ---"
+    for a in addresses:
+        yield templates["aliases"].format(a=a)
 
-    crbasic_code_list.append("\n'--- Units Declarations ---")
-    crbasic_code_list.append("Units BattV=Volts")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        for j in range(len(standard_measurements)):
-            alias_name = f"{standard_measurements[j][0]}{sdi_address_char}"
-            unit = standard_measurements[j][1]
-            crbasic_code_list.append(f"Units {alias_name}={unit}")
-
-    crbasic_code_list.append("\n'--- Define Data Tables (One table per sensor due to CR200X field limit) ---")
-    crbasic_code_list.append(f"' Note: CR200X dataloggers have a limit of 16 fields per table and {MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} tables total.")
-    crbasic_code_list.append("' DataTable names must be <= 12 characters.")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        table_name = f"Table_S{sdi_address_char}"
-        crbasic_code_list.append(f"DataTable({table_name},True,-1)")
-        crbasic_code_list.append(f"\tDataInterval(0,{measure_interval_min},Min)")
-        crbasic_code_list.append("\tMinimum(1,BattV,False,False)")
-        crbasic_code_list.append("\tSample(1,id)")
-        crbasic_code_list.append(f"\tSample(1,SensorAddress{sdi_address_char})")
-        for j in range(len(standard_measurements)):
-            alias_name = f"{standard_measurements[j][0]}{sdi_address_char}"
-            crbasic_code_list.append(f"\tSample(1,{alias_name})")
-        crbasic_code_list.append("EndTable\n")
-
-    crbasic_code_list.append("\n'--- Main Program ---")
-    crbasic_code_list.append("BeginProg")
-    crbasic_code_list.append(f"\tScan({measure_interval_min},Min)")
-    crbasic_code_list.append("\t\t'Default CR200 Series Datalogger Battery Voltage measurement 'BattV'")
-    crbasic_code_list.append("\t\tBattery(BattV)")
-    crbasic_code_list.append("\t\t'User Entered Calculation (from example)")
-    crbasic_code_list.append("\t\tid = Status.PakBusAddress(1,1)")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        crbasic_code_list.append(f"\t\tSensorAddress{sdi_address_char} = {i}")
-    crbasic_code_list.append("")
+    yield "\n'--- Units Declarations ---"
+    yield "Units BattV=Volts"
+    for a in addresses:
+        yield templates["units"].format(a=a)
+
+    yield "\n'--- Define Data Tables (One table per sensor due to CR200X field limit) ---"
+    yield f"' Note: CR200X dataloggers have a limit of 16 fields per table and {MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR} tables total."
+    yield "' DataTable names must be <= 12 characters."
+    for a in addresses:
+        yield templates["table"].format(a=a, interval=measure_interval_min)
+    if instrument:
+        yield "'Scan timing diagnostics (a record on every scan)"
+        yield f"DataTable({INSTRUMENT_TABLE_NAME},True,-1)"
+        for field in instrument_fields(num_sensors):
+            yield f"\tSample(1,{field['name']})"
+        yield "EndTable\n"
+
+    yield "\n'--- Main Program ---"
+    yield "BeginProg"
+    yield f"\tScan({measure_interval_min},Min)"
+    if instrument:
+        yield f"\t\tTimer({SCAN_TIMER},mSec,2)"
+    yield "\t\t'Default CR200 Series Datalogger Battery Voltage measurement 'BattV'"
+    yield "\t\tBattery(BattV)"
+    yield "\t\t'User Entered Calculation (from example)"
+    yield "\t\tid = Status.PakBusAddress(1,1)"
+    for i, a in enumerate(addresses):
+        yield templates["address"].format(a=a, i=i)
+    yield ""
+
+    collect = templates["collect_instrumented" if instrument else "collect"]
+    for a in addresses:
+        yield collect.format(a=a, n="N" if num_sensors == 1 else f"N_{a}")
+
+    yield "\t\t'Call Data Tables and Store Data"
+    for a in addresses:
+        yield templates["call_table"].format(a=a)
+    if instrument:
+        yield f"\t\tProcTime_ms = Timer({SCAN_TIMER},mSec,4)"
+        for name, status_field in INSTRUMENT_STATUS_FIELDS.items():
+            yield f"\t\t{name} = {status_field}"
+        yield f"\t\tCallTable {INSTRUMENT_TABLE_NAME}"
+
+    yield "\tNextScan"
+    yield "EndProg"
+
+
+def command_array_name(sdi_address_char, sdi_cmd):
+    """Array a sensor's SDI12Recorder call for a command fills, e.g. SDIData_Sensor0 or SDIDataM1_Sensor0."""
+    return f"SDIData{'' if sdi_cmd == 'M!' else sdi_cmd.rstrip('!')}_Sensor{sdi_address_char}"
+
+
+def decimation_flag(sdi_cmd):
+    """Variable set at the start of a scan when a decimated command is due (e.g. Run_M1)."""
+    return f"Run_{sdi_cmd.rstrip('!')}"
 
-    for i in range(num_sensors):
-        sdi_address_char_cmd = get_sdi12_address_char(i)
-        sdi_address_char_var = get_sdi12_address_char(i)
-        loop_counter = "N" if num_sensors == 1 else f"N_{sdi_address_char_var}"
-        crbasic_code_list.append(f"\t\t' --- Collect standard data for Sensor {sdi_address_char_cmd} (Address \"{sdi_address_char_cmd}\") ---")
-        crbasic_code_list.append(f"\t\tSDI12Recorder(SDIData_Sensor{sdi_address_char_var}(), \"{sdi_address_char_cmd}M!\", 1, 0)")
-        crbasic_code_list.append(f"\t\t'Reset all Generic SDI-12 Sensor measurements if NAN is returned to the first element")
-        crbasic_code_list.append(f"\t\tIf SDIData_Sensor{sdi_address_char_var}(1) = NAN Then")
-        crbasic_code_list.append(f"\t\t\tFor {loop_counter} = 1 To 9")
-        crbasic_code_list.append(f"\t\t\t\tSDIData_Sensor{sdi_address_char_var}({loop_counter}) = NAN")
-        crbasic_code_list.append(f"\t\t\tNext")
-        crbasic_code_list.append(f"\t\tEndIf\n")
-
-    crbasic_code_list.append("\t\t'Call Data Tables and Store Data")
-    for i in range(num_sensors):
-        sdi_address_char = get_sdi12_address_char(i)
-        table_name = f"Table_S{sdi_address_char}"
-        crbasic_code_list.append(f"\t\tCallTable {table_name}")
 
-    crbasic_code_list.append("\tNextScan")
-    crbasic_code_list.append("EndProg")
+def _iter_packed_code(num_sensors, measure_interval_min, tables, measurements, decimation, instrument):
+    """The program of the packed layout, for the tables planned by plan_tables()."""
+    addresses = [get_sdi12_address_char(i) for i in range(num_sensors)]
+    commands = sensor_commands(measurements)
+    every_scans, _ = resolve_decimation(decimation)
+    decimated = [sdi_cmd for sdi_cmd in commands if every_scans[sdi_cmd] > 1]
+    logged = [field for table in tables for field in table["fields"] if field["sensor"] is not None]
+    num_fields = sum(len(table["fields"]) for table in tables)
 
-    return "\n".join(crbasic_code_list)
+    yield "' CR200/CR200X Series"
+    yield "' Program to log data from Implexx Sap Flow Sensors"
+    yield "' Generated by Python Script (cr200x_generator.py)"
+    yield f"' Number of Sensors: {num_sensors}"
+    yield f"' Measurement Interval: {measure_interval_min} minutes"
+    yield f"' SDI-12 commands per sensor: {', '.join(commands)}"
+    for sdi_cmd in decimated:
+        yield f"' {sdi_cmd} values are collected every {every_scans[sdi_cmd]} scans"
+    yield (f"' NOTE: This program packs its {num_fields} fields into {len(tables)} of the "
+           f"{TABLE_LIMITS['max_tables']} DataTables (max {TABLE_LIMITS['max_fields_per_table']} fields each).")
+    yield "' Field-to-table map:"
+    for table in tables:
+        yield f"'   {table['name']} ({table['interval_min']} min): {', '.join(field['name'] for field in table['fields'])}"
+    if instrument:
+        yield f"' Instrumented: SDI-12 call latency and scan timing logged to {INSTRUMENT_TABLE_NAME}"
+    yield ""
+
+    yield "'--- Declare Variables and Units ---"
+    yield "Dim N"
+    yield "Public BattV"
+    yield "Public id"
+    for a in addresses:
+        for sdi_cmd in commands:
+            yield f"Public {command_array_name(a, sdi_cmd)}({len(MEASUREMENT_COMMANDS[sdi_cmd])})"
+    if decimated:
+        yield "Public ScanCount ' Scans into the decimation cycle"
+        for sdi_cmd in decimated:
+            yield f"Public {decimation_flag(sdi_cmd)}"
+    if instrument:
+        yield "Public ProcTime_ms"
+        for name in INSTRUMENT_STATUS_FIELDS:
+            yield f"Public {name}"
+        for a in addresses:
+            yield f"Public Lat_S{a}"
+
+    yield "\n'--- Alias Declarations (Maps the logged array elements to meaningful names) ---"
+    for field in logged:
+        sdi_cmd, index, _ = MEASUREMENT_SOURCES[field["measurement"]]
+        yield f"Alias {command_array_name(field['sensor'], sdi_cmd)}({index}) = {field['name']}"
+
+    yield "\n'--- Units Declarations ---"
+    yield "Units BattV=Volts"
+    for field in logged:
+        yield f"Units {field['name']}={field['unit']}"
+
+    yield "\n'--- Define Data Tables (Fields packed into tables by the table planner) ---"
+    yield (f"' Note: CR200X dataloggers have a limit of {TABLE_LIMITS['max_fields_per_table']} fields per table "
+           f"and {TABLE_LIMITS['max_tables']} tables total.")
+    yield "' DataTable names must be <= 12 characters."
+    for table in tables:
+        yield f"DataTable({table['name']},True,-1)"
+        if table["interval_min"] == measure_interval_min:
+            yield f"\tDataInterval(0,{measure_interval_min},Min)"
+        else:
+            yield "\t' No DataInterval: a record is stored on each scan that calls the table"
+        for field in table["fields"]:
+            if field["name"] == "BattV_Min":
+                yield "\tMinimum(1,BattV,False,False)"
+            else:
+                yield f"\tSample(1,{field['name']})"
+        yield "EndTable\n"
+    if instrument:
+        yield "'Scan timing diagnostics (a record on every scan)"
+        yield f"DataTable({INSTRUMENT_TABLE_NAME},True,-1)"
+        for field in instrument_fields(num_sensors):
+            yield f"\tSample(1,{field['name']})"
+        yield "EndTable\n"
+
+    yield "\n'--- Main Program ---"
+    yield "BeginProg"
+    yield f"\tScan({measure_interval_min},Min)"
+    if instrument:
+        yield f"\t\tTimer({SCAN_TIMER},mSec,2)"
+    if decimated:
+        yield "\t\t'Decimated measurement groups due on this scan"
+        for sdi_cmd in decimated:
+            yield f"\t\t{decimation_flag(sdi_cmd)} = (ScanCount MOD {every_scans[sdi_cmd]} = 0)"
+        yield "\t\tScanCount = ScanCount + 1"
+        yield f"\t\tIf ScanCount >= {math.lcm(*(every_scans[sdi_cmd] for sdi_cmd in decimated))} Then ScanCount = 0"
+    yield "\t\t'Default CR200 Series Datalogger Battery Voltage measurement 'BattV'"
+    yield "\t\tBattery(BattV)"
+    yield "\t\tid = Status.PakBusAddress(1,1)"
+    yield ""
+
+    for a in addresses:
+        yield f"\t\t' --- Collect data for Sensor {a} (Address \"{a}\") ---"
+        if instrument:
+            yield f"\t\tTimer({SDI12_TIMER},mSec,2)"
+        for sdi_cmd in commands:
+            array = command_array_name(a, sdi_cmd)
+            indent = "\t\t\t" if sdi_cmd in decimated else "\t\t"
+            if sdi_cmd in decimated:
+                yield f"\t\tIf {decimation_flag(sdi_cmd)} Then"
+            yield f"{indent}SDI12Recorder({array}(), \"{a}{sdi_cmd}\", 1, 0)"
+            yield f"{indent}If {array}(1) = NAN Then"
+            yield f"{indent}\tFor N = 1 To {len(MEASUREMENT_COMMANDS[sdi_cmd])}"
+            yield f"{indent}\t\t{array}(N) = NAN"
+            yield f"{indent}\tNext"
+            yield f"{indent}EndIf"
+            if sdi_cmd in decimated:
+                yield "\t\tEndIf"
+        if instrument:
+            yield f"\t\tLat_S{a} = Timer({SDI12_TIMER},mSec,4)"
+        yield ""
+
+    yield "\t\t'Call Data Tables and Store Data"
+    for table in tables:
+        every = table["interval_min"] // measure_interval_min
+        if every == 1:
+            yield f"\t\tCallTable {table['name']}"
+        else:
+            flag = decimation_flag(next(sdi_cmd for sdi_cmd in decimated if every_scans[sdi_cmd] == every))
+            yield f"\t\tIf {flag} Then CallTable {table['name']}"
+    if instrument:
+        yield f"\t\tProcTime_ms = Timer({SCAN_TIMER},mSec,4)"
+        for name, status_field in INSTRUMENT_STATUS_FIELDS.items():
+            yield f"\t\t{name} = {status_field}"
+        yield f"\t\tCallTable {INSTRUMENT_TABLE_NAME}"
+
+    yield "\tNextScan"
+    yield "EndProg"
+
+
+def generate_code(num_sensors, measure_interval_min, **kwargs):
+    """
+    Generates CRBasic code for CR200/CR200X dataloggers as a single string
+    (or an error string). Thin wrapper around iter_code.
+    """
+    return "\n".join(iter_code(num_sensors, measure_interval_min, **kwargs))
 
 # Optional: Direct testing block (as before)
 if __name__ == "__main__":
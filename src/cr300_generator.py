@@ -1,13 +1,590 @@
 # src/cr300_generator.py
 
+import functools
+import math
 import sys
 
-# Constants specific to CR300 generation
-MAX_SDI12_SENSORS_CR300 = 62
-MIN_MEASURE_INTERVAL_MINUTES_IMPLEX = 10 # Implexx general recommendation
+from src.profiles import LOGGER_PROFILES
+from src.scan_budget import balance_ports, command_latency, concurrent_wait_s
+
+# Constants specific to CR300 generation (limits from the logger profile)
+PROFILE = LOGGER_PROFILES["CR300"]
+MAX_SDI12_SENSORS_CR300 = PROFILE["max_sensors"]
+MIN_MEASURE_INTERVAL_MINUTES_IMPLEX = PROFILE["min_interval_min"] # Implexx general recommendation
+
+# Define the structure for the measurements we want to extract.
+# This will help in creating aliases and assigning data.
+# (alias_suffix, unit, source_sdi_command, array_size_for_sdi_command, index_in_that_array)
+# Note: CRBasic array access is 1-indexed.
+# The SDI12Recorder for "M!" in CR300 example populates 9 values (D0 & D1 combined)
+# The SDI12Recorder for "M1!"/"M2!" should populate 6 values (D0)
+# The SDI12Recorder for "M5!" should populate 2 values (D0)
+
+# Base names for the Public arrays that SDI12Recorder will populate
+# Suffixes for aliased variables (will become FieldNames)
+# Units for the aliased variables
+# Source SDI Command (M!, M1!, M2!, M5!)
+# Size of the array that the SDI12Recorder call for that command will populate
+# 1-based index within that populated array for this specific data point
+
+DESIRED_MEASUREMENTS_CONFIG = [
+    # From M! (which implicitly gets D0 and D1, total 9 values)
+    ("AlpOut", "ratio", "M!", 9, 4),  # AlphaOuter is 4th of 9 (D0's 4th)
+    ("AlpInn", "ratio", "M!", 9, 5),  # AlphaInner is 5th of 9 (D0's 5th)
+    ("BetOut", "ratio", "M!", 9, 6),  # BetaOuter is 6th of 9 (D1's 1st)
+    ("BetInn", "ratio", "M!", 9, 7),  # BetaInner is 7th of 9 (D1's 2nd)
+    ("tMxTout", "sec", "M!", 9, 8),   # tMaxTouter is 8th of 9 (D1's 3rd)
+    ("tMxTinn", "sec", "M!", 9, 9),   # tMaxTinner is 9th of 9 (D1's 4th)
+    # From M1! (implicitly gets D0, total 6 values)
+    ("TpDsOut", "degC", "M1!", 6, 1), # TpreDsOuter
+    ("dTDsOut", "degC", "M1!", 6, 2), # dTmaxDsOuter
+    ("TsDsOut", "degC", "M1!", 6, 3), # TpostDsOuter
+    ("TpUsOut", "degC", "M1!", 6, 4), # TpreUsOuter
+    ("dTUsOut", "degC", "M1!", 6, 5), # dTmaxUsOuter
+    ("TsUsOut", "degC", "M1!", 6, 6), # TpostUsOuter
+    # From M2! (implicitly gets D0, total 6 values)
+    ("TpDsInn", "degC", "M2!", 6, 1), # TpreDsInner
+    ("dTDsInn", "degC", "M2!", 6, 2), # dTmaxDsInner
+    ("TsDsInn", "degC", "M2!", 6, 3), # TpostDsInner
+    ("TpUsInn", "degC", "M2!", 6, 4), # TpreUsInner
+    ("dTUsInn", "degC", "M2!", 6, 5), # dTmaxUsInner
+    ("TsUsInn", "degC", "M2!", 6, 6), # TpostUsInner
+    # From M5! (implicitly gets D0, total 2 values)
+    ("tMxTUsO", "sec", "M5!", 2, 1),  # tMaxTusOuter
+    ("tMxTUsI", "sec", "M5!", 2, 2)   # tMaxTusInner
+]
+
+# SDI-12 commands issued for every sensor on every scan, in order
+SDI12_COMMANDS = list(PROFILE["measurement_commands"])
+
+# SDI-12 modes for issuing those commands:
+#   sequential - one blocking M!/M1!/M2!/M5! call per sensor, one sensor after another
+#   concurrent - C!/C1!/C2!/C5! started on every sensor, one wait, then D0!/D1! collection
+SDI12_MODES = ["sequential", "concurrent"]
+
+# Concurrent equivalent of each measurement command, and the data commands that
+# collect its values: (data_command, 1-based index in the array where they land).
+# M! values come back split over D0! (values 1-5) and D1! (values 6-9).
+CONCURRENT_COMMANDS = {"M!": "C!", "M1!": "C1!", "M2!": "C2!", "M5!": "C5!"}
+CONCURRENT_DATA_COMMANDS = {
+    "M!": [("D0!", 1), ("D1!", 6)],
+    "M1!": [("D0!", 1)],
+    "M2!": [("D0!", 1)],
+    "M5!": [("D0!", 1)],
+}
+# SDI12Recorder manages C commands itself: on each call after the first it
+# collects the previous measurement of that instruction (aD0!, ...) into the
+# destination before issuing the C command again. The collection is only valid
+# up to the next command to the sensor, which replaces the sensor's buffer, so
+# with several commands per sensor the programs still collect each command's
+# values with explicit D commands after the wait. The C call's destination is
+# the command's own array: the values the logger collects there have the
+# command's count, and the D commands overwrite them in the same scan.
+
+# Control ports that can run an SDI-12 bus, and the default one
+SDI12_PORTS = ["C1", "C2"]
+DEFAULT_SDI12_PORT = "C1"
+
+# Program layouts:
+#   unrolled - per-sensor arrays, Alias and Sample lines; grows by ~60 lines per sensor
+#   rolled   - sensor-indexed 2-D arrays, For loops over an address table and bulk
+#              Move resets; the size barely changes with the number of sensors
+LAYOUTS = ["unrolled", "rolled"]
+ROLLED_TABLE_ARRAY = "SapData" # Row per sensor, columns in DESIRED_MEASUREMENTS_CONFIG order
+
+# Storage types for the logged measurements. IEEE4 is the default; FP2 takes half
+# the bytes and suits values within +/-7999 that need only 3-4 significant digits.
+# fp2_measurements names alias suffixes (e.g. "TpDsOut") or these groups of them:
+DEFAULT_DATA_TYPE = "IEEE4"
+FP2_GROUPS = {"TEMPERATURES": "degC", "TIMES": "sec"} # group -> unit of its measurements
+TABLE_NAME = "SapFlowAll"
+
+# Decimation: how often each measurement group (the DESIRED_MEASUREMENTS_CONFIG
+# entries of one command) is collected, in scans. M! fires the heat pulse that
+# M1!/M2!/M5! report on, so it runs every scan; the slowly changing diagnostics
+# can be collected every Kth scan instead (decimation={"M1!": 4, ...}). Their
+# values then go to a separate table written only on the scans they are measured.
+MEASUREMENT_GROUP_EVERY_SCANS = {"M!": 1, "M1!": 1, "M2!": 1, "M5!": 1}
+UNDECIMATED_COMMANDS = ["M!"]
+DIAGNOSTICS_TABLE_NAME = "SapFlowDiag" # Gets the K suffix when groups use different K
+
+# Scan-timing instrumentation (instrument=True): each SDI12Recorder call is timed
+# and its duration added to the sensor's LATENCY_ARRAY entry. The scan's process
+# time and the logger's skipped-scan and watchdog counters are logged with the
+# latencies to INSTRUMENT_TABLE_NAME on every scan.
+INSTRUMENT_TABLE_NAME = "ScanDiag"
+LATENCY_ARRAY = "SDI12_Lat" # ms per sensor, in sensor order
+SCAN_TIMER = 1 # Timer number of the scan; port n times its SDI-12 calls with timer n + 1
+INSTRUMENT_STATUS_FIELDS = {"SkippedScan": "Status.SkippedScan", "WatchdogErr": "Status.WatchdogErrors"}
+
+
+# Helper to get SDI-12 address character (0-9, a-z, A-Z)
+def get_sdi12_address_char(index):
+    addresses = PROFILE["sdi12_addresses"]
+    if 0 <= index < len(addresses): return addresses[index]
+    raise ValueError(f"Sensor index out of SDI-12 addressable range (0-{len(addresses) - 1})")
+
+
+def command_array_size(sdi_cmd):
+    """Number of values a measurement command (M!, M1!, ...) returns, from the config."""
+    for _, _, cmd_conf, size_conf, _ in DESIRED_MEASUREMENTS_CONFIG:
+        if cmd_conf == sdi_cmd:
+            return size_conf
+    return 0
+
+
+def resolve_fp2_measurements(names):
+    """
+    Resolves fp2_measurements names (alias suffixes or FP2_GROUPS, any case) to
+    alias suffixes of DESIRED_MEASUREMENTS_CONFIG.
+
+    Returns:
+        tuple: (set of alias suffixes, list of names that match nothing).
+    """
+    suffixes, unknown = set(), []
+    by_upper = {alias_suffix.upper(): alias_suffix for alias_suffix, *_ in DESIRED_MEASUREMENTS_CONFIG}
+    for name in names or []:
+        key = str(name).upper()
+        if key in FP2_GROUPS:
+            suffixes.update(alias_suffix for alias_suffix, unit, *_ in DESIRED_MEASUREMENTS_CONFIG
+                            if unit == FP2_GROUPS[key])
+        elif key in by_upper:
+            suffixes.add(by_upper[key])
+        else:
+            unknown.append(str(name))
+    return suffixes, unknown
+
+
+def measurement_data_types(fp2_measurements=None):
+    """Storage type of each DESIRED_MEASUREMENTS_CONFIG entry, in order."""
+    fp2_suffixes, _ = resolve_fp2_measurements(fp2_measurements)
+    return ["FP2" if alias_suffix in fp2_suffixes else DEFAULT_DATA_TYPE
+            for alias_suffix, *_ in DESIRED_MEASUREMENTS_CONFIG]
+
+
+def resolve_decimation(decimation):
+    """
+    Normalizes a decimation mapping ({"M1": 4} or {"m1!": 4}) to every command's
+    collection period in scans, starting from MEASUREMENT_GROUP_EVERY_SCANS.
+
+    Returns:
+        tuple: (dict of command -> every K scans, error message or None).
+    """
+    every_scans = dict(MEASUREMENT_GROUP_EVERY_SCANS)
+    for name, every in (decimation or {}).items():
+        sdi_cmd = str(name).upper()
+        if not sdi_cmd.endswith("!"):
+            sdi_cmd += "!"
+        if sdi_cmd not in every_scans:
+            return every_scans, (f"Unknown measurement group '{name}' for decimation. "
+                                 f"Choose among: {', '.join(SDI12_COMMANDS)}.")
+        if isinstance(every, bool) or not isinstance(every, int) or every < 1:
+            return every_scans, f"Decimation of {sdi_cmd} must be a whole number of scans >= 1. Requested: {every}."
+        if sdi_cmd in UNDECIMATED_COMMANDS and every != 1:
+            return every_scans, f"{sdi_cmd} fires the heat pulse and must run on every scan."
+        every_scans[sdi_cmd] = every
+    return every_scans, None
+
+
+def diagnostics_tables(every_scans):
+    """
+    The lower-rate tables of a decimated program, one per distinct period.
+
+    Returns:
+        list: (table_name, every_k_scans, [commands]) tuples, by period.
+    """
+    periods = sorted({every for every in every_scans.values() if every > 1})
+    tables = []
+    for every in periods:
+        name = DIAGNOSTICS_TABLE_NAME if len(periods) == 1 else f"{DIAGNOSTICS_TABLE_NAME}{every}"
+        tables.append((name, every, [cmd for cmd in SDI12_COMMANDS if every_scans[cmd] == every]))
+    return tables
+
+
+def decimation_flag(sdi_cmd):
+    """Boolean set at the start of a scan when a decimated command is due (e.g. Run_M1)."""
+    return f"Run_{sdi_cmd.rstrip('!')}"
+
+
+def decimation_const(sdi_cmd):
+    """Constant holding a decimated command's period in scans (e.g. EVERY_M1_SCANS)."""
+    return f"EVERY_{sdi_cmd.rstrip('!')}_SCANS"
+
+
+def _iter_when_due(lines, sdi_cmd, decimated, indent="    "):
+    """Guards one command's lines with its decimation flag if it is decimated."""
+    lines = list(lines)
+    if sdi_cmd not in decimated:
+        yield from lines
+        return
+    trailing_blank = bool(lines) and lines[-1] == ""
+    if trailing_blank:
+        lines.pop()
+    yield f"{indent}If {decimation_flag(sdi_cmd)} Then"
+    for line in lines:
+        yield "  " + line if line else line
+    yield f"{indent}EndIf"
+    if trailing_blank:
+        yield ""
+
+
+def port_timer(port_number=None):
+    """Timer number that times the SDI-12 calls of a port (instrumented programs)."""
+    return SCAN_TIMER + (port_number or 1)
+
+
+def _iter_timed_call(call_line, latency_index, timer=None):
+    """
+    An SDI12Recorder line. With a timer number, the call's duration (ms) is
+    added to LATENCY_ARRAY(latency_index).
+    """
+    if timer is None:
+        yield call_line
+        return
+    indent = call_line[:len(call_line) - len(call_line.lstrip())]
+    yield f"{indent}Timer ({timer}, mSec, 2)"
+    yield call_line
+    yield f"{indent}{LATENCY_ARRAY}({latency_index}) = {LATENCY_ARRAY}({latency_index}) + Timer ({timer}, mSec, 4)"
+
+
+def instrument_fields(num_sensors):
+    """Fields of the INSTRUMENT_TABLE_NAME table, in table_layout() form."""
+    fields = [{"name": "ProcTime_ms", "data_type": DEFAULT_DATA_TYPE, "unit": "ms", "sensor": None, "measurement": None}]
+    fields += [{"name": name, "data_type": "Long", "unit": "count", "sensor": None, "measurement": None}
+               for name in INSTRUMENT_STATUS_FIELDS]
+    for i in range(num_sensors):
+        sdi_char = get_sdi12_address_char(i)
+        fields.append({"name": f"Lat_S{sdi_char}", "data_type": DEFAULT_DATA_TYPE, "unit": "ms",
+                       "sensor": sdi_char, "measurement": "Lat"})
+    return fields
+
+
+def table_layout(num_sensors, measure_interval_min, fp2_measurements=None, decimation=None, instrument=False,
+                 **kwargs):
+    """
+    Describes the data tables the generated program writes (the same for both layouts).
+    Decimated measurement groups go to the diagnostics tables, whose interval_min is
+    the scan interval times their period.
+
+    Returns:
+        list: One dict per table with 'name', 'interval_min' and 'fields', a list of
+        {'name', 'data_type', 'unit', 'sensor', 'measurement'} dicts in column order
+        ('sensor' and 'measurement' are None for the logger's own values).
+    """
+    fields = [
+        {"name": "Batt_volt", "data_type": "FP2", "unit": "V", "sensor": None, "measurement": None},
+        {"name": "PTemp_C", "data_type": "FP2", "unit": "degC", "sensor": None, "measurement": None},
+    ]
+    every_scans, _ = resolve_decimation(decimation)
+    tables = [{"name": TABLE_NAME, "interval_min": measure_interval_min, "fields": fields}]
+    tables += [{"name": name, "interval_min": measure_interval_min * every, "fields": []}
+               for name, every, _ in diagnostics_tables(every_scans)]
+    table_of_command = {cmd: table for table in tables[1:] for cmd in SDI12_COMMANDS
+                        if table["interval_min"] == measure_interval_min * every_scans[cmd]}
+    data_types = measurement_data_types(fp2_measurements)
+    for i in range(num_sensors):
+        sdi_char = get_sdi12_address_char(i)
+        for (alias_suffix, unit, sdi_cmd, *_), data_type in zip(DESIRED_MEASUREMENTS_CONFIG, data_types):
+            table_of_command.get(sdi_cmd, tables[0])["fields"].append(
+                {"name": f"S{sdi_char}_{alias_suffix}", "data_type": data_type,
+                 "unit": unit, "sensor": sdi_char, "measurement": alias_suffix})
+    if instrument:
+        tables.append({"name": INSTRUMENT_TABLE_NAME, "interval_min": measure_interval_min,
+                       "fields": instrument_fields(num_sensors)})
+    return tables
+
+
+def sensor_commands(sdi12_mode):
+    """The SDI-12 commands issued to each sensor per scan in an SDI-12 mode."""
+    if sdi12_mode == "concurrent":
+        return [CONCURRENT_COMMANDS[command] for command in SDI12_COMMANDS]
+    return list(SDI12_COMMANDS)
+
+
+def sensor_seconds(sdi12_mode):
+    """Expected worst-case seconds one sensor's calls take per scan (waits included)."""
+    return sum(command_latency("CR300", command) for command in sensor_commands(sdi12_mode))
+
+
+def assign_ports(num_sensors, sdi12_mode="sequential", sdi12_ports=None):
+    """
+    Partitions the sensors across the available SDI-12 ports, balancing each
+    port's expected measurement time (see scan_budget.balance_ports).
+
+    Returns:
+        list: (port, [(sensor_index, address_char), ...]) in port order; a single
+        entry for DEFAULT_SDI12_PORT when no ports are given.
+    """
+    addresses = [(i, get_sdi12_address_char(i)) for i in range(num_sensors)]
+    if not sdi12_ports:
+        return [(DEFAULT_SDI12_PORT, addresses)]
+    seconds = sensor_seconds(sdi12_mode)
+    by_port = balance_ports({sdi_char: seconds for _, sdi_char in addresses}, list(sdi12_ports))
+    return [(port, [(i, sdi_char) for i, sdi_char in addresses if sdi_char in by_port[port]])
+            for port in by_port]
+
+
+def scan_commands(num_sensors, measure_interval_min, sdi12_mode="sequential", sdi12_ports=None, **kwargs):
+    """
+    Lists the SDI-12 commands one scan of the generated program issues.
+
+    Returns:
+        list: (port, address_char, command) tuples in the order each port issues
+        them. In concurrent mode each C command is started on every sensor of
+        the port before the next.
+    """
+    commands = []
+    for port, addresses in assign_ports(num_sensors, sdi12_mode, sdi12_ports):
+        if sdi12_mode == "concurrent":
+            commands += [(port, sdi_char, command)
+                         for command in sensor_commands(sdi12_mode) for _, sdi_char in addresses]
+        else:
+            commands += [(port, sdi_char, command)
+                         for _, sdi_char in addresses for command in sensor_commands(sdi12_mode)]
+    return commands
+
+
+def command_every_scans(decimation=None, **kwargs):
+    """
+    How often each measurement command of scan_commands() runs, in scans (1 for
+    every scan). Used by the energy model; an invalid decimation counts as none.
+    """
+    return resolve_decimation(decimation)[0]
+
+
+def _iter_sequential_measurements(addresses, sdi_command_array_map, port_const="SDI12_PORT", decimated=(),
+                                  timer=None):
+    """Blocking M!/M1!/M2!/M5! calls for one sensor after another (timed with 'timer' if given)."""
+    for i, sdi_char in addresses:
+        yield f"    ' --- Sensor {sdi_char} (Address \"{sdi_char}\") ---"
+
+        # --- Standard Measurement (M!) ---
+        # This call is assumed to be blocking for ~100s and retrieve all 9 values
+        sdi_cmd_m = "M!"
+        array_name_m = sdi_command_array_map[(i, sdi_cmd_m)]
+        num_values_m = 9 # For M! + D0/D1
+        yield from _iter_timed_call(
+            f"    SDI12Recorder({array_name_m}(), {port_const}, \"{sdi_char}\", \"{sdi_cmd_m}\", 1.0, 0, -1)",
+            i + 1, timer)
+        yield f"    If {array_name_m}(1) = NAN Then ' Check if first value is NAN (measurement failed)"
+        yield f"      Move ({array_name_m}(), {num_values_m}, NAN, 1) ' Set all elements of this array to NAN"
+        yield f"    EndIf"
+        yield ""
+
+        # --- Additional Measurements (M1!, M2!, M5!) ---
+        # These are assumed to be quick, blocking calls retrieving their respective data
+        for sdi_cmd_base in ["M1", "M2", "M5"]:
+            sdi_cmd_add = sdi_cmd_base + "!"
+            array_name_add = sdi_command_array_map[(i, sdi_cmd_add)]
+            num_values_add = command_array_size(sdi_cmd_add)
+
+            yield from _iter_when_due([
+                f"    ' {sdi_cmd_add} Measurement",
+                *_iter_timed_call(
+                    f"    SDI12Recorder({array_name_add}(), {port_const}, \"{sdi_char}\", \"{sdi_cmd_add}\", 1.0, 0, -1)",
+                    i + 1, timer),
+                f"    If {array_name_add}(1) = NAN Then",
+                f"      Move ({array_name_add}(), {num_values_add}, NAN, 1)",
+                f"    EndIf",
+                "",
+            ], sdi_cmd_add, decimated)
+
+
+def _iter_concurrent_measurements(addresses, sdi_command_array_map, port_const="SDI12_PORT", decimated=(),
+                                  timer=None):
+    """
+    For each command: start it on every sensor (C!), wait once for the slowest
+    sensor, then collect every sensor's values (D0!/D1!). A sensor runs one
+    measurement at a time, so the commands themselves stay in sequence.
+    """
+    for sdi_cmd in SDI12_COMMANDS:
+        yield from _iter_when_due(
+            _iter_concurrent_command(addresses, sdi_command_array_map, port_const, sdi_cmd, timer),
+            sdi_cmd, decimated)
+
+
+def _iter_concurrent_command(addresses, sdi_command_array_map, port_const, sdi_cmd, timer=None):
+    """
+    One concurrent command (C!, C1!, ...) on every sensor of a port. An
+    instrumented sensor's latency covers its own C and D calls, not the shared wait.
+    """
+    conc_cmd = CONCURRENT_COMMANDS[sdi_cmd]
+    num_values = command_array_size(sdi_cmd)
+    yield f"    ' --- Concurrent {conc_cmd} ({sdi_cmd} values) on all sensors ---"
+    for i, sdi_char in addresses:
+        array_name = sdi_command_array_map[(i, sdi_cmd)]
+        yield from _iter_timed_call(
+            f"    SDI12Recorder({array_name}(), {port_const}, \"{sdi_char}\", \"{conc_cmd}\", 1.0, 0, -1)", i + 1, timer)
+    yield f"    Delay (1, {concurrent_wait_const(sdi_cmd)}, Sec) ' Wait once for the slowest sensor"
+    for i, sdi_char in addresses:
+        array_name = sdi_command_array_map[(i, sdi_cmd)]
+        for data_cmd, start_index in CONCURRENT_DATA_COMMANDS[sdi_cmd]:
+            yield from _iter_timed_call(
+                f"    SDI12Recorder({array_name}({start_index}), {port_const}, \"{sdi_char}\", \"{data_cmd}\", 1.0, 0, -1)",
+                i + 1, timer)
+        yield f"    If {array_name}(1) = NAN Then"
+        yield f"      Move ({array_name}(), {num_values}, NAN, 1)"
+        yield f"    EndIf"
+    yield ""
+
+
+def rolled_array_name(sdi_cmd):
+    """Sensor-indexed 2-D array a command's values land in (rolled layout), e.g. M1_Data."""
+    return f"{sdi_cmd.rstrip('!')}_Data"
+
+
+def table_row_moves():
+    """
+    Contiguous runs of DESIRED_MEASUREMENTS_CONFIG, each copied with one Move from a
+    command array into a sensor's ROLLED_TABLE_ARRAY row (rolled layout).
+
+    Returns:
+        list: (first_column, count, sdi_command, first_index_in_command_array) tuples.
+    """
+    runs = []
+    for column, (_, _, sdi_cmd, _, index) in enumerate(DESIRED_MEASUREMENTS_CONFIG, start=1):
+        if runs and runs[-1][2] == sdi_cmd and runs[-1][3] + runs[-1][1] == index:
+            runs[-1][1] += 1
+        else:
+            runs.append([column, 1, sdi_cmd, index])
+    return [tuple(run) for run in runs]
+
+
+def _iter_rolled_sensor_loop(body, port_number=None, indent="    "):
+    """
+    Wraps per-sensor lines in a For loop over the address table. With a port
+    number, only the sensors SENSOR_PORT_MAP puts on that port are measured.
+    """
+    loop_var, addr_var = rolled_loop_vars(port_number)
+    inner = indent + "  "
+    yield f"{indent}For {loop_var} = 1 To NUM_SENSORS"
+    if port_number is not None:
+        yield f"{inner}If Mid (SENSOR_PORT_MAP, {loop_var}, 1) = \"{port_number}\" Then"
+        inner += "  "
+    yield f"{inner}{addr_var} = Mid (SDI12_ADDRESSES, {loop_var}, 1)"
+    for line in body(loop_var, addr_var):
+        yield inner + line
+    if port_number is not None:
+        yield f"{indent}  EndIf"
+    yield f"{indent}Next {loop_var}"
+
+
+def rolled_loop_vars(port_number=None):
+    """Loop counter and address variable of a port's sensor loop (one pair per task)."""
+    if port_number is None or port_number == 1:
+        return "S", "Addr"
+    return f"S_{port_number}", f"Addr_{port_number}"
+
+
+def _iter_rolled_nan_check(sdi_cmd, loop_var):
+    array_name = rolled_array_name(sdi_cmd)
+    yield f"If {array_name}({loop_var},1) = NAN Then"
+    yield f"  Move ({array_name}({loop_var},1), {command_array_size(sdi_cmd)}, NAN, 1)"
+    yield "EndIf"
+
+
+def _iter_rolled_measurements(sdi12_mode, port_const="SDI12_PORT", port_number=None, decimated=(), timer=None):
+    """The sequential or concurrent SDI-12 calls of one port as loops over its sensors."""
+    if sdi12_mode != "concurrent":
+        def body(loop_var, addr_var):
+            for sdi_cmd in SDI12_COMMANDS:
+                yield from _iter_when_due([
+                    *_iter_timed_call(
+                        (f"SDI12Recorder({rolled_array_name(sdi_cmd)}({loop_var},1), {port_const}, "
+                         f"{addr_var}, \"{sdi_cmd}\", 1.0, 0, -1)"), loop_var, timer),
+                    *_iter_rolled_nan_check(sdi_cmd, loop_var),
+                ], sdi_cmd, decimated, indent="")
+        yield "    ' --- M!, M1!, M2!, M5! on each sensor in turn ---"
+        yield from _iter_rolled_sensor_loop(body, port_number)
+        yield ""
+        return
+
+    for sdi_cmd in SDI12_COMMANDS:
+        conc_cmd = CONCURRENT_COMMANDS[sdi_cmd]
+
+        def start(loop_var, addr_var, sdi_cmd=sdi_cmd, conc_cmd=conc_cmd):
+            yield from _iter_timed_call(
+                (f"SDI12Recorder({rolled_array_name(sdi_cmd)}({loop_var},1), {port_const}, {addr_var}, "
+                 f"\"{conc_cmd}\", 1.0, 0, -1)"), loop_var, timer)
+
+        def collect(loop_var, addr_var, sdi_cmd=sdi_cmd):
+            for data_cmd, start_index in CONCURRENT_DATA_COMMANDS[sdi_cmd]:
+                yield from _iter_timed_call(
+                    (f"SDI12Recorder({rolled_array_name(sdi_cmd)}({loop_var},{start_index}), "
+                     f"{port_const}, {addr_var}, \"{data_cmd}\", 1.0, 0, -1)"), loop_var, timer)
+            yield from _iter_rolled_nan_check(sdi_cmd, loop_var)
+
+        yield from _iter_when_due([
+            f"    ' --- Concurrent {conc_cmd} ({sdi_cmd} values) on all sensors ---",
+            *_iter_rolled_sensor_loop(start, port_number),
+            f"    Delay (1, {concurrent_wait_const(sdi_cmd)}, Sec) ' Wait once for the slowest sensor",
+            *_iter_rolled_sensor_loop(collect, port_number),
+            "",
+        ], sdi_cmd, decimated)
+
+
+def _iter_table_header(table_name, every_scans, sdi_commands):
+    """DataTable line and the fields that precede the sensor values (core or diagnostics table)."""
+    if every_scans == 1:
+        yield "'--- DataTable Definition (Single Table for All Sensors) ---"
+        yield f"DataTable ({table_name}, True, -1)"
+        yield f"  DataInterval (0, MEAST_INTERVAL_MIN, Min, 0) ' No output delay"
+        yield "  Sample (1, Batt_volt, FP2)"
+        yield "  Sample (1, PTemp_C, FP2)"
+    else:
+        yield f"'--- Diagnostics Table ({', '.join(sdi_commands)} values, every {every_scans} scans) ---"
+        yield f"DataTable ({table_name}, True, -1)"
+        yield "  ' No DataInterval: a record is stored on each scan that calls the table"
+
+
+def sensor_array_name(sdi_char, sdi_cmd):
+    """Public array an unrolled program's SDI12Recorder call for a command fills, e.g. S0_M1_Data."""
+    return f"S{sdi_char}_{sdi_cmd.rstrip('!')}_Data"
+
+
+@functools.cache
+def emission_templates():
+    """
+    The per-sensor blocks of an unrolled program as format strings, compiled
+    once per process (see profiles.load_profile()). Field: {a} (SDI-12 address).
+
+    Returns:
+        dict: 'arrays' (the SDI12Recorder arrays), 'aliases' (an Alias and Units
+        per logged value), 'variables' (the logged values, in column order, for
+        sample_template()) and 'nan_init' (the logged values set to NAN).
+    """
+    variables = [f"S{{a}}_{alias_suffix}" for alias_suffix, *_ in DESIRED_MEASUREMENTS_CONFIG]
+    return {
+        "arrays": "\n".join(f"Public {sensor_array_name('{a}', sdi_cmd)}({command_array_size(sdi_cmd)}) As Float"
+                            for sdi_cmd in SDI12_COMMANDS if command_array_size(sdi_cmd) > 0),
+        "aliases": "\n".join(f"Alias {sensor_array_name('{a}', sdi_cmd)}({index_in_sdi_array}) = {variable}"
+                             f" : Units {variable}={unit}"
+                             for variable, (_, unit, sdi_cmd, _, index_in_sdi_array)
+                             in zip(variables, DESIRED_MEASUREMENTS_CONFIG)),
+        "variables": variables,
+        "nan_init": "\n".join(f"    {variable} = NAN" for variable in variables),
+    }
+
+
+def sample_template(data_types, table_commands):
+    """
+    One sensor's Sample lines in a table of an unrolled program, as a format
+    string with the field {a}, for the given storage types and logged commands.
+    """
+    return "\n".join(f"  Sample (1, {variable}, {data_type})" # IEEE4 for float precision unless FP2 was asked for
+                     for variable, data_type, (_, _, sdi_cmd, _, _)
+                     in zip(emission_templates()["variables"], data_types, DESIRED_MEASUREMENTS_CONFIG)
+                     if sdi_cmd in table_commands)
+
+
+def concurrent_wait_const(sdi_cmd):
+    """Name of the CRBasic constant holding the concurrent wait for a command."""
+    return f"CONC_WAIT_{sdi_cmd.rstrip('!')}_S"
+
 
 # This is the function that main.py will call
-def generate_code(num_sensors, measure_interval_min, **kwargs):
+def iter_code(num_sensors, measure_interval_min, sdi12_mode="sequential", sdi12_ports=None,
+              layout="unrolled", fp2_measurements=None, decimation=None, instrument=False, **kwargs):
     """
     Generates CRBasic code for CR300 series dataloggers to read
     20 specified measurements from multiple Implexx sap flow sensors.
@@ -17,193 +594,342 @@ def generate_code(num_sensors, measure_interval_min, **kwargs):
     Args:
         num_sensors (int): The number of sensors.
         measure_interval_min (int): The measurement interval in minutes.
+        sdi12_mode (str): "sequential" (default) or "concurrent"; see SDI12_MODES.
+        sdi12_ports (list): Optional SDI-12 ports (e.g. ["C1", "C2"]) to spread the
+            sensors over. With more than one port, each extra port runs its sensors
+            in a triggered SlowSequence so the buses work in parallel.
+        layout (str): "unrolled" (default) or "rolled"; see LAYOUTS. Both log the
+            same SapFlowAll columns.
+        fp2_measurements (list): Optional alias suffixes (e.g. "TpDsOut") or FP2_GROUPS
+            ("temperatures", "times") to log as FP2 instead of IEEE4.
+        decimation (dict): Optional collection period in scans per measurement group,
+            e.g. {"M1!": 4, "M2!": 4, "M5!": 12}; see MEASUREMENT_GROUP_EVERY_SCANS.
+        instrument (bool): Time the SDI-12 calls and the scan and log them, with
+            the skipped-scan and watchdog counters, to INSTRUMENT_TABLE_NAME.
         **kwargs: For future expansion if needed.
 
-    Returns:
-        str: The generated CRBasic program as a string, or an error string.
+    Yields:
+        str: The program line by line (an item may hold several lines; join the
+        items with "\n"), or a single error line if the input is invalid.
     """
 
     # --- Module-specific Validation ---
     if not (1 <= num_sensors <= MAX_SDI12_SENSORS_CR300):
-        return (f"' Error in cr300_generator: Number of sensors must be between 1 and "
+        yield (f"' Error in cr300_generator: Number of sensors must be between 1 and "
                 f"{MAX_SDI12_SENSORS_CR300}.")
+        return
     if measure_interval_min < MIN_MEASURE_INTERVAL_MINUTES_IMPLEX:
-        return (f"' Error in cr300_generator: Implexx sensors recommend a measurement interval of at least "
+        yield (f"' Error in cr300_generator: Implexx sensors recommend a measurement interval of at least "
                 f"{MIN_MEASURE_INTERVAL_MINUTES_IMPLEX} minutes for reliable data. Requested: {measure_interval_min} min.")
-
-    # Define the structure for the measurements we want to extract.
-    # This will help in creating aliases and assigning data.
-    # (alias_suffix, unit, source_sdi_command, array_size_for_sdi_command, index_in_that_array)
-    # Note: CRBasic array access is 1-indexed.
-    # The SDI12Recorder for "M!" in CR300 example populates 9 values (D0 & D1 combined)
-    # The SDI12Recorder for "M1!"/"M2!" should populate 6 values (D0)
-    # The SDI12Recorder for "M5!" should populate 2 values (D0)
-
-    # Base names for the Public arrays that SDI12Recorder will populate
-    # Suffixes for aliased variables (will become FieldNames)
-    # Units for the aliased variables
-    # Source SDI Command (M!, M1!, M2!, M5!)
-    # Size of the array that the SDI12Recorder call for that command will populate
-    # 1-based index within that populated array for this specific data point
-
-    desired_measurements_config = [
-        # From M! (which implicitly gets D0 and D1, total 9 values)
-        ("AlpOut", "ratio", "M!", 9, 4),  # AlphaOuter is 4th of 9 (D0's 4th)
-        ("AlpInn", "ratio", "M!", 9, 5),  # AlphaInner is 5th of 9 (D0's 5th)
-        ("BetOut", "ratio", "M!", 9, 6),  # BetaOuter is 6th of 9 (D1's 1st)
-        ("BetInn", "ratio", "M!", 9, 7),  # BetaInner is 7th of 9 (D1's 2nd)
-        ("tMxTout", "sec", "M!", 9, 8),   # tMaxTouter is 8th of 9 (D1's 3rd)
-        ("tMxTinn", "sec", "M!", 9, 9),   # tMaxTinner is 9th of 9 (D1's 4th)
-        # From M1! (implicitly gets D0, total 6 values)
-        ("TpDsOut", "degC", "M1!", 6, 1), # TpreDsOuter
-        ("dTDsOut", "degC", "M1!", 6, 2), # dTmaxDsOuter
-        ("TsDsOut", "degC", "M1!", 6, 3), # TpostDsOuter
-        ("TpUsOut", "degC", "M1!", 6, 4), # TpreUsOuter
-        ("dTUsOut", "degC", "M1!", 6, 5), # dTmaxUsOuter
-        ("TsUsOut", "degC", "M1!", 6, 6), # TpostUsOuter
-        # From M2! (implicitly gets D0, total 6 values)
-        ("TpDsInn", "degC", "M2!", 6, 1), # TpreDsInner
-        ("dTDsInn", "degC", "M2!", 6, 2), # dTmaxDsInner
-        ("TsDsInn", "degC", "M2!", 6, 3), # TpostDsInner
-        ("TpUsInn", "degC", "M2!", 6, 4), # TpreUsInner
-        ("dTUsInn", "degC", "M2!", 6, 5), # dTmaxUsInner
-        ("TsUsInn", "degC", "M2!", 6, 6), # TpostUsInner
-        # From M5! (implicitly gets D0, total 2 values)
-        ("tMxTUsO", "sec", "M5!", 2, 1),  # tMaxTusOuter
-        ("tMxTUsI", "sec", "M5!", 2, 2)   # tMaxTusInner
-    ]
-
-
-    # Helper to get SDI-12 address character (0-9, a-z, A-Z)
-    def get_sdi12_address_char(index):
-        if 0 <= index <= 9: return str(index)
-        elif 10 <= index <= 35: return chr(ord('a') + (index - 10))
-        elif 36 <= index <= 61: return chr(ord('A') + (index - 36))
-        raise ValueError("Sensor index out of SDI-12 addressable range (0-61)")
-
-    crbasic_code_list = []
+        return
+    if sdi12_mode not in SDI12_MODES:
+        yield (f"' Error in cr300_generator: Unknown SDI-12 mode '{sdi12_mode}'. "
+                f"Choose one of: {', '.join(SDI12_MODES)}.")
+        return
+    if layout not in LAYOUTS:
+        yield (f"' Error in cr300_generator: Unknown layout '{layout}'. "
+                f"Choose one of: {', '.join(LAYOUTS)}.")
+        return
+    fp2_suffixes, unknown_fp2 = resolve_fp2_measurements(fp2_measurements)
+    if unknown_fp2:
+        yield (f"' Error in cr300_generator: Unknown FP2 measurement(s): {', '.join(unknown_fp2)}. "
+                f"Use alias suffixes (e.g. TpDsOut) or: {', '.join(g.lower() for g in FP2_GROUPS)}.")
+        return
+    every_scans, decimation_error = resolve_decimation(decimation)
+    if decimation_error:
+        yield f"' Error in cr300_generator: {decimation_error}"
+        return
+    if kwargs.get("measurements"):
+        yield "' Error in cr300_generator: The CR300 logs every measurement of DESIRED_MEASUREMENTS_CONFIG; measurements is not supported."
+        return
+    if sdi12_ports is not None:
+        sdi12_ports = [str(port).upper() for port in sdi12_ports]
+        unknown_ports = [port for port in sdi12_ports if port not in SDI12_PORTS]
+        if unknown_ports or not sdi12_ports or len(set(sdi12_ports)) != len(sdi12_ports):
+            yield (f"' Error in cr300_generator: SDI-12 ports must be distinct and among "
+                    f"{', '.join(SDI12_PORTS)}. Requested: {', '.join(sdi12_ports) or 'none'}.")
+            return
+
+    port_assignment = assign_ports(num_sensors, sdi12_mode, sdi12_ports)
+    multi_port = len(port_assignment) > 1
+    rolled = layout == "rolled"
+
+    desired_measurements_config = DESIRED_MEASUREMENTS_CONFIG
+    data_types = measurement_data_types(fp2_measurements)
+    decimated = [sdi_cmd for sdi_cmd in SDI12_COMMANDS if every_scans[sdi_cmd] > 1]
+    # (table name, every K scans, commands whose values it logs); the core table first
+    tables = [(TABLE_NAME, 1, [sdi_cmd for sdi_cmd in SDI12_COMMANDS if sdi_cmd not in decimated])]
+    tables += diagnostics_tables(every_scans)
 
     # --- File Header ---
-    crbasic_code_list.append("' CR300 Series Datalogger Program")
-    crbasic_code_list.append("' Program to log 20 specified measurements from Implexx Sap Flow Sensors")
-    crbasic_code_list.append("' Generated by Python Script (cr300_generator.py)")
-    crbasic_code_list.append(f"' Number of Sensors: {num_sensors}")
-    crbasic_code_list.append(f"' Measurement Interval: {measure_interval_min} minutes")
-    crbasic_code_list.append("")
+    yield "' CR300 Series Datalogger Program"
+    yield "' Program to log 20 specified measurements from Implexx Sap Flow Sensors"
+    yield "' Generated by Python Script (cr300_generator.py)"
+    yield f"' Number of Sensors: {num_sensors}"
+    yield f"' Measurement Interval: {measure_interval_min} minutes"
+    if sdi12_mode == "concurrent":
+        yield "' SDI-12 Mode: concurrent (C!/D! measurements on all sensors at once)"
+    if rolled:
+        yield "' Layout: rolled (sensor-indexed arrays and loops; row k of each array is sensor k)"
+    if fp2_suffixes:
+        yield f"' FP2 storage: {', '.join(s for s, *_ in desired_measurements_config if s in fp2_suffixes)}"
+    if decimated:
+        yield (f"' Decimation: {', '.join(f'{c} every {every_scans[c]} scans' for c in decimated)}"
+               f" (logged to {', '.join(name for name, _, _ in tables[1:])})")
+    if instrument:
+        yield f"' Instrumented: SDI-12 call latency and scan timing logged to {INSTRUMENT_TABLE_NAME}"
+    if multi_port:
+        for port, addresses in port_assignment:
+            yield (f"' SDI-12 Port {port}: sensors {', '.join(sdi_char for _, sdi_char in addresses)} "
+                   f"(est. {sensor_seconds(sdi12_mode) * len(addresses):.0f} s per scan)")
+    yield ""
 
     # --- Constants ---
-    crbasic_code_list.append("'--- Constants ---")
-    crbasic_code_list.append(f"Const MEAST_INTERVAL_MIN = {measure_interval_min}")
-    crbasic_code_list.append(f"Const SDI12_PORT = C1 ' Default SDI-12 Port (e.g., C1, C2)")
-    crbasic_code_list.append("")
+    yield "'--- Constants ---"
+    yield f"Const MEAST_INTERVAL_MIN = {measure_interval_min}"
+    if multi_port:
+        for n, (port, addresses) in enumerate(port_assignment, start=1):
+            yield f"Const SDI12_PORT_{n} = {port} ' {len(addresses)} sensor(s)"
+        port_wait_s = math.ceil(sensor_seconds(sdi12_mode) * max(len(a) for _, a in port_assignment))
+        yield f"Const PORT_WAIT_MAX_S = {port_wait_s} ' Longest time to wait for the other ports (s)"
+    elif sdi12_ports:
+        yield f"Const SDI12_PORT = {port_assignment[0][0]} ' SDI-12 Port"
+    else:
+        yield f"Const SDI12_PORT = C1 ' Default SDI-12 Port (e.g., C1, C2)"
+    if sdi12_mode == "concurrent":
+        for sdi_cmd in SDI12_COMMANDS:
+            wait_s = concurrent_wait_s(CONCURRENT_COMMANDS[sdi_cmd])
+            yield f"Const {concurrent_wait_const(sdi_cmd)} = {wait_s} ' Longest {CONCURRENT_COMMANDS[sdi_cmd]} response time (s)"
+    for sdi_cmd in decimated:
+        yield f"Const {decimation_const(sdi_cmd)} = {every_scans[sdi_cmd]} ' Collect {sdi_cmd} values every Kth scan"
+    if decimated:
+        cycle = math.lcm(*(every_scans[sdi_cmd] for sdi_cmd in decimated))
+        yield f"Const DECIMATION_CYCLE = {cycle} ' The scan counter wraps here"
+    if rolled:
+        addresses = "".join(get_sdi12_address_char(i) for i in range(num_sensors))
+        yield f"Const NUM_SENSORS = {num_sensors}"
+        yield f"Const SDI12_ADDRESSES = \"{addresses}\" ' Address of the sensor in each array row"
+        if multi_port:
+            port_of = {sdi_char: n for n, (_, port_addresses) in enumerate(port_assignment, start=1)
+                       for _, sdi_char in port_addresses}
+            yield (f"Const SENSOR_PORT_MAP = \"{''.join(str(port_of[c]) for c in addresses)}\""
+                   f" ' SDI-12 port number of each sensor")
+    yield ""
 
     # --- Declare Public Variables ---
-    crbasic_code_list.append("'--- Declare Public Variables ---")
-    crbasic_code_list.append("Public PTemp_C As Float") # Renamed from PTemp for clarity
-    crbasic_code_list.append("Public Batt_volt As Float")
-    crbasic_code_list.append("Dim N_Loop ' Generic loop counter for error handling") # Single loop counter
-    crbasic_code_list.append("")
-
-    # Declare Public arrays for SDI12Recorder for each command type and sensor
-    # These arrays will be populated by the abstracted SDI12Recorder calls
-    # Example: S0_M_Data(9), S0_M1_Data(6), S0_M2_Data(6), S0_M5_Data(2)
-    sdi_command_array_map = {} # To store array names like "S0_M_Data"
-    for i in range(num_sensors):
-        sdi_char = get_sdi12_address_char(i)
-        # Create unique arrays for each sensor and each type of M command that returns data
-        for sdi_cmd_base in ["M", "M1", "M2", "M5"]: # "M" implies M!
-            # Determine array size based on the first config entry for that command
-            array_size = 0
-            for _, _, cmd_conf, size_conf, _ in desired_measurements_config:
-                if cmd_conf == sdi_cmd_base + "!": # Match M!, M1!, etc.
-                    array_size = size_conf
-                    break
-            if array_size > 0:
-                array_name = f"S{sdi_char}_{sdi_cmd_base}_Data" # e.g., S0_M_Data, Sa_M1_Data
-                sdi_command_array_map[(i, sdi_cmd_base + "!")] = array_name
-                crbasic_code_list.append(f"Public {array_name}({array_size}) As Float")
-    crbasic_code_list.append("")
-
-    # Declare Aliases for the specific data points we want to log
-    # These Aliases will point into the S{sdi_char}_{sdi_cmd_base}_Data arrays
-    crbasic_code_list.append("'--- Alias Declarations (for logged variables) ---")
-    all_data_table_vars = [] # For defining the DataTable
-    for i in range(num_sensors):
-        sdi_char = get_sdi12_address_char(i)
-        for alias_suffix, unit, sdi_cmd, _, index_in_sdi_array in desired_measurements_config:
-            source_array_name = sdi_command_array_map[(i, sdi_cmd)]
-            final_var_name = f"S{sdi_char}_{alias_suffix}" # e.g., S0_AlpOut
-            crbasic_code_list.append(f"Alias {source_array_name}({index_in_sdi_array}) = {final_var_name} : Units {final_var_name}={unit}")
-            all_data_table_vars.append(final_var_name)
-    crbasic_code_list.append("")
-
-
-    # --- DataTable Definition ---
-    crbasic_code_list.append("'--- DataTable Definition (Single Table for All Sensors) ---")
-    crbasic_code_list.append("DataTable (SapFlowAll, True, -1)")
-    crbasic_code_list.append(f"  DataInterval (0, MEAST_INTERVAL_MIN, Min, 0) ' No output delay")
-    crbasic_code_list.append("  Sample (1, Batt_volt, FP2)")
-    crbasic_code_list.append("  Sample (1, PTemp_C, FP2)")
-    for var_name in all_data_table_vars:
-        crbasic_code_list.append(f"  Sample (1, {var_name}, IEEE4)") # Use IEEE4 for float precision
-    crbasic_code_list.append("EndTable")
-    crbasic_code_list.append("")
+    yield "'--- Declare Public Variables ---"
+    yield "Public PTemp_C As Float" # Renamed from PTemp for clarity
+    yield "Public Batt_volt As Float"
+    yield "Dim N_Loop ' Generic loop counter for error handling" # Single loop counter
+    if multi_port:
+        yield f"Public PortDone({len(port_assignment)}) As Boolean ' Set when a port's SDI-12 calls finish"
+        yield "Dim PortWait ' Seconds spent waiting for the other ports"
+    if decimated:
+        yield "Public ScanCount As Long ' Scans into the decimation cycle"
+        for sdi_cmd in decimated:
+            yield f"Dim {decimation_flag(sdi_cmd)} As Boolean ' {sdi_cmd} runs this scan"
+    if rolled:
+        for n in range(1, len(port_assignment) + 1) if multi_port else [None]:
+            loop_var, addr_var = rolled_loop_vars(n)
+            yield f"Dim {loop_var} ' Sensor (array row) loop counter"
+            yield f"Dim {addr_var} As String * 2 ' SDI-12 address of sensor {loop_var}"
+    if instrument:
+        yield f"Public {LATENCY_ARRAY}({num_sensors}) As Float ' ms spent in each sensor's SDI-12 calls this scan"
+        yield "Public ProcTime_ms As Float ' ms from scan start to the diagnostics CallTable"
+        for name in INSTRUMENT_STATUS_FIELDS:
+            yield f"Public {name} As Long"
+    yield ""
+
+    if rolled:
+        # One row per sensor in each command's array, and one row per sensor of
+        # logged values. FieldNames keeps the unrolled layout's column names.
+        yield "'--- Sensor-indexed Arrays ---"
+        for sdi_cmd in SDI12_COMMANDS:
+            yield f"Public {rolled_array_name(sdi_cmd)}(NUM_SENSORS, {command_array_size(sdi_cmd)}) As Float"
+        num_logged = len(desired_measurements_config)
+        yield (f"Public {ROLLED_TABLE_ARRAY}(NUM_SENSORS, {num_logged}) As Float"
+               f" ' Logged values (units: {', '.join(sorted({unit for _, unit, _, _, _ in desired_measurements_config}))})")
+        yield ""
+
+        for table_name, table_every, table_commands in tables:
+            yield from _iter_table_header(table_name, table_every, table_commands)
+            # One Sample per run of adjacent columns with the same storage type
+            type_runs = []
+            for column, ((_, _, sdi_cmd, _, _), data_type) in enumerate(
+                    zip(desired_measurements_config, data_types), start=1):
+                if sdi_cmd not in table_commands:
+                    continue
+                if type_runs and type_runs[-1][2] == data_type and sum(type_runs[-1][:2]) == column:
+                    type_runs[-1][1] += 1
+                else:
+                    type_runs.append([column, 1, data_type])
+            for i in range(num_sensors):
+                sdi_char = get_sdi12_address_char(i)
+                for column, count, data_type in type_runs:
+                    field_names = ",".join(f"S{sdi_char}_{alias_suffix}" for alias_suffix, _, _, _, _
+                                           in desired_measurements_config[column - 1:column - 1 + count])
+                    yield f"  Sample ({count}, {ROLLED_TABLE_ARRAY}({i + 1},{column}), {data_type})"
+                    yield f"  FieldNames (\"{field_names}\")"
+            yield "EndTable"
+            yield ""
+    else:
+        # The per-sensor blocks come from the compiled templates
+        templates = emission_templates()
+        addresses = [get_sdi12_address_char(i) for i in range(num_sensors)]
+
+        # Declare Public arrays for SDI12Recorder for each command type and sensor
+        # These arrays will be populated by the abstracted SDI12Recorder calls
+        # Example: S0_M_Data(9), S0_M1_Data(6), S0_M2_Data(6), S0_M5_Data(2)
+        sdi_command_array_map = {(i, sdi_cmd): sensor_array_name(sdi_char, sdi_cmd)
+                                 for i, sdi_char in enumerate(addresses) for sdi_cmd in SDI12_COMMANDS
+                                 if command_array_size(sdi_cmd) > 0}
+        for sdi_char in addresses:
+            yield templates["arrays"].format(a=sdi_char)
+        yield ""
+
+        # Declare Aliases for the specific data points we want to log
+        # These Aliases will point into the S{sdi_char}_{sdi_cmd_base}_Data arrays
+        yield "'--- Alias Declarations (for logged variables) ---"
+        for sdi_char in addresses:
+            yield templates["aliases"].format(a=sdi_char)
+        yield ""
+
+
+        # --- DataTable Definition ---
+        for table_name, table_every, table_commands in tables:
+            yield from _iter_table_header(table_name, table_every, table_commands)
+            samples = sample_template(data_types, table_commands)
+            for sdi_char in addresses if samples else ():
+                yield samples.format(a=sdi_char)
+            yield "EndTable"
+            yield ""
+
+
+    if instrument:
+        latency_fields = ",".join(field["name"] for field in instrument_fields(num_sensors) if field["sensor"])
+        yield "'--- Scan Timing Diagnostics (a record on every scan) ---"
+        yield f"DataTable ({INSTRUMENT_TABLE_NAME}, True, -1)"
+        for field in instrument_fields(num_sensors):
+            if not field["sensor"]:
+                yield f"  Sample (1, {field['name']}, {field['data_type']})"
+        yield f"  Sample ({num_sensors}, {LATENCY_ARRAY}(1), {DEFAULT_DATA_TYPE})"
+        yield f"  FieldNames (\"{latency_fields}\")"
+        yield "EndTable"
+        yield ""
 
     # --- Main Program ---
-    crbasic_code_list.append("'--- Main Program ---")
+    yield "'--- Main Program ---"
     # CR300 example does not use SequentialMode, relies on SDI12Recorder blocking.
     # Let's try without it first, matching the new CR300 Short Cut example.
     # If timing issues arise, SequentialMode can be added.
-    crbasic_code_list.append("BeginProg")
-    crbasic_code_list.append(f"  Scan (MEAST_INTERVAL_MIN, Min, 1, 0) ' Scan interval, units, buffer=1, count=0 (continuous)")
-    crbasic_code_list.append("    PanelTemp (PTemp_C, 60) ' Defaulting to 60Hz fnotch, or use PanelTemp(PTemp_C)")
-    crbasic_code_list.append("    Battery (Batt_volt)")
-    crbasic_code_list.append("")
+    yield "BeginProg"
+    yield f"  Scan (MEAST_INTERVAL_MIN, Min, 1, 0) ' Scan interval, units, buffer=1, count=0 (continuous)"
+    if instrument:
+        yield f"    Timer ({SCAN_TIMER}, mSec, 2) ' Time the scan"
+        yield f"    Move ({LATENCY_ARRAY}(1), {num_sensors}, 0, 1)"
+    yield "    PanelTemp (PTemp_C, 60) ' Defaulting to 60Hz fnotch, or use PanelTemp(PTemp_C)"
+    yield "    Battery (Batt_volt)"
+    yield ""
+
+    if decimated:
+        yield "    ' --- Decimation: flag the diagnostic commands due this scan ---"
+        for sdi_cmd in decimated:
+            yield f"    {decimation_flag(sdi_cmd)} = (ScanCount MOD {decimation_const(sdi_cmd)} = 0)"
+        yield "    ScanCount = ScanCount + 1"
+        yield "    If ScanCount >= DECIMATION_CYCLE Then ScanCount = 0"
+        yield ""
 
     # Initialize all aliased data variables to NAN at the start of each scan
-    crbasic_code_list.append("    ' Initialize all sensor data variables to NAN")
-    for var_name in all_data_table_vars:
-        crbasic_code_list.append(f"    {var_name} = NAN")
-    crbasic_code_list.append("")
+    yield "    ' Initialize all sensor data variables to NAN"
+    if rolled:
+        for sdi_cmd in SDI12_COMMANDS:
+            array_name = rolled_array_name(sdi_cmd)
+            yield f"    Move ({array_name}(1,1), NUM_SENSORS * {command_array_size(sdi_cmd)}, NAN, 1)"
+    else:
+        for sdi_char in addresses:
+            yield templates["nan_init"].format(a=sdi_char)
+    yield ""
 
-    for i in range(num_sensors):
-        sdi_char = get_sdi12_address_char(i)
-        crbasic_code_list.append(f"    ' --- Sensor {sdi_char} (Address \"{sdi_char}\") ---")
+    if sdi12_mode == "concurrent":
+        iter_measurements = _iter_concurrent_measurements
+    else:
+        iter_measurements = _iter_sequential_measurements
+
+    def iter_port_measurements(n=None):
+        """SDI-12 calls of the n-th port (n is None in a single-port program)."""
+        port_const = "SDI12_PORT" if n is None else f"SDI12_PORT_{n}"
+        timer = port_timer(n) if instrument else None
+        if rolled:
+            return _iter_rolled_measurements(sdi12_mode, port_const, n, decimated, timer)
+        return iter_measurements(port_assignment[(n or 1) - 1][1], sdi_command_array_map, port_const, decimated,
+                                 timer)
+
+    if not multi_port:
+        yield from iter_port_measurements()
+    else:
+        # Port 1 runs inline in the main scan; every other port runs in its own
+        # triggered SlowSequence so the buses are used at the same time.
+        other_ports = range(2, len(port_assignment) + 1)
+        yield "    ' --- Start the SDI-12 sequences of the other ports (they run in parallel) ---"
+        for n in range(1, len(port_assignment) + 1):
+            yield f"    PortDone({n}) = False"
+        for n in other_ports:
+            yield f"    TriggerSequence ({n - 1}, 0)"
+        yield ""
+        yield f"    ' === SDI-12 Port 1 ({port_assignment[0][0]}) ==="
+        yield from iter_port_measurements(1)
+        yield "    PortDone(1) = True"
+        yield ""
+        all_done = " AND ".join(f"PortDone({n})" for n in other_ports)
+        yield "    ' --- Wait (bounded) for the other ports, so a stalled bus cannot hold up the table ---"
+        yield "    PortWait = 0"
+        yield "    Do While PortWait < PORT_WAIT_MAX_S"
+        yield f"      If {all_done} Then ExitDo"
+        yield "      Delay (1, 1, Sec)"
+        yield "      PortWait = PortWait + 1"
+        yield "    Loop"
+        yield ""
+
+    if rolled:
+        yield f"    ' --- Copy each sensor's logged values into its {ROLLED_TABLE_ARRAY} row ---"
+        yield "    For S = 1 To NUM_SENSORS"
+        for column, count, sdi_cmd, index in table_row_moves():
+            yield f"      Move ({ROLLED_TABLE_ARRAY}(S,{column}), {count}, {rolled_array_name(sdi_cmd)}(S,{index}), {count})"
+        yield "    Next S"
+        yield ""
+
+    yield f"    CallTable {TABLE_NAME}"
+    for table_name, _, table_commands in tables[1:]:
+        yield f"    If {decimation_flag(table_commands[0])} Then CallTable {table_name}"
+    if instrument:
+        yield f"    ProcTime_ms = Timer ({SCAN_TIMER}, mSec, 4)"
+        for name, status_field in INSTRUMENT_STATUS_FIELDS.items():
+            yield f"    {name} = {status_field}"
+        yield f"    CallTable {INSTRUMENT_TABLE_NAME}"
+    yield "  NextScan"
+
+    if multi_port:
+        for n in other_ports:
+            port, addresses = port_assignment[n - 1]
+            yield ""
+            yield f"  ' === SDI-12 Port {n} ({port}), started by TriggerSequence ({n - 1}, 0) ==="
+            yield "  SlowSequence"
+            yield "  Do"
+            yield "    WaitTriggerSequence"
+            yield from iter_port_measurements(n)
+            yield f"    PortDone({n}) = True"
+            yield "  Loop"
+    yield "EndProg"
 
-        # --- Standard Measurement (M!) ---
-        # This call is assumed to be blocking for ~100s and retrieve all 9 values
-        sdi_cmd_m = "M!"
-        array_name_m = sdi_command_array_map[(i, sdi_cmd_m)]
-        num_values_m = 9 # For M! + D0/D1
-        crbasic_code_list.append(f"    SDI12Recorder({array_name_m}(), SDI12_PORT, \"{sdi_char}\", \"{sdi_cmd_m}\", 1.0, 0, -1)")
-        crbasic_code_list.append(f"    If {array_name_m}(1) = NAN Then ' Check if first value is NAN (measurement failed)")
-        crbasic_code_list.append(f"      Move ({array_name_m}(), {num_values_m}, NAN, 1) ' Set all elements of this array to NAN")
-        crbasic_code_list.append(f"    EndIf")
-        crbasic_code_list.append("")
 
-        # --- Additional Measurements (M1!, M2!, M5!) ---
-        # These are assumed to be quick, blocking calls retrieving their respective data
-        for sdi_cmd_base in ["M1", "M2", "M5"]:
-            sdi_cmd_add = sdi_cmd_base + "!"
-            array_name_add = sdi_command_array_map[(i, sdi_cmd_add)]
-            num_values_add = 0
-            for _, _, cmd_conf, size_conf, _ in desired_measurements_config:
-                if cmd_conf == sdi_cmd_add:
-                    num_values_add = size_conf
-                    break
-
-            crbasic_code_list.append(f"    ' {sdi_cmd_add} Measurement")
-            crbasic_code_list.append(f"    SDI12Recorder({array_name_add}(), SDI12_PORT, \"{sdi_char}\", \"{sdi_cmd_add}\", 1.0, 0, -1)")
-            crbasic_code_list.append(f"    If {array_name_add}(1) = NAN Then")
-            crbasic_code_list.append(f"      Move ({array_name_add}(), {num_values_add}, NAN, 1)")
-            crbasic_code_list.append(f"    EndIf")
-            crbasic_code_list.append("")
-
-    crbasic_code_list.append("    CallTable SapFlowAll")
-    crbasic_code_list.append("  NextScan")
-    crbasic_code_list.append("EndProg")
-
-    return "\n".join(crbasic_code_list)
+def generate_code(num_sensors, measure_interval_min, **kwargs):
+    """
+    Generates the CR300 program as a single string. Thin wrapper around iter_code.
+
+    Returns:
+        str: The generated CRBasic program as a string, or an error string.
+    """
+    return "\n".join(iter_code(num_sensors, measure_interval_min, **kwargs))
 
 
 # Optional: Add a section for direct testing of this module
@@ -4,10 +4,825 @@
 # ///
 
 import argparse
+import filecmp
+import itertools
+import json
+import os
 import sys
-import importlib # For dynamic module importing
+import time
+import tomllib
+from functools import partial
+
+from src import power, profiles, scan_budget, storage
+from src.cache import DEFAULT_CACHE_DIR, ProgramCache, cache_key
+from src.profiles import LOGGER_TYPES, check_sensor_config, load_generator
+from src.verifier import ProgramLimitError, ProgramVerifier
+
+# Logger types, their limits and their generator modules are in the profile
+# registry (profiles.LOGGER_PROFILES). Generators are imported when first used,
+# so the CLI only imports the selected logger's generator; modules needed by a
+# single subcommand (batch workers, merge, bench, the service, the NumPy stages)
+# are imported by that subcommand.
+
+# Keys every station in a batch manifest must provide (directly or via [defaults])
+MANIFEST_STATION_KEYS = ("logger_type", "num_sensors", "measure_interval", "output")
+
+# Optional generator keyword arguments. Each is a CLI option (e.g. --sdi12-mode)
+# and a manifest station key; they are passed to the generator only when set.
+GENERATOR_OPTION_KEYS = ("sdi12_mode", "sdi12_ports", "layout", "fp2_measurements", "decimation", "measurements",
+                         "instrument")
+
+# Generator options that take a list: comma-separated on the CLI, and a list or
+# a comma-separated string in a manifest station or service request
+LIST_OPTION_KEYS = ("sdi12_ports", "fp2_measurements", "measurements")
+
+# Power supply of a station for the energy budget (see power.py). Each is a CLI
+# option (e.g. --battery-ah) and a manifest station key.
+POWER_OPTION_KEYS = ("battery_ah", "solar_w", "sun_hours")
+
+
+def comma_list(value):
+    """argparse type for comma-separated options, e.g. '--sdi12-ports C1,C2'."""
+    return [item.strip().upper() for item in value.split(",") if item.strip()]
+
+
+def list_option(key, value):
+    """
+    Normalizes a LIST_OPTION_KEYS value from a manifest or service request: a
+    comma-separated string is split as on the CLI (see comma_list()).
+
+    Raises:
+        ValueError: If the value is neither a string nor a list of strings.
+    """
+    if isinstance(value, str):
+        return comma_list(value)
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    raise ValueError(f"'{key}' must be a list of strings or a comma-separated string, got {value!r}")
+
+
+def decimation_map(value):
+    """argparse type for '--decimate M1=4,M2=4,M5=12' (measurement group -> every K scans)."""
+    decimation = {}
+    for item in comma_list(value):
+        name, sep, every = item.partition("=")
+        if not sep or not every.strip().isdigit():
+            raise argparse.ArgumentTypeError(f"expected GROUP=K (e.g. M1=4), got '{item}'")
+        decimation[name.strip()] = int(every)
+    return decimation
+
+
+def check_scan_budget(logger_type, module, generator_args):
+    """
+    Runs the worst-case scan-time model (see scan_budget.py) for a configuration.
+
+    Returns:
+        tuple: (budget dict from scan_budget.estimate_scan, error message or None
+        if the scan fits in the measurement interval).
+    """
+    budget = scan_budget.estimate_scan(logger_type, module.scan_commands(**generator_args),
+                                       generator_args["measure_interval_min"])
+    return budget, None if budget["fits"] else scan_budget.overrun_message(budget)
+
+
+def check_storage(logger_type, module, generator_args):
+    """
+    Estimates the storage and telemetry footprint (see storage.py) of a configuration.
+
+    Returns:
+        tuple: (estimate dict from storage.estimate_storage, warning message or None
+        if the ring buffers last at least storage.WRAP_WARNING_DAYS).
+    """
+    estimate = storage.estimate_storage(logger_type, module.table_layout(**generator_args))
+    return estimate, storage.wrap_warning(estimate)
+
+
+def check_power(logger_type, module, generator_args, power_args=None):
+    """
+    Runs the energy budget (see power.py) for a configuration and power supply.
+
+    Args:
+        power_args (dict): Optional POWER_OPTION_KEYS values (battery_ah, solar_w, sun_hours).
+
+    Returns:
+        tuple: (estimate dict from power.estimate_energy, warning message or None).
+    """
+    estimate = power.estimate_energy(logger_type, module.scan_commands(**generator_args),
+                                     generator_args["measure_interval_min"],
+                                     module.command_every_scans(**generator_args), **(power_args or {}))
+    return estimate, power.power_warning(estimate)
+
+
+def join_messages(*messages):
+    """Joins the non-empty messages with newlines; None if there are none."""
+    return "\n".join(message for message in messages if message) or None
+
+
+def is_generator_error(generated_code):
+    """Generators report problems by returning a CRBasic comment starting with "' Error"."""
+    return generated_code.startswith("' Error")
+
+
+def peek_lines(lines):
+    """
+    Takes the first item from a generator's iter_code() output so it can be
+    checked for an error before anything is written.
+
+    Returns:
+        tuple: (first line or None if nothing was generated, iterator over all lines).
+    """
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return None, iter(())
+    return first, itertools.chain([first], lines)
+
+
+def stream_lines(f, lines):
+    """Writes lines to an open file joined by newlines, as "\n".join(lines) would."""
+    for i, line in enumerate(lines):
+        if i:
+            f.write("\n")
+        f.write(line)
+
+
+def write_output(path, lines, verify=None):
+    """
+    Streams generated code to 'path', creating the output directory if needed.
+    The code goes to a temporary file first; an existing file that already holds
+    exactly this code is left untouched.
+
+    Args:
+        path (str): Output file path.
+        lines (iterable): Program lines, e.g. from iter_code() (or [generated_code]).
+        verify (callable): Optional check run once all lines are written and before
+            the file is replaced, e.g. ProgramVerifier.check. If it raises, 'path'
+            is left as it was.
+
+    Returns:
+        bool: True if the file was (re)written.
+    """
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            stream_lines(f, lines)
+        if verify is not None:
+            verify()
+        if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+# --- Batch Generation ---
+
+def load_manifest(path):
+    """
+    Reads a batch manifest and returns its stations as a list of dicts.
+
+    The manifest is TOML (or JSON when the file name ends in '.json') with an
+    optional 'defaults' table and a 'stations' array, e.g.:
+
+        [defaults]
+        measure_interval = 30
+
+        [[stations]]
+        logger_type = "CR300"
+        num_sensors = 4
+        output = "generated_programs/cr300/site_a.cr300"
+
+    Raises:
+        ValueError: If a station is missing one of MANIFEST_STATION_KEYS, its
+            sensor count or interval is not an integer, or a list option is malformed.
+    """
+    with open(path, "rb") as f:
+        if path.endswith(".json"):
+            manifest = json.load(f)
+        else:
+            manifest = tomllib.load(f)
+
+    defaults = manifest.get("defaults", {})
+    stations = []
+    for i, entry in enumerate(manifest.get("stations", []), start=1):
+        station = {**defaults, **entry}
+        missing = [key for key in MANIFEST_STATION_KEYS if key not in station]
+        if missing:
+            raise ValueError(f"Station {i} in '{path}' is missing: {', '.join(missing)}")
+        for key in ("num_sensors", "measure_interval"):
+            if isinstance(station[key], bool) or not isinstance(station[key], int):
+                raise ValueError(f"Station {i} in '{path}': '{key}' must be an integer, got {station[key]!r}")
+        for key in LIST_OPTION_KEYS:
+            if station.get(key) is not None:
+                try:
+                    station[key] = list_option(key, station[key])
+                except ValueError as e:
+                    raise ValueError(f"Station {i} in '{path}': {e}") from None
+        station["logger_type"] = str(station["logger_type"]).upper()
+        stations.append(station)
+    return stations
+
+
+def _preload_generators(logger_types):
+    """
+    Batch worker initializer: load every profile the manifest needs up front, so
+    each worker imports the generators and compiles their templates once.
+    """
+    for logger_type in logger_types:
+        if logger_type in profiles.LOGGER_PROFILES:
+            profiles.load_profile(logger_type)
+
+
+def station_generator_args(station):
+    """The keyword arguments a manifest station passes to generate_code."""
+    generator_args = {
+        "num_sensors": station["num_sensors"],
+        "measure_interval_min": station["measure_interval"],
+    }
+    for key in GENERATOR_OPTION_KEYS:
+        if station.get(key) is not None:
+            generator_args[key] = station[key]
+    return generator_args
+
+
+def station_power_args(station):
+    """The power supply (POWER_OPTION_KEYS) a manifest station sets."""
+    return {key: station[key] for key in POWER_OPTION_KEYS if station.get(key) is not None}
+
+
+def _new_result(station):
+    return {"output": station["output"], "ok": False, "cached": False,
+            "error": None, "warning": None, "seconds": 0.0, "scan_s": None,
+            "kb_per_day": None, "wrap_days": None, "ah_per_day": None, "runtime_days": None}
+
+
+def _record_storage(result, estimate, warning):
+    """Copies a storage estimate (and its wrap warning) into a batch result."""
+    result["kb_per_day"] = estimate["bytes_per_day"] / 1024
+    result["wrap_days"] = estimate["days_until_wrap"]
+    result["warning"] = join_messages(result["warning"], warning)
+
+
+def _record_power(result, estimate, warning):
+    """Copies an energy estimate (and its warning) into a batch result."""
+    result["ah_per_day"] = estimate["ah_per_day"]
+    result["runtime_days"] = estimate["runtime_days"]
+    result["warning"] = join_messages(result["warning"], warning)
+
+
+def _generate_station(station, key=None, cache_dir=None):
+    """
+    Batch worker: generates and writes one station's program, returning a result dict.
+    With a cache key and cache_dir, the program is also stored as a cache blob.
+    """
+    start = time.perf_counter()
+    result = _new_result(station)
+
+    error, result["warning"] = check_sensor_config(
+        station["logger_type"], station["num_sensors"], station["measure_interval"], station.get("layout"))
+    if error is None:
+        try:
+            module = load_generator(station["logger_type"])
+            generator_args = station_generator_args(station)
+            budget, budget_error = check_scan_budget(station["logger_type"], module, generator_args)
+            result["scan_s"] = budget["total_s"]
+            if budget_error:
+                error = budget_error
+            else:
+                _record_storage(result, *check_storage(station["logger_type"], module, generator_args))
+                _record_power(result, *check_power(station["logger_type"], module, generator_args,
+                                                   station_power_args(station)))
+                first_line, lines = peek_lines(module.iter_code(**generator_args))
+                if first_line is None:
+                    error = "Error: Code generation failed for an unknown reason."
+                elif is_generator_error(first_line):
+                    error = f"Error from generator module: {first_line}"
+                else:
+                    verifier = ProgramVerifier(station["logger_type"])
+                    write_output(station["output"], verifier.watch(lines), verify=verifier.check)
+                    if cache_dir is not None and key is not None:
+                        result["cache_size"] = ProgramCache(cache_dir).put_file(key, station["output"])
+                    result["ok"] = True
+        except ProgramLimitError as e:
+            error = str(e)
+        except Exception as e:
+            error = f"Error during code generation: {e}"
+
+    result["error"] = error
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _cached_station(station, cache):
+    """
+    Tries to satisfy a station from the cache without generating anything.
+
+    Returns:
+        tuple: (result dict or None on a miss, cache key or None).
+    """
+    start = time.perf_counter()
+    if check_sensor_config(station["logger_type"], station["num_sensors"],
+                           station["measure_interval"], station.get("layout"))[0] is not None:
+        return None, None # Let the worker report the error
+    try:
+        module = load_generator(station["logger_type"])
+        generator_args = station_generator_args(station)
+        budget, budget_error = check_scan_budget(station["logger_type"], module, generator_args)
+        if budget_error:
+            return None, None
+        key = cache_key(module, generator_args)
+        estimate, storage_warning = check_storage(station["logger_type"], module, generator_args)
+        energy, power_warning = check_power(station["logger_type"], module, generator_args,
+                                            station_power_args(station))
+    except Exception:
+        return None, None
+
+    if not cache.output_is_current(key, station["output"]):
+        generated_code = cache.get(key)
+        if generated_code is None:
+            return None, key
+        write_output(station["output"], [generated_code])
+        cache.record_output(key, station["output"])
+
+    result = _new_result(station)
+    result["ok"] = result["cached"] = True
+    result["scan_s"] = budget["total_s"]
+    _record_storage(result, estimate, storage_warning)
+    _record_power(result, energy, power_warning)
+    result["seconds"] = time.perf_counter() - start
+    return result, key
+
+
+def run_batch(stations, jobs=None, cache=None):
+    """
+    Generates every station, spreading the work over a pool of 'jobs' processes.
+    Stations whose program is already cached (see ProgramCache) are not regenerated.
+
+    Returns:
+        list: One result dict per station, in manifest order.
+    """
+    results = [None] * len(stations)
+    keys = [None] * len(stations)
+    if cache is not None:
+        for i, station in enumerate(stations):
+            results[i], keys[i] = _cached_station(station, cache)
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if pending:
+        logger_types = sorted({stations[i]["logger_type"] for i in pending})
+        worker = partial(_generate_station, cache_dir=cache.cache_dir if cache else None)
+        todo = ([stations[i] for i in pending], [keys[i] for i in pending])
+        if jobs == 1 or len(pending) == 1:
+            _preload_generators(logger_types)
+            generated = list(map(worker, *todo))
+        else:
+            from concurrent.futures import ProcessPoolExecutor # Only batch runs use worker processes
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_preload_generators,
+                                     initargs=(logger_types,)) as pool:
+                generated = list(pool.map(worker, *todo))
+        for i, result in zip(pending, generated):
+            results[i] = result
+            if cache is not None and "cache_size" in result:
+                cache.add(keys[i], result["cache_size"])
+                cache.record_output(keys[i], result["output"])
+
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def print_batch_summary(results, elapsed):
+    """Prints a per-file timing table; errors and warnings go to stderr."""
+    width = max([len("Output")] + [len(r["output"]) for r in results])
+    print(f"{'Output':<{width}}  {'Status':<6}  {'Time (ms)':>9}  {'Scan (s)':>8}  "
+          f"{'KB/day':>7}  {'Wrap (d)':>8}  {'Ah/day':>6}  {'Run (d)':>7}")
+    for r in results:
+        status = ("cached" if r["cached"] else "ok") if r["ok"] else "FAILED"
+        scan_s = "-" if r["scan_s"] is None else f"{r['scan_s']:.0f}"
+        kb_per_day = "-" if r["kb_per_day"] is None else f"{r['kb_per_day']:.1f}"
+        wrap_days = "-" if r["wrap_days"] is None else f"{r['wrap_days']:.0f}"
+        ah_per_day = "-" if r["ah_per_day"] is None else f"{r['ah_per_day']:.3f}"
+        runtime_days = "-" if r["runtime_days"] is None else f"{r['runtime_days']:.0f}"
+        print(f"{r['output']:<{width}}  {status:<6}  {r['seconds'] * 1000:>9.1f}  {scan_s:>8}  "
+              f"{kb_per_day:>7}  {wrap_days:>8}  {ah_per_day:>6}  {runtime_days:>7}")
+        if r["warning"]:
+            print(f"  {r['output']}: {r['warning']}", file=sys.stderr)
+        if r["error"]:
+            print(f"  {r['output']}: {r['error']}", file=sys.stderr)
+    failed = sum(1 for r in results if not r["ok"])
+    cached = sum(1 for r in results if r["cached"])
+    print(f"{len(results)} station(s): {len(results) - failed} ok ({cached} cached), "
+          f"{failed} failed in {elapsed:.2f} s")
+
+
+def add_cache_arguments(parser):
+    """Adds the output cache options shared by single and batch generation."""
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always regenerate, ignoring and not updating the output cache."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the generated-program cache (default: {DEFAULT_CACHE_DIR})."
+    )
+
+
+def batch_main(argv):
+    """Entry point for 'python -m src.main batch MANIFEST'. Returns the exit code."""
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main batch",
+        description="Generate CRBasic programs for every station listed in a TOML/JSON manifest.",
+    )
+    parser.add_argument("manifest", help="Path to the batch manifest (.toml or .json).")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per CPU; 1 runs in-process)."
+    )
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        stations = load_manifest(args.manifest)
+    except (OSError, ValueError, tomllib.TOMLDecodeError) as e:
+        print(f"Error reading manifest '{args.manifest}': {e}", file=sys.stderr)
+        return 1
+    if not stations:
+        print(f"Error: Manifest '{args.manifest}' lists no stations.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    cache = None if args.no_cache else ProgramCache(args.cache_dir)
+    results = run_batch(stations, jobs=args.jobs, cache=cache)
+    print_batch_summary(results, time.perf_counter() - start)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+# --- Data Merge ---
+
+def merge_main(argv):
+    """Entry point for 'python -m src.main merge TABLE_FILES... -t T -o OUTPUT'. Returns the exit code."""
+    from src import merge
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main merge",
+        description="Merge the per-sensor CR200X Table_S{n} TOA5 files of one station into a single\n"
+                    "wide table in the CR300 SapFlowAll layout.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("tables", nargs="+", metavar="TABLE_FILE",
+                        help="TOA5 files collected from the Table_S{n} tables, one per sensor.")
+    parser.add_argument(
+        "-t", "--measure-interval",
+        type=int,
+        required=True,
+        help="The measurement interval in minutes the program was generated with (T)."
+    )
+    parser.add_argument(
+        "-o", "--output",
+        metavar="FILENAME",
+        required=True,
+        help="Output TOA5 file for the merged table."
+    )
+    parser.add_argument(
+        "--no-fill-gaps",
+        dest="fill_gaps",
+        action="store_false",
+        help="Do not add records for intervals in which no table has a record."
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    written = {"lines": 0}
+
+    def counted(lines):
+        for line in lines:
+            written["lines"] += 1
+            yield line
+
+    try:
+        lines = merge.iter_merged_lines(args.tables, args.measure_interval, fill_gaps=args.fill_gaps)
+        _, lines = peek_lines(lines) # Checks every input header before the output is created
+        write_output(args.output, counted(lines))
+    except (OSError, ValueError) as e:
+        print(f"Error merging tables: {e}", file=sys.stderr)
+        return 1
+    print(f"Merged {len(args.tables)} table(s) into '{args.output}': "
+          f"{written['lines'] - merge.TOA5_HEADER_LINES} records in {time.perf_counter() - start:.2f} s.")
+    return 0
+
+
+# --- Sap Flux Processing ---
+
+def sapflux_main(argv):
+    """Entry point for 'python -m src.main sapflux DATA_FILES... -o OUTPUT'. Returns the exit code."""
+    from src import reader, sapflux # Needs NumPy (the optional 'data' dependencies)
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main sapflux",
+        description="Compute heat velocity, sap flux density and tree water use from the logged\n"
+                    "alpha, beta and tMax values of a generated program's data files.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("data", nargs="+", metavar="DATA_FILE",
+                        help="TOA5 or TOB1 files of one table, in time order.")
+    parser.add_argument("--logger-type", type=str.upper, required=True, choices=LOGGER_TYPES,
+                        help="The logger the program was generated for.")
+    parser.add_argument("-n", "--num-sensors", type=int, required=True,
+                        help="The number of sensors the program was generated with (N).")
+    parser.add_argument("-t", "--measure-interval", type=int, required=True,
+                        help="The measurement interval in minutes (T).")
+    parser.add_argument("--table", default="SapFlowAll",
+                        help="Table of the data files (default: SapFlowAll; CR200X: Table_S{n}, or\n"
+                             "SapFlowAll for a table merged with 'merge').")
+    parser.add_argument("--trees", metavar="TOML",
+                        help="Per-sensor probe and tree parameters (see src/sapflux.py).")
+    parser.add_argument("--chunk-rows", type=int, default=sapflux.DEFAULT_CHUNK_ROWS,
+                        help=f"Records processed per chunk (default: {sapflux.DEFAULT_CHUNK_ROWS}).")
+    parser.add_argument("-o", "--output", metavar="FILENAME", required=True,
+                        help="Output TOA5 file for the results.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        schema = reader.table_schema(args.logger_type, args.table, args.num_sensors, args.measure_interval)
+        trees = sapflux.load_tree_params(args.trees) if args.trees else None
+        addresses = list(sapflux.find_inputs(schema))
+        chunks = sapflux.iter_processed_chunks(args.data, schema, trees, args.chunk_rows)
+        environment = ["TOA5", os.path.splitext(os.path.basename(args.output))[0], args.logger_type, f"{args.table}_SapFlux"]
+        write_output(args.output, sapflux.iter_result_lines(chunks, addresses, environment))
+    except (OSError, ValueError, tomllib.TOMLDecodeError) as e:
+        print(f"Error processing sap flux data: {e}", file=sys.stderr)
+        return 1
+    print(f"Processed {len(args.data)} file(s) for {len(addresses)} sensor(s) into '{args.output}' "
+          f"in {time.perf_counter() - start:.2f} s.")
+    return 0
+
+
+# --- Data Archive ---
+
+def ingest_main(argv):
+    """Entry point for 'python -m src.main ingest ARCHIVE DATA_FILES...'. Returns the exit code."""
+    from src import archive # Needs NumPy (the optional 'data' dependencies)
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main ingest",
+        description="Append TOA5/TOB1 downloads of one table to a columnar, time-indexed archive.\n"
+                    "The first ingest creates the archive and needs the generator configuration;\n"
+                    "later ingests take it from the archive. Already archived records are skipped.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("archive", help="Archive directory.")
+    parser.add_argument("data", nargs="+", metavar="DATA_FILE", help="TOA5 or TOB1 files of the table.")
+    parser.add_argument("--logger-type", type=str.upper, choices=LOGGER_TYPES,
+                        help="New archive: the logger the program was generated for.")
+    parser.add_argument("-n", "--num-sensors", type=int, help="New archive: the number of sensors (N).")
+    parser.add_argument("-t", "--measure-interval", type=int, help="New archive: the measurement interval in minutes (T).")
+    parser.add_argument("--table", default="SapFlowAll", help="New archive: the table (default: SapFlowAll).")
+    parser.add_argument("--fp2", dest="fp2_measurements", metavar="MEASUREMENTS", type=comma_list, default=None,
+                        help="New archive (CR300): the program's --fp2 option.")
+    parser.add_argument("--decimate", dest="decimation", metavar="GROUP=K,...", type=decimation_map, default=None,
+                        help="New archive: the program's --decimate option.")
+    parser.add_argument("--layout", choices=["packed"], default=None,
+                        help="New archive (CR200X): the program's --layout option.")
+    parser.add_argument("--measurements", metavar="MEASUREMENTS", type=comma_list, default=None,
+                        help="New archive (CR200X packed layout): the program's --measurements option.")
+    parser.add_argument("--qc", action="store_true",
+                        help="Quality-check the records this ingest adds (NAN bursts, stuck values, spikes,\n"
+                             "alpha/beta range, battery sag) and print the flags per sensor. The running\n"
+                             "state is kept in the archive (qc_state.json), so each ingest checks only\n"
+                             "its new records.")
+    parser.add_argument("--qc-flags", metavar="CSV_FILE", default=None,
+                        help="With --qc: append the flagged values to this CSV file.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        if not os.path.exists(os.path.join(args.archive, archive.INDEX_FILE)):
+            if None in (args.logger_type, args.num_sensors, args.measure_interval):
+                print(f"Error: '{args.archive}' is not an archive yet; give --logger-type, -n and -t "
+                      f"to create it.", file=sys.stderr)
+                return 1
+            generator_kwargs = {key: getattr(args, key)
+                                for key in ("fp2_measurements", "decimation", "layout", "measurements")
+                                if getattr(args, key) is not None}
+            archive.create_archive(args.archive, args.logger_type, args.table, args.num_sensors,
+                                   args.measure_interval, **generator_kwargs)
+        qc_state = qc_flags = on_added = None
+        if args.qc:
+            from src import qc
+            qc_path = os.path.join(args.archive, qc.STATE_FILE)
+            qc_state = qc.load_state(qc_path, archive.archive_schema(archive.open_archive(args.archive)))
+            qc_flags = []
+
+            def on_added(records):
+                qc_flags.extend(qc.check(qc_state, records))
+        stats = archive.ingest(args.archive, args.data, on_added=on_added)
+        if args.qc:
+            qc.save_state(qc_path, qc_state)
+            if args.qc_flags:
+                qc.write_flags(args.qc_flags, qc_flags)
+        summary = archive.archive_summary(archive.open_archive(args.archive))
+    except (OSError, ValueError) as e:
+        print(f"Error ingesting into '{args.archive}': {e}", file=sys.stderr)
+        return 1
+    print(summary)
+    print(f"Ingested {stats['records']} records from {len(args.data)} file(s): {stats['added']} added, "
+          f"{stats['duplicates']} already archived, {len(stats['chunks'])} chunk(s) written "
+          f"in {time.perf_counter() - start:.2f} s.")
+    if args.qc:
+        print(qc.format_report(qc_state, qc_flags))
+    return 0
+
+
+# --- Scan Timing Analysis ---
+
+def scandiag_main(argv):
+    """Entry point for 'python -m src.main scandiag DATA_FILES...'. Returns the exit code."""
+    from src import reader, scan_timing # Needs NumPy (the optional 'data' dependencies)
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main scandiag",
+        description="Report SDI-12 latency percentiles and trends per sensor address from the\n"
+                    "ScanDiag table of a program generated with --instrument.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("data", nargs="+", metavar="DATA_FILE", help="TOA5 or TOB1 files of the ScanDiag table.")
+    parser.add_argument("--logger-type", type=str.upper, required=True, choices=LOGGER_TYPES,
+                        help="The logger the program was generated for.")
+    parser.add_argument("-n", "--num-sensors", type=int, required=True,
+                        help="The number of sensors the program was generated with (N).")
+    parser.add_argument("-t", "--measure-interval", type=int, required=True,
+                        help="The measurement interval in minutes (T).")
+    args = parser.parse_args(argv)
+
+    try:
+        schema = scan_timing.instrument_schema(args.logger_type, args.num_sensors, args.measure_interval)
+        data = reader.read_archive(args.data, schema)
+    except (OSError, ValueError) as e:
+        print(f"Error reading scan diagnostics: {e}", file=sys.stderr)
+        return 1
+    if not len(data):
+        print("Error: The ScanDiag files hold no records.", file=sys.stderr)
+        return 1
+    print(scan_timing.format_report(scan_timing.analyze(data, args.measure_interval)))
+    return 0
+
+
+# --- Benchmarks ---
+
+def bench_main(argv):
+    """Entry point for 'python -m src.main bench'. Returns the exit code."""
+    from src import bench
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main bench",
+        description="Benchmark the generators over logger type x sensor count x interval, compare\n"
+                    "wall time, peak memory, program size, DataTable fields and scan time with the\n"
+                    "committed baseline, and check the golden programs in the manifest.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--logger-type", type=str.upper, choices=LOGGER_TYPES, default=None,
+                        help="Sweep only this logger type (default: all).")
+    parser.add_argument("-t", "--intervals", type=lambda value: [int(item) for item in comma_list(value)],
+                        default=list(bench.DEFAULT_INTERVALS),
+                        help=f"Comma-separated intervals in minutes (default: "
+                             f"{','.join(map(str, bench.DEFAULT_INTERVALS))}).")
+    parser.add_argument("--repeat", type=int, default=bench.DEFAULT_REPEAT,
+                        help=f"Timed runs per configuration; the fastest counts (default: {bench.DEFAULT_REPEAT}).")
+    parser.add_argument("--baseline", default=bench.BASELINE_PATH,
+                        help=f"Baseline file (default: {bench.BASELINE_PATH}).")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store this sweep's results as the baseline instead of comparing.")
+    parser.add_argument("--no-timing", action="store_true",
+                        help="Do not fail on wall time (e.g. on a shared or slower machine).")
+    parser.add_argument("--manifest", default="generated_programs/manifest.toml",
+                        help="Manifest of the golden programs (default: generated_programs/manifest.toml).")
+    parser.add_argument("--no-golden", action="store_true", help="Skip the golden-output check.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every run's results.")
+    args = parser.parse_args(argv)
+
+    logger_types = [args.logger_type] if args.logger_type else LOGGER_TYPES
+    configs = bench.sweep_configs(logger_types, args.intervals)
+    start = time.perf_counter()
+    results = bench.run_sweep(load_generator, configs, args.repeat)
+    print(f"Benchmarked {len(results)} configuration(s) in {time.perf_counter() - start:.1f} s.")
+    if args.verbose:
+        print(bench.format_results(results))
+
+    failed = False
+    try:
+        baseline = bench.load_baseline(args.baseline)
+    except (OSError, ValueError) as e:
+        print(f"Error reading baseline: {e}", file=sys.stderr)
+        return 1
+    if args.update_baseline:
+        bench.save_baseline(results, args.baseline, merge_with=baseline)
+        print(f"Baseline '{args.baseline}' updated.")
+    elif not baseline:
+        print(f"Error: No baseline at '{args.baseline}'; create it with --update-baseline.", file=sys.stderr)
+        failed = True
+    else:
+        regressions, improvements, missing = bench.compare(results, baseline, timing=not args.no_timing)
+        report = bench.format_comparison(regressions, improvements, missing)
+        if report:
+            print(report)
+        if regressions:
+            print(f"Error: {len(regressions)} regression(s) against '{args.baseline}'. If they are intended, "
+                  f"update the baseline with --update-baseline.", file=sys.stderr)
+            failed = True
+        else:
+            print(f"No regressions against '{args.baseline}'.")
+
+    if not args.no_golden:
+        try:
+            stations = load_manifest(args.manifest)
+        except (OSError, ValueError, tomllib.TOMLDecodeError) as e:
+            print(f"Error reading manifest '{args.manifest}': {e}", file=sys.stderr)
+            return 1
+        mismatches = 0
+        for station in stations:
+            module = load_generator(station["logger_type"])
+            diff = bench.golden_diff(station["output"], module.iter_code(**station_generator_args(station)))
+            if diff:
+                mismatches += 1
+                print(f"Golden output differs: {station['output']}", file=sys.stderr)
+                for line in diff[:bench.GOLDEN_DIFF_LINES]:
+                    print(f"  {line}", file=sys.stderr)
+                if len(diff) > bench.GOLDEN_DIFF_LINES:
+                    print(f"  ... {len(diff) - bench.GOLDEN_DIFF_LINES} more diff lines", file=sys.stderr)
+        print(f"Golden outputs: {len(stations) - mismatches} of {len(stations)} match.")
+        failed = failed or mismatches > 0
+    return 1 if failed else 0
+
+
+# --- Provisioning service ---
+
+def serve_main(argv):
+    """Entry point for 'python -m src.main serve'. Returns the exit code."""
+    import asyncio
+    from src import service
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.main serve",
+        description="Run a local provisioning service: POST station configurations as JSON to\n"
+                    "/generate and get the programs back with their metadata; GET /metrics for\n"
+                    "request latency and throughput. Workers keep the generators loaded.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--host", default=service.DEFAULT_HOST,
+                        help=f"Address to listen on (default: {service.DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=service.DEFAULT_PORT,
+                        help=f"Port to listen on (default: {service.DEFAULT_PORT}; 0 picks a free port).")
+    parser.add_argument("--unix-socket", default=None,
+                        help="Listen on this Unix socket path instead of host and port.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Worker processes (default: one per CPU). 0 generates in the service process.")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 0:
+        print("Error: --workers must be 0 or more.", file=sys.stderr)
+        return 1
+
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix_socket, args.workers,
+                                  ready=lambda address: print(f"Serving on {address}. Press Ctrl+C to stop.",
+                                                              flush=True)))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error starting the service: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "batch":
+        sys.exit(batch_main(argv[1:]))
+    if argv and argv[0] == "merge":
+        sys.exit(merge_main(argv[1:]))
+    if argv and argv[0] == "sapflux":
+        sys.exit(sapflux_main(argv[1:]))
+    if argv and argv[0] == "ingest":
+        sys.exit(ingest_main(argv[1:]))
+    if argv and argv[0] == "scandiag":
+        sys.exit(scandiag_main(argv[1:]))
+    if argv and argv[0] == "bench":
+        sys.exit(bench_main(argv[1:]))
+    if argv and argv[0] == "serve":
+        sys.exit(serve_main(argv[1:]))
 
-def main():
     parser = argparse.ArgumentParser(
         description="Generate CRBasic code for Implexx Sap Flow Sensors.",
         formatter_class=argparse.RawTextHelpFormatter,
@@ -17,8 +832,12 @@ Example usage:
   uv run python -m src.main --logger-type CR200X -n 2 -t 30 -o generated_programs/sapflux_cr200x.cr2
   uv run python src/main.py --logger-type CR300 -n 1 -t 15 # (If CWD is project root)
 
+  Generate every station in a manifest (see generated_programs/manifest.toml):
+  uv run python -m src.main batch generated_programs/manifest.toml
+
 Notes:
-  - CR200X generated code uses one DataTable per sensor.
+  - CR200X generated code uses one DataTable per sensor (8 sensors at most);
+    --layout packed shares tables between sensors.
   - CR300 generated code aims for a single comprehensive DataTable.
 """
     )
@@ -28,7 +847,7 @@ Notes:
         "--logger-type",
         type=str.upper,
         required=True,
-        choices=["CR200X", "CR300"],
+        choices=LOGGER_TYPES,
         help="Specify the target datalogger type (e.g., CR200X, CR300)."
     )
     parser.add_argument(
@@ -51,67 +870,175 @@ Notes:
         type=str,
         help="Optional: Output filename for the generated CRBasic code."
     )
+    parser.add_argument(
+        "--sdi12-mode",
+        choices=["sequential", "concurrent"],
+        default=None,
+        help="Optional (CR300 only): 'sequential' (default) issues blocking M! commands one sensor\n"
+             "after another; 'concurrent' starts C! on all sensors, waits once, then collects."
+    )
+    parser.add_argument(
+        "--sdi12-ports",
+        metavar="PORTS",
+        type=comma_list,
+        default=None,
+        help="Optional (CR300 only): Comma-separated SDI-12 ports to balance the sensors\n"
+             "across (e.g. C1,C2). The buses are measured in parallel."
+    )
+    parser.add_argument(
+        "--layout",
+        choices=["unrolled", "rolled", "packed"],
+        default=None,
+        help="Optional: 'unrolled' (default) writes per-sensor variables and lines.\n"
+             "CR300: 'rolled' uses sensor-indexed arrays and loops, so the program size stays\n"
+             "nearly constant as the sensor count grows. Both log the same columns.\n"
+             "CR200X: 'packed' bin-packs the --measurements of all sensors into as few\n"
+             "16-field tables as possible instead of one table per sensor, so more than\n"
+             "8 sensors fit when their fields fit the 8 tables (e.g. 14 with the M! values)."
+    )
+    parser.add_argument(
+        "--fp2",
+        dest="fp2_measurements",
+        metavar="MEASUREMENTS",
+        type=comma_list,
+        default=None,
+        help="Optional (CR300 only): Comma-separated measurements to store as FP2 instead of\n"
+             "IEEE4, by alias suffix (e.g. TpDsOut,tMxTout) or group ('temperatures', 'times')."
+    )
+    parser.add_argument(
+        "--decimate",
+        dest="decimation",
+        metavar="GROUP=K,...",
+        type=decimation_map,
+        default=None,
+        help="Optional (CR300, CR200X packed layout): Collect a measurement group only every\n"
+             "Kth scan, e.g. M1=4,M2=4,M5=12. Decimated values go to separate lower-rate tables\n"
+             "(CR300: SapFlowDiag, CR200X: Diag{K}_n); M! keeps the full rate."
+    )
+    parser.add_argument(
+        "--measurements",
+        metavar="MEASUREMENTS",
+        type=comma_list,
+        default=None,
+        help="Optional (CR200X packed layout only): Comma-separated values to log, by alias\n"
+             "prefix (e.g. SapFlwTot,TpDsOut), command (M!, M1, M2, M5) or 'all'\n"
+             "(default: the 9 M! values)."
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        default=None,
+        help="Optional: Time every SDI-12 call and the scan, and log the latencies, process time\n"
+             "and skipped-scan/watchdog counters to a ScanDiag table on every scan\n"
+             "(analyze it with 'scandiag')."
+    )
+    parser.add_argument(
+        "--scan-budget",
+        action="store_true",
+        help="Print the per-sensor worst-case scan time breakdown (to stderr)."
+    )
+    parser.add_argument(
+        "--storage",
+        action="store_true",
+        help="Print bytes per record, records and KB per day, and days until the tables wrap\n"
+             "(to stderr)."
+    )
+    parser.add_argument(
+        "--power",
+        action="store_true",
+        help="Print the daily energy budget per sensor and for the logger, and the battery\n"
+             "run time and smallest sustainable interval for --battery-ah/--solar-w (to stderr)."
+    )
+    parser.add_argument(
+        "--battery-ah",
+        type=float,
+        default=None,
+        help="Optional: Battery capacity in Ah, for the run time and the solar reserve."
+    )
+    parser.add_argument(
+        "--solar-w",
+        type=float,
+        default=None,
+        help="Optional: Solar panel rating in W; warns if it cannot sustain the interval."
+    )
+    parser.add_argument(
+        "--sun-hours",
+        type=float,
+        default=None,
+        help=f"Optional: Peak sun hours per day for --solar-w (default: {power.SOLAR_SUN_HOURS:g},\n"
+             "a worst-month value)."
+    )
+    add_cache_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    # --- Basic Input Validation ---
-    if args.num_sensors < 1:
-        print("Error: Number of sensors must be at least 1.", file=sys.stderr)
+    # --- Input Validation ---
+    error, warning = check_sensor_config(args.logger_type, args.num_sensors, args.measure_interval, args.layout)
+    if error:
+        print(error, file=sys.stderr)
         sys.exit(1)
-    if args.measure_interval <= 0:
-         print("Error: Measurement interval must be a positive integer.", file=sys.stderr)
-         sys.exit(1)
+    if warning:
+        print(warning, file=sys.stderr)
 
     # --- Dynamically select and call the generator module ---
-    generated_code = None
-    generator_module_name_short = None # e.g., "cr200x_generator"
-    generator_module_full_path = None  # e.g., "src.cr200x_generator"
-    generator_kwargs = {}
-
-    if args.logger_type == "CR200X":
-        generator_module_name_short = "cr200x_generator"
-        # MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR is 8
-        if not (1 <= args.num_sensors <= 8):
-            print(f"Error: For CR200X (one table per sensor), "
-                  f"number of sensors must be between 1 and 8. Requested: {args.num_sensors}",
-                  file=sys.stderr)
-            sys.exit(1)
-        # MIN_MEASURE_INTERVAL_MINUTES_IMPLEX_CR200X is 15
-        if args.measure_interval < 15:
-             print(f"Warning: Implexx sensors on CR200X typically recommend a measurement interval of at least 15 minutes. "
-                   f"Requested: {args.measure_interval} min.",
-                   file=sys.stderr)
-
-    elif args.logger_type == "CR300":
-        generator_module_name_short = "cr300_generator"
-        # MAX_SDI12_SENSORS_CR300 is 62
-        if not (1 <= args.num_sensors <= 62):
-            print(f"Error: Number of sensors for CR300 must be between 1 and 62. Requested: {args.num_sensors}",
-                  file=sys.stderr)
+    lines = None
+    generator_module_name_short = profiles.get_profile(args.logger_type)["generator"] # e.g., "cr200x_generator"
+    generator_module_full_path = f"src.{generator_module_name_short}" # e.g., "src.cr200x_generator"
+    generator_kwargs = {key: getattr(args, key) for key in GENERATOR_OPTION_KEYS
+                        if getattr(args, key) is not None}
+    generator_args = {
+        "num_sensors": args.num_sensors,
+        "measure_interval_min": args.measure_interval,
+        **generator_kwargs
+    }
+    cache = None if args.no_cache else ProgramCache(args.cache_dir)
+    key = None
+
+    try:
+        module = load_generator(args.logger_type)
+
+        # --- Scan-Time Budget ---
+        budget, budget_error = check_scan_budget(args.logger_type, module, generator_args)
+        if args.scan_budget or budget_error:
+            print(scan_budget.format_budget(budget), file=sys.stderr)
+        if budget_error:
+            print(budget_error, file=sys.stderr)
             sys.exit(1)
-        # MIN_MEASURE_INTERVAL_MINUTES_IMPLEX is 10
-        if args.measure_interval < 10:
-             print(f"Warning: Implexx sensors recommend a data collect interval of at least 10 minutes. "
-                   f"Requested: {args.measure_interval} min.",
-                   file=sys.stderr)
-    else:
-        print(f"Error: Unsupported logger type '{args.logger_type}'.", file=sys.stderr)
-        sys.exit(1)
 
-    # Construct the full module path assuming main.py is in 'src' and generators are siblings
-    # This relies on 'src' or its parent being effectively on PYTHONPATH
-    # which `python -m src.main` or `uv run python src/main.py` (from root) should handle.
-    generator_module_full_path = f"src.{generator_module_name_short}"
+        # --- Storage Footprint ---
+        estimate, storage_warning = check_storage(args.logger_type, module, generator_args)
+        if args.storage:
+            print(storage.format_storage(estimate), file=sys.stderr)
+        if storage_warning:
+            print(storage_warning, file=sys.stderr)
 
-    try:
-        # Dynamically import the module
-        module = importlib.import_module(generator_module_full_path)
-        # Call the consistent function name 'generate_code'
-        generated_code = module.generate_code(
-            num_sensors=args.num_sensors,
-            measure_interval_min=args.measure_interval,
-            **generator_kwargs
-        )
+        # --- Energy Budget ---
+        power_args = {key: getattr(args, key) for key in POWER_OPTION_KEYS if getattr(args, key) is not None}
+        energy, power_warning = check_power(args.logger_type, module, generator_args, power_args)
+        if args.power:
+            print(power.format_energy(energy), file=sys.stderr)
+        if power_warning:
+            print(power_warning, file=sys.stderr)
+
+        if cache is not None:
+            key = cache_key(module, generator_args)
+            if args.output and cache.output_is_current(key, args.output):
+                cache.save()
+                print(f"CRBasic code in '{args.output}' is up to date (cached); not rewritten.")
+                return
+            cached_code = cache.get(key)
+            if cached_code is not None:
+                lines = [cached_code]
+        if lines is None:
+            # Call the consistent streaming function 'iter_code'; lines are generated
+            # lazily while they are written out below.
+            first_line, lines = peek_lines(module.iter_code(**generator_args))
+            if first_line is None:
+                print("Error: Code generation failed for an unknown reason.", file=sys.stderr)
+                sys.exit(1)
+            if is_generator_error(first_line): # Check if the generator function returned an error string
+                print(f"Error from generator module:\n{first_line}", file=sys.stderr)
+                sys.exit(1)
     except ImportError as e:
         print(f"Error: Could not import generator module '{generator_module_full_path}'. "
               f"Details: {e}\n"
@@ -120,7 +1047,7 @@ Notes:
               f"or 'uv run python src/main.py ...').", file=sys.stderr)
         sys.exit(1)
     except AttributeError:
-        print(f"Error: The module '{generator_module_full_path}' does not have a 'generate_code' function.", file=sys.stderr)
+        print(f"Error: The module '{generator_module_full_path}' does not have an 'iter_code' function.", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         print(f"Error during code generation with '{generator_module_full_path}': {e}", file=sys.stderr)
@@ -128,29 +1055,35 @@ Notes:
 
 
     # --- Output Handling ---
-    if generated_code:
-        if "' Error:" in generated_code: # Check if the generator function returned an error string
-            print(f"Error from generator module:\n{generated_code}", file=sys.stderr)
-            sys.exit(1)
-
+    # The program is checked against the logger's limits (see verifier.py) as it
+    # is written; a file is only replaced if it passes.
+    verifier = ProgramVerifier(args.logger_type)
+    lines = verifier.watch(lines)
+    try:
         if args.output:
-            try:
-                # Ensure the output directory exists if specified in the path
-                import os
-                output_dir = os.path.dirname(args.output)
-                if output_dir and not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                with open(args.output, "w") as f:
-                    f.write(generated_code)
+            if write_output(args.output, lines, verify=verifier.check):
                 print(f"CRBasic code generated and saved to '{args.output}'.")
-            except IOError as e:
-                print(f"Error writing to file '{args.output}': {e}", file=sys.stderr)
-                sys.exit(1)
+            else:
+                print(f"CRBasic code in '{args.output}' is unchanged; not rewritten.")
+            if cache is not None:
+                if key not in cache.entries:
+                    cache.add(key, cache.put_file(key, args.output))
+                cache.record_output(key, args.output)
         else:
-            print(generated_code)
-    else:
-        print("Error: Code generation failed for an unknown reason.", file=sys.stderr)
+            stream_lines(sys.stdout, lines)
+            sys.stdout.write("\n")
+            verifier.check()
+    except ProgramLimitError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except IOError as e:
+        print(f"Error writing to '{args.output or 'stdout'}': {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error during code generation with '{generator_module_full_path}': {e}", file=sys.stderr)
         sys.exit(1)
+    if cache is not None:
+        cache.save()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,239 @@
+# src/merge.py
+
+import csv
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+from src import cr200x_generator, cr300_generator
+
+# Streaming merge of the per-sensor CR200X tables into one wide table.
+#
+# The CR200X program writes one Table_S{n} per sensor (16 fields per table), so
+# a station's data arrives as up to 8 TOA5 files. They are merged on TIMESTAMP
+# with a k-way heap merge that holds one record per file, and written as a
+# single table in the CR300 SapFlowAll layout (S{n}_AlpOut, ...), so data from
+# both logger families goes through the same analysis.
+#
+# Output columns: the SapFlowAll columns for the same number of sensors, then
+# per sensor the M! values the CR300 program does not log (S{n}_SapFlwTot,
+# S{n}_VhOuter, S{n}_VhInner) and its status (STATUS_*). SapFlowAll columns the
+# CR200X does not measure (PTemp_C, the M1!/M2!/M5! diagnostics) are NAN.
+
+TABLE_NAME = cr300_generator.TABLE_NAME
+
+# CR200X measurement alias prefix -> SapFlowAll alias suffix of the same M! value
+CR200X_TO_SAPFLOWALL = {
+    "AlphaOut": "AlpOut", "AlphaIn": "AlpInn",
+    "BetaOut": "BetOut", "BetaIn": "BetInn",
+    "tMaxTout": "tMxTout", "tMaxTin": "tMxTinn",
+}
+BATTERY_FIELD = "BattV_Min"     # CR200X column
+SAPFLOWALL_BATTERY = "Batt_volt" # SapFlowAll column
+
+# Per-sensor status of each merged record
+STATUS_OK = 0
+STATUS_NAN = 1     # The sensor's record is there but every measurement is NAN (no reply)
+STATUS_MISSING = 2 # The sensor's table has no record at this timestamp
+
+NAN = "NAN"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TOA5_HEADER_LINES = 4 # Environment, field names, units, processing
+
+# Addresses of the sensors a CR200X program can hold, in table order
+CR200X_ADDRESSES = [cr200x_generator.get_sdi12_address_char(i)
+                    for i in range(cr200x_generator.MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR)]
+
+
+def status_column(sdi_address_char):
+    return f"S{sdi_address_char}_Status"
+
+
+def merged_table_layout(num_sensors, measure_interval_min):
+    """
+    Describes the merged wide table, in the form of the generators' table_layout()
+    entries ({'name', 'interval_min', 'fields'}), so it can be used with
+    storage.estimate_storage() or as a reader schema.
+    """
+    core = cr300_generator.table_layout(num_sensors, measure_interval_min)[0]
+    fields = [dict(field) for field in core["fields"]]
+    for i in range(num_sensors):
+        sdi_address_char = cr200x_generator.get_sdi12_address_char(i)
+        for alias_prefix, unit in cr200x_generator.STANDARD_MEASUREMENTS:
+            if alias_prefix not in CR200X_TO_SAPFLOWALL:
+                fields.append({"name": f"S{sdi_address_char}_{alias_prefix}", "data_type": "IEEE4",
+                               "unit": unit, "sensor": sdi_address_char, "measurement": alias_prefix})
+        fields.append({"name": status_column(sdi_address_char), "data_type": "IEEE4", "unit": None,
+                       "sensor": sdi_address_char, "measurement": None})
+    return {"name": TABLE_NAME, "interval_min": measure_interval_min, "fields": fields}
+
+
+def _sensor_field_map(sdi_address_char):
+    """Merged column name -> CR200X column name, for one sensor's mapped values."""
+    mapping = {f"S{sdi_address_char}_{suffix}": f"{prefix}{sdi_address_char}"
+               for prefix, suffix in CR200X_TO_SAPFLOWALL.items()}
+    for alias_prefix, _ in cr200x_generator.STANDARD_MEASUREMENTS:
+        if alias_prefix not in CR200X_TO_SAPFLOWALL:
+            mapping[f"S{sdi_address_char}_{alias_prefix}"] = f"{alias_prefix}{sdi_address_char}"
+    return mapping
+
+
+def _is_nan(token):
+    return token.strip().upper() in ("NAN", "")
+
+
+# --- Input ---
+
+def read_toa5_header(path):
+    """Returns the 4 header rows of a TOA5 file (environment, names, units, processing)."""
+    with open(path, newline="") as f:
+        rows = csv.reader(f)
+        header = [next(rows, []) for _ in range(TOA5_HEADER_LINES)]
+    if not header[0] or header[0][0] != "TOA5":
+        raise ValueError(f"'{path}' is not a TOA5 file.")
+    return header
+
+
+def table_sensor(path, measure_interval_min):
+    """
+    Identifies which sensor's Table_S{n} a TOA5 file holds, from its field names,
+    and checks them against the generated table layout.
+
+    Returns:
+        str: The sensor's SDI-12 address character.
+
+    Raises:
+        ValueError: If the file is not a CR200X per-sensor table.
+    """
+    names = read_toa5_header(path)[1]
+    addresses = [name[len("SensorAddress"):] for name in names if name.startswith("SensorAddress")]
+    if len(addresses) != 1 or addresses[0] not in CR200X_ADDRESSES:
+        raise ValueError(f"'{path}' is not a CR200X Table_S{{n}} file (no SensorAddress field).")
+    address = addresses[0]
+    index = CR200X_ADDRESSES.index(address)
+    expected = ["TIMESTAMP", "RECORD"] + [
+        field["name"] for field in cr200x_generator.table_layout(index + 1, measure_interval_min)[index]["fields"]]
+    if names != expected:
+        raise ValueError(f"'{path}' does not match the generated Table_S{address} layout "
+                         f"(expected fields: {', '.join(expected)}).")
+    return address
+
+
+def _iter_table_records(path, sensor_index):
+    """
+    Yields (timestamp, sensor_index, {field: value token}) for each record of a
+    TOA5 file, skipping repeated records. The file must be in time order.
+    """
+    with open(path, newline="") as f:
+        rows = csv.reader(f)
+        header = [next(rows, []) for _ in range(TOA5_HEADER_LINES)]
+        names = header[1]
+        previous = None
+        for line_number, row in enumerate(rows, start=5):
+            if not row:
+                continue
+            timestamp = datetime.fromisoformat(row[0])
+            if previous is not None and timestamp <= previous:
+                if timestamp == previous:
+                    continue
+                raise ValueError(f"'{path}' line {line_number}: {row[0]} is earlier than the "
+                                 f"record before it; the file is not in time order.")
+            previous = timestamp
+            yield timestamp, sensor_index, dict(zip(names, row))
+
+
+# --- Merge ---
+
+def iter_merged_records(paths, measure_interval_min, fill_gaps=True):
+    """
+    Merges CR200X Table_S{n} files record by record, in bounded memory (one
+    pending record per file).
+
+    Args:
+        paths (list): TOA5 files, one per sensor table, in any order.
+        measure_interval_min (int): The program's measurement interval.
+        fill_gaps (bool): Emit a record with every sensor STATUS_MISSING for each
+            interval in which no table has a record.
+
+    Yields:
+        list: The merged table's header rows (4), then one list of value tokens per
+        record, in merged_table_layout() column order.
+    """
+    sensors = {}
+    for path in paths:
+        address = table_sensor(path, measure_interval_min)
+        if address in sensors:
+            raise ValueError(f"'{path}' and '{sensors[address]}' both hold sensor {address}.")
+        sensors[address] = path
+    if not sensors:
+        raise ValueError("No CR200X table files to merge.")
+    num_sensors = max(CR200X_ADDRESSES.index(address) for address in sensors) + 1
+    addresses = CR200X_ADDRESSES[:num_sensors]
+
+    layout = merged_table_layout(num_sensors, measure_interval_min)
+    columns = [field["name"] for field in layout["fields"]]
+    first_header = read_toa5_header(sensors[min(sensors)])[0]
+    environment = (first_header + [""] * 8)[:7] + [TABLE_NAME]
+    yield environment
+    yield ["TIMESTAMP", "RECORD"] + columns
+    yield ["TS", "RN"] + [field["unit"] or "" for field in layout["fields"]]
+    yield ["", ""] + ["Smp"] * len(columns)
+
+    field_maps = [_sensor_field_map(address) for address in addresses]
+    sensor_of_column = {field["name"]: field["sensor"] for field in layout["fields"]}
+    measurement_fields = [[f"{alias_prefix}{address}" for alias_prefix, _ in cr200x_generator.STANDARD_MEASUREMENTS]
+                          for address in addresses]
+
+    streams = [_iter_table_records(path, addresses.index(address)) for address, path in sensors.items()]
+    interval = timedelta(minutes=measure_interval_min)
+    record = 0
+    previous = None
+    for timestamp, group in itertools.groupby(heapq.merge(*streams, key=lambda item: item[:2]),
+                                              key=lambda item: item[0]):
+        if fill_gaps and previous is not None:
+            gap = previous + interval
+            while gap < timestamp:
+                yield [gap.strftime(TIMESTAMP_FORMAT), str(record)] + [
+                    str(STATUS_MISSING) if column.endswith("_Status") else NAN for column in columns]
+                record += 1
+                gap += interval
+        previous = timestamp
+
+        values = {index: fields for _, index, fields in group}
+        row = [timestamp.strftime(TIMESTAMP_FORMAT), str(record)]
+        battery = next((fields[BATTERY_FIELD] for fields in values.values()
+                        if not _is_nan(fields[BATTERY_FIELD])), NAN)
+        status = {}
+        for index, address in enumerate(addresses):
+            if index not in values:
+                status[address] = STATUS_MISSING
+            elif all(_is_nan(values[index][name]) for name in measurement_fields[index]):
+                status[address] = STATUS_NAN
+            else:
+                status[address] = STATUS_OK
+        for column in columns:
+            address = sensor_of_column[column]
+            if column == SAPFLOWALL_BATTERY:
+                row.append(battery)
+            elif address is None:
+                row.append(NAN)
+            elif column == status_column(address):
+                row.append(str(status[address]))
+            else:
+                index = addresses.index(address)
+                source = field_maps[index].get(column)
+                row.append(values[index][source] if source and index in values else NAN)
+        yield row
+        record += 1
+
+
+def _toa5_line(row, quote_all=False):
+    """One TOA5 line: header rows and timestamps are quoted, as are NAN values."""
+    return ",".join(f'"{token}"' if quote_all or index == 0 or token == NAN else token
+                    for index, token in enumerate(row))
+
+
+def iter_merged_lines(paths, measure_interval_min, fill_gaps=True):
+    """iter_merged_records() rendered as the lines of a TOA5 file."""
+    for line_number, row in enumerate(iter_merged_records(paths, measure_interval_min, fill_gaps)):
+        yield _toa5_line(row, quote_all=line_number < TOA5_HEADER_LINES)
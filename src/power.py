@@ -0,0 +1,203 @@
+# src/power.py
+
+import math
+
+from src import scan_budget
+
+# Energy budget of a generated program on battery and solar power.
+#
+# Every M! fires a heat pulse in the sensor, and on a remote plot that pulse,
+# not the logger, sets the battery and panel size. The model adds up each day's
+# charge from three parts:
+#   - the sensors: a fixed charge per command the program issues, counting
+#     decimated commands (see the CR300 decimation option) only on the scans
+#     they run;
+#   - the logger while a scan runs: the scan length comes from the scan_budget
+#     model, including its SDI-12 waits;
+#   - the quiescent draw of the logger and sensors the rest of the time.
+# All currents are at the nominal SUPPLY_V. The figures are planning values;
+# replace them with measured ones for a site design.
+
+SUPPLY_V = 12.0
+MINUTES_PER_DAY = 24 * 60
+
+# Charge (mA*s) one sensor draws for a command, above its quiescent draw. M!
+# heats the needles (~3 s at ~600 mA) and then samples the temperatures for
+# ~100 s at ~15 mA. M1!/M2!/M5! only report values derived from that pulse. The
+# concurrent C commands draw as much as their M counterparts.
+SENSOR_COMMAND_CHARGE_MAS = {"M!": 3 * 600.0 + 100 * 15.0, "M1!": 15.0, "M2!": 15.0, "M5!": 15.0}
+SENSOR_COMMAND_CHARGE_MAS.update({"C" + cmd[1:]: charge for cmd, charge in SENSOR_COMMAND_CHARGE_MAS.items()})
+SENSOR_QUIESCENT_MA = 0.5
+
+# Per logger profile:
+#   quiescent_ma  - between scans (no radio or other peripherals)
+#   active_ma     - while a scan runs, in place of the quiescent draw
+POWER_PROFILES = {
+    "CR200X": {"quiescent_ma": 0.2, "active_ma": 3.0},
+    "CR300": {"quiescent_ma": 1.5, "active_ma": 10.0},
+}
+
+# Battery and solar design values
+BATTERY_USABLE_FRACTION = 0.5 # Depth of discharge a sealed lead-acid battery tolerates
+SOLAR_SUN_HOURS = 3.0         # Peak sun hours per day in the worst month
+SOLAR_EFFICIENCY = 0.7        # Regulator, charging and panel temperature losses
+AUTONOMY_DAYS = 5             # Days the battery alone must carry a solar-powered station
+
+# A battery-only configuration that runs flat sooner than this gets a warning
+RUNTIME_WARNING_DAYS = 30
+
+
+def command_charge_mah(command):
+    """Charge (mAh) one sensor draws for one command."""
+    return SENSOR_COMMAND_CHARGE_MAS[command] / 3600
+
+
+def _measurement_command(command):
+    """The M form of a concurrent command (C1! -> M1!), as decimation is keyed."""
+    return "M" + command[1:] if command.startswith("C") else command
+
+
+def decimation_cycle(commands, every_scans):
+    """
+    The scans of one decimation cycle, as the commands each one issues.
+
+    Args:
+        commands (list): (port, address_char, command) tuples of a full scan, as
+            returned by a generator module's scan_commands().
+        every_scans (dict): Measurement command -> run every K scans (missing: 1).
+
+    Returns:
+        list: One list of commands per scan of the cycle (the first scan runs them all).
+    """
+    periods = {_measurement_command(command): every_scans.get(_measurement_command(command), 1)
+               for _, _, command in commands}
+    cycle = math.lcm(*periods.values()) if periods else 1
+    return [[item for item in commands if scan % periods[_measurement_command(item[2])] == 0]
+            for scan in range(cycle)]
+
+
+def estimate_energy(logger_type, commands, measure_interval_min, every_scans=None,
+                    battery_ah=None, solar_w=None, sun_hours=SOLAR_SUN_HOURS):
+    """
+    Estimates daily charge use, battery run time and the sustainable interval.
+
+    Args:
+        logger_type (str): Key into POWER_PROFILES and scan_budget.LATENCY_PROFILES.
+        commands (list): (port, address_char, command) tuples of a full scan, as
+            returned by a generator module's scan_commands().
+        measure_interval_min (int): The scan interval in minutes.
+        every_scans (dict): How often each measurement command runs, in scans, as
+            returned by a generator module's command_every_scans(). Default: every scan.
+        battery_ah (float): Optional battery capacity in Ah.
+        solar_w (float): Optional solar panel rating in W.
+        sun_hours (float): Peak sun hours per day for the panel.
+
+    Returns:
+        dict: 'sensors' (address -> mAh per day for its commands), 'scan_s' (mean
+        scan length), 'scans_per_day', the mAh per day of 'sensor_commands_mah',
+        'logger_active_mah' and 'quiescent_mah', the totals 'mah_per_scan'
+        (everything that scales with the scan rate) and 'ah_per_day', the
+        configuration ('battery_ah', 'solar_w', 'sun_hours'), 'runtime_days'
+        (battery only, None without a battery), 'harvest_ah_per_day' and
+        'sustainable' (None without a panel), and 'min_interval_min' (the smallest
+        whole-minute interval the panel and battery sustain with AUTONOMY_DAYS of
+        reserve; None without a panel or if no interval is sustainable).
+    """
+    profile = POWER_PROFILES[logger_type]
+    scans = decimation_cycle(commands, every_scans or {})
+
+    # Sensor charge per scan, averaged over the decimation cycle
+    sensors = {}
+    for scan in scans:
+        for _, address, command in scan:
+            sensors[address] = sensors.get(address, 0.0) + command_charge_mah(command) / len(scans)
+
+    # Scan lengths from the scan-time model, once per distinct set of commands
+    scan_seconds = {}
+    for scan in scans:
+        key = tuple(scan)
+        if key not in scan_seconds:
+            scan_seconds[key] = scan_budget.estimate_scan(logger_type, scan, measure_interval_min)["total_s"]
+    scan_s = sum(scan_seconds[tuple(scan)] for scan in scans) / len(scans)
+    full_scan = scan_budget.estimate_scan(logger_type, commands, measure_interval_min)
+
+    scans_per_day = MINUTES_PER_DAY / measure_interval_min
+    num_sensors = len(sensors)
+    active_mah_per_scan = (profile["active_ma"] - profile["quiescent_ma"]) * scan_s / 3600
+    mah_per_scan = sum(sensors.values()) + active_mah_per_scan
+    quiescent_mah = (profile["quiescent_ma"] + num_sensors * SENSOR_QUIESCENT_MA) * 24
+    ah_per_day = (quiescent_mah + mah_per_scan * scans_per_day) / 1000
+
+    usable_ah = battery_ah * BATTERY_USABLE_FRACTION if battery_ah else None
+    harvest_ah_per_day = solar_w * sun_hours * SOLAR_EFFICIENCY / SUPPLY_V if solar_w else None
+    min_interval_min = None
+    if harvest_ah_per_day is not None:
+        # Daily use must fit the harvest and, with a battery, let it carry AUTONOMY_DAYS
+        limit_ah = harvest_ah_per_day if usable_ah is None else min(harvest_ah_per_day, usable_ah / AUTONOMY_DAYS)
+        spare_mah = limit_ah * 1000 - quiescent_mah
+        if spare_mah > 0:
+            min_interval_min = max(full_scan["min_interval_min"],
+                                   math.ceil(MINUTES_PER_DAY * mah_per_scan / spare_mah))
+    return {
+        "logger_type": logger_type,
+        "interval_min": measure_interval_min,
+        "sensors": {address: mah * scans_per_day for address, mah in sensors.items()},
+        "scan_s": scan_s,
+        "scans_per_day": scans_per_day,
+        "sensor_commands_mah": sum(sensors.values()) * scans_per_day,
+        "logger_active_mah": active_mah_per_scan * scans_per_day,
+        "quiescent_mah": quiescent_mah,
+        "mah_per_scan": mah_per_scan,
+        "ah_per_day": ah_per_day,
+        "battery_ah": battery_ah,
+        "solar_w": solar_w,
+        "sun_hours": sun_hours,
+        "runtime_days": usable_ah / ah_per_day if usable_ah is not None else None,
+        "harvest_ah_per_day": harvest_ah_per_day,
+        "sustainable": (min_interval_min is not None and measure_interval_min >= min_interval_min)
+        if harvest_ah_per_day is not None else None,
+        "min_interval_min": min_interval_min,
+    }
+
+
+def format_energy(estimate):
+    """Renders an estimate_energy() result as a per-sensor breakdown with totals."""
+    lines = [f"Energy budget ({estimate['logger_type']}, {estimate['interval_min']} min interval, "
+             f"{estimate['scans_per_day']:.0f} scans/day of {estimate['scan_s']:.0f} s, {SUPPLY_V:.0f} V):",
+             f"  {'Sensor':<36}{'mAh/day':>9}"]
+    for address, mah in estimate["sensors"].items():
+        lines.append(f"  {address:<36}{mah:>9.1f}")
+    lines.append(f"  {'Logger during scans':<36}{estimate['logger_active_mah']:>9.1f}")
+    lines.append(f"  {'Quiescent (logger and sensors)':<36}{estimate['quiescent_mah']:>9.1f}")
+    lines.append(f"  {'Total':<36}{estimate['ah_per_day'] * 1000:>9.1f}  "
+                 f"({estimate['ah_per_day']:.3f} Ah/day)")
+    if estimate["battery_ah"]:
+        lines.append(f"  {f'Run time on {estimate['battery_ah']:g} Ah (no charging)':<36}"
+                     f"{estimate['runtime_days']:>9.0f} days "
+                     f"(to {100 * BATTERY_USABLE_FRACTION:.0f}% depth of discharge)")
+    if estimate["solar_w"]:
+        lines.append(f"  {f'Solar harvest ({estimate['solar_w']:g} W, {estimate['sun_hours']:g} h sun)':<36}"
+                     f"{estimate['harvest_ah_per_day'] * 1000:>9.1f}")
+        minimum = estimate["min_interval_min"]
+        lines.append(f"  {'Smallest sustainable interval':<36}"
+                     f"{'none' if minimum is None else f'{minimum} min':>9}"
+                     + (f"  (with {AUTONOMY_DAYS} days of battery reserve)" if estimate["battery_ah"] else ""))
+    return "\n".join(lines)
+
+
+def power_warning(estimate):
+    """
+    Warning message if the solar setup cannot sustain the interval, or a battery
+    without solar runs flat within RUNTIME_WARNING_DAYS; else None.
+    """
+    if estimate["sustainable"] is False:
+        minimum = estimate["min_interval_min"]
+        return (f"Warning: The station uses {estimate['ah_per_day']:.3f} Ah/day, more than the "
+                f"{estimate['solar_w']:g} W panel{' and battery' if estimate['battery_ah'] else ''} sustain; "
+                + (f"smallest sustainable interval: {minimum} min." if minimum is not None
+                   else "no interval is sustainable (the quiescent draw alone exceeds the budget)."))
+    if estimate["sustainable"] is None and estimate["runtime_days"] is not None \
+            and estimate["runtime_days"] < RUNTIME_WARNING_DAYS:
+        return (f"Warning: The {estimate['battery_ah']:g} Ah battery runs flat after "
+                f"{estimate['runtime_days']:.1f} days ({estimate['ah_per_day']:.3f} Ah/day).")
+    return None
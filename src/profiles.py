@@ -0,0 +1,150 @@
+# src/profiles.py
+
+import importlib
+import string
+
+# Registry of the supported loggers.
+#
+# Each profile describes a logger declaratively: the generator module that
+# writes its programs, its sensor and interval limits, the SDI-12 addresses
+# it uses, how it lays out its tables, and the measurement commands it issues.
+# main.py validates requests and picks the generator from here, and the
+# generators take their limits and address alphabet from here. A new logger is
+# a new entry, plus its generator (or an existing one it shares), and its rows
+# in the per-logger model tables (scan_budget.LATENCY_PROFILES,
+# storage.STORAGE_PROFILES, power.POWER_PROFILES, verifier.LIMIT_PROFILES).
+#
+# Nothing is imported until a profile is used. load_profile() imports the
+# profile's generator once per process and compiles the generator's emission
+# templates (its emission_templates(), the per-sensor blocks of the program
+# as format strings). Batch workers and repeated generation then reuse them.
+#
+# Profile keys:
+#   generator             - generator module in 'src'
+#   description           - shown in messages
+#   max_sensors           - sensors one program can hold
+#   layout_max_sensors    - optional per-layout overrides of max_sensors
+#   min_interval_min      - recommended shortest measurement interval; shorter
+#                           intervals get a warning
+#   sdi12_addresses       - the SDI-12 addresses, in sensor order
+#   table_strategy        - key into TABLE_STRATEGIES
+#   measurement_commands  - SDI-12 measurement commands issued to each sensor per scan
+#   file_extension        - extension of the generated program files
+
+SDI12_ADDRESS_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+
+TABLE_STRATEGIES = {
+    "table_per_sensor": "one table per sensor",
+    "single_table": "one table for all sensors",
+}
+
+LOGGER_PROFILES = {
+    "CR200X": {
+        "generator": "cr200x_generator",
+        "description": "CR200/CR200X series",
+        "max_sensors": 8,         # The CR200X holds at most 8 tables of 16 fields
+        # The packed layout shares tables between sensors; whether a sensor count
+        # fits the tables, variables and aliases of the CR200X is left to its table
+        # planner. 36 is the address limit: CRBasic names are not case-sensitive,
+        # so the per-sensor names only tell the digit and lowercase addresses apart.
+        "layout_max_sensors": {"packed": 36},
+        "min_interval_min": 15,   # Implexx recommendation for the CR200X
+        "sdi12_addresses": SDI12_ADDRESS_ALPHABET[:36],
+        "table_strategy": "table_per_sensor",
+        "measurement_commands": ("M!",),
+        "file_extension": ".cr2",
+    },
+    "CR300": {
+        "generator": "cr300_generator",
+        "description": "CR300 series",
+        "max_sensors": 62,        # All SDI-12 addresses
+        "min_interval_min": 10,   # Implexx general recommendation
+        "sdi12_addresses": SDI12_ADDRESS_ALPHABET,
+        "table_strategy": "single_table",
+        "measurement_commands": ("M!", "M1!", "M2!", "M5!"),
+        "file_extension": ".cr300",
+    },
+}
+
+LOGGER_TYPES = list(LOGGER_PROFILES)
+
+# Profiles loaded by this process, keyed by logger type:
+# {'profile', 'module', 'templates'}
+_loaded_profiles = {}
+
+
+def get_profile(logger_type):
+    """
+    The registry entry of a logger type.
+
+    Raises:
+        ValueError: If the logger type is not in LOGGER_PROFILES.
+    """
+    try:
+        return LOGGER_PROFILES[logger_type]
+    except KeyError:
+        raise ValueError(f"Unsupported logger type '{logger_type}'. "
+                         f"Choose among: {', '.join(LOGGER_TYPES)}.") from None
+
+
+def sdi12_address(logger_type, index):
+    """SDI-12 address character of the index-th sensor of a logger type."""
+    addresses = get_profile(logger_type)["sdi12_addresses"]
+    if not 0 <= index < len(addresses):
+        raise ValueError(f"Sensor index {index} out of range (0-{len(addresses) - 1}).")
+    return addresses[index]
+
+
+def load_profile(logger_type):
+    """
+    Imports a logger type's generator and compiles its emission templates, once
+    per process.
+
+    Returns:
+        dict: 'profile' (the registry entry), 'module' (the generator module) and
+        'templates' (its compiled emission templates, or None).
+    """
+    loaded = _loaded_profiles.get(logger_type)
+    if loaded is None:
+        profile = get_profile(logger_type)
+        # Relies on 'src' or its parent being on PYTHONPATH, which
+        # `python -m src.main` or `uv run python src/main.py` (from root) handles.
+        module = importlib.import_module(f"src.{profile['generator']}")
+        templates = module.emission_templates() if hasattr(module, "emission_templates") else None
+        loaded = {"profile": profile, "module": module, "templates": templates}
+        _loaded_profiles[logger_type] = loaded
+    return loaded
+
+
+def load_generator(logger_type):
+    """The generator module of a logger type (see load_profile())."""
+    return load_profile(logger_type)["module"]
+
+
+def check_sensor_config(logger_type, num_sensors, measure_interval, layout=None):
+    """
+    Validates a requested logger configuration against its profile before any
+    code is generated. 'layout' is the generator's layout option, if set.
+
+    Returns:
+        tuple: (error, warning) message strings; either may be None.
+    """
+    if logger_type not in LOGGER_PROFILES:
+        return f"Error: Unsupported logger type '{logger_type}'.", None
+    if num_sensors < 1:
+        return "Error: Number of sensors must be at least 1.", None
+    if measure_interval <= 0:
+        return "Error: Measurement interval must be a positive integer.", None
+
+    profile = LOGGER_PROFILES[logger_type]
+    layout_max_sensors = profile.get("layout_max_sensors", {})
+    max_sensors = layout_max_sensors.get(layout, profile["max_sensors"])
+    if num_sensors > max_sensors:
+        strategy = f"{layout} layout" if layout in layout_max_sensors else TABLE_STRATEGIES[profile["table_strategy"]]
+        return (f"Error: For {logger_type} ({strategy}), number of "
+                f"sensors must be between 1 and {max_sensors}. Requested: {num_sensors}"), None
+    warning = None
+    if measure_interval < profile["min_interval_min"]:
+        warning = (f"Warning: Implexx sensors on {logger_type} recommend a measurement interval of at least "
+                   f"{profile['min_interval_min']} minutes. Requested: {measure_interval} min.")
+    return None, warning
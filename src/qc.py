@@ -0,0 +1,249 @@
+# src/qc.py
+
+import csv
+import json
+import os
+
+import numpy as np
+
+from src import reader
+
+# Incremental quality control of incoming station data.
+#
+# Each run checks only the records a new download adds. What the checks need to
+# know about earlier records is kept as a running state of constant size per
+# sensor address and per column, saved between runs (STATE_FILE in the archive):
+#   nan_burst - the generated programs set all of a command's values to NAN when
+#               the sensor does not reply ("If ...(1) = NAN Then"); a sensor whose
+#               values are all NAN for NAN_BURST_RECORDS records in a row is
+#               flagged on each record from the NAN_BURST_RECORDS-th of the run
+#               on (the run may span downloads). Its last good timestamp is kept.
+#   stuck     - a sensor value repeated exactly over STUCK_RECORDS records
+#   spike     - a sensor value more than SPIKE_SIGMAS standard deviations from the
+#               column's exponentially weighted mean (span EWMA_SPAN records), once
+#               SPIKE_WARMUP_RECORDS values have been seen
+#   range     - a value outside RANGE_LIMITS, keyed by the generators' measurement names
+#   battery   - the logger's battery voltage below BATTERY_MIN_V, or more than
+#               BATTERY_SAG_V below its running mean
+# Records are checked in time order. A record not newer than the last one
+# checked (e.g. a backfilled gap) is counted as late and not checked.
+
+STATE_FILE = "qc_state.json"
+STATE_FORMAT_VERSION = 1
+
+RULES = ("nan_burst", "stuck", "spike", "range", "battery")
+
+NAN_BURST_RECORDS = 3
+STUCK_RECORDS = 6
+EWMA_SPAN = 48
+SPIKE_SIGMAS = 6.0
+SPIKE_WARMUP_RECORDS = 24
+
+# Measurement name -> (low, high). Alpha and beta are logs of temperature-rise
+# ratios; beyond these bounds the reading is not physical. Both naming schemes:
+# CR200X (AlphaOut, ...) and SapFlowAll (AlpOut, ...).
+RANGE_LIMITS = {name: (-4.0, 4.0) for name in ("AlphaOut", "AlphaIn", "BetaOut", "BetaIn",
+                                               "AlpOut", "AlpInn", "BetOut", "BetInn")}
+
+# The logger's battery voltage column (CR200X, CR300) and its limits for a 12 V battery
+BATTERY_FIELDS = ("BattV_Min", "Batt_volt")
+BATTERY_MIN_V = 11.5
+BATTERY_SAG_V = 0.8
+
+LOGGER_ADDRESS = "" # 'address' of the flags and counts of the logger's own values
+
+
+def _time_str(timestamp):
+    return str(np.datetime64(timestamp, "s"))
+
+
+def checked_columns(schema):
+    """
+    The columns QC follows, from a reader schema: the sensors' measurements and
+    the battery voltage.
+
+    Returns:
+        dict: column -> (sensor address, measurement name), in file order. The
+        battery's address is LOGGER_ADDRESS and its measurement its column name.
+    """
+    columns = {}
+    for field in schema["fields"]:
+        if field["sensor"] is not None and field["measurement"] is not None:
+            columns[field["name"]] = (field["sensor"], field["measurement"])
+        elif field["name"] in BATTERY_FIELDS:
+            columns[field["name"]] = (LOGGER_ADDRESS, field["name"])
+    return columns
+
+
+# --- State ---
+
+def new_state(schema):
+    """An empty QC state for the table of a reader schema."""
+    columns = checked_columns(schema)
+    addresses = list(dict.fromkeys(address for address, _ in columns.values()))
+    return {
+        "format_version": STATE_FORMAT_VERSION,
+        "table": schema["table"],
+        "last_timestamp": None,
+        "records": 0,
+        "late": 0,
+        "addresses": {address: {"nan_run": 0, "last_good": None, "flags": dict.fromkeys(RULES, 0)}
+                      for address in addresses},
+        "columns": {column: {"address": address, "measurement": measurement,
+                             "n": 0, "mean": 0.0, "var": 0.0, "last": None, "repeats": 0}
+                    for column, (address, measurement) in columns.items()},
+    }
+
+
+def load_state(path, schema):
+    """
+    Reads a QC state, or starts a new one if 'path' does not exist.
+
+    Raises:
+        ValueError: If the state was kept for other columns than the schema's.
+    """
+    if not os.path.exists(path):
+        return new_state(schema)
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("format_version") != STATE_FORMAT_VERSION:
+        raise ValueError(f"'{path}' has QC state format {state.get('format_version')}; "
+                         f"expected {STATE_FORMAT_VERSION}.")
+    if list(state["columns"]) != list(checked_columns(schema)):
+        raise ValueError(f"The QC state in '{path}' was kept for other columns; delete it to start over.")
+    return state
+
+
+def save_state(path, state):
+    """Writes a QC state; an interrupted write leaves the previous one."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+# --- Checks ---
+
+def check(state, records):
+    """
+    Checks new records against the rules and advances the state.
+
+    Args:
+        state (dict): QC state (new_state() or load_state()); updated in place.
+        records: Column -> array mapping with TIMESTAMP and the checked columns,
+            e.g. a reader structured array or the records archive.ingest() adds.
+
+    Returns:
+        list: (timestamp, address, rule, column, value) flags in time order;
+        column and value are None for a NAN burst, which flags the whole sensor.
+    """
+    timestamps = np.asarray(records[reader.TIMESTAMP_FIELD])
+    new = np.ones(len(timestamps), dtype=bool)
+    if state["last_timestamp"] is not None:
+        new = timestamps > np.datetime64(state["last_timestamp"], "ns")
+    state["late"] += int((~new).sum())
+    if not new.any():
+        return []
+    order = np.argsort(timestamps[new], kind="stable")
+    timestamps = timestamps[new][order]
+
+    columns = list(state["columns"])
+    column_state = [state["columns"][column] for column in columns]
+    column_address = [entry["address"] for entry in column_state]
+    addresses = list(state["addresses"])
+    values = np.column_stack([np.asarray(records[column], dtype=np.float64)[new][order] for column in columns]) \
+        if columns else np.empty((len(timestamps), 0))
+
+    # Running state as arrays over the columns
+    n = np.array([entry["n"] for entry in column_state], dtype=np.int64)
+    mean = np.array([entry["mean"] for entry in column_state], dtype=np.float64)
+    var = np.array([entry["var"] for entry in column_state], dtype=np.float64)
+    last = np.array([np.nan if entry["last"] is None else entry["last"] for entry in column_state], dtype=np.float64)
+    repeats = np.array([entry["repeats"] for entry in column_state], dtype=np.int64)
+    nan_run = np.array([state["addresses"][address]["nan_run"] for address in addresses], dtype=np.int64)
+
+    is_sensor = np.array([address != LOGGER_ADDRESS for address in column_address], dtype=bool)
+    is_battery = ~is_sensor
+    limits = [RANGE_LIMITS.get(entry["measurement"], (-np.inf, np.inf)) for entry in column_state]
+    low = np.array([limit[0] for limit in limits], dtype=np.float64)
+    high = np.array([limit[1] for limit in limits], dtype=np.float64)
+    alpha = 2.0 / (EWMA_SPAN + 1)
+
+    # A sensor's record is a NAN record when all of its values are NAN
+    nan_values = np.isnan(values)
+    all_nan = np.zeros((len(timestamps), len(addresses)), dtype=bool)
+    for k, address in enumerate(addresses):
+        sensor_columns = [j for j, column_addr in enumerate(column_address) if column_addr == address]
+        if address != LOGGER_ADDRESS and sensor_columns:
+            all_nan[:, k] = nan_values[:, sensor_columns].all(axis=1)
+
+    flags = []
+    for timestamp, row, nan_row in zip(timestamps, values, all_nan):
+        valid = ~np.isnan(row)
+        with np.errstate(invalid="ignore"):
+            std = np.sqrt(var)
+            warm = n >= SPIKE_WARMUP_RECORDS
+            spike = is_sensor & valid & warm & (std > 0) & (np.abs(row - mean) > SPIKE_SIGMAS * std)
+            battery = is_battery & valid & ((row < BATTERY_MIN_V) | (warm & (row < mean - BATTERY_SAG_V)))
+            out_of_range = valid & ((row < low) | (row > high))
+        repeats = np.where(valid & (row == last), repeats + 1, 0)
+        stuck = is_sensor & (repeats + 1 >= STUCK_RECORDS)
+        last = row
+
+        # Exponentially weighted mean and variance of the valid values
+        diff = np.where(valid, row - mean, 0.0)
+        first = valid & (n == 0)
+        mean = np.where(first, row, mean + alpha * diff)
+        var = np.where(first, 0.0, np.where(valid, (1 - alpha) * (var + alpha * diff * diff), var))
+        n = n + valid
+
+        nan_run = np.where(nan_row, nan_run + 1, 0)
+        for k in np.flatnonzero(nan_run >= NAN_BURST_RECORDS):
+            flags.append((timestamp, addresses[k], "nan_burst", None, None))
+        for rule, hits in (("stuck", stuck), ("spike", spike), ("range", out_of_range), ("battery", battery)):
+            for j in np.flatnonzero(hits):
+                flags.append((timestamp, column_address[j], rule, columns[j], float(row[j])))
+
+    # Store the running state back
+    for j, entry in enumerate(column_state):
+        entry.update(n=int(n[j]), mean=float(mean[j]), var=float(var[j]),
+                     last=None if np.isnan(last[j]) else float(last[j]), repeats=int(repeats[j]))
+    for k, address in enumerate(addresses):
+        address_state = state["addresses"][address]
+        address_state["nan_run"] = int(nan_run[k])
+        good = np.flatnonzero(~all_nan[:, k])
+        if len(good):
+            address_state["last_good"] = _time_str(timestamps[good[-1]])
+    for _, address, rule, _, _ in flags:
+        state["addresses"][address]["flags"][rule] += 1
+    state["records"] += len(timestamps)
+    state["last_timestamp"] = _time_str(timestamps[-1])
+    return flags
+
+
+# --- Reports ---
+
+def write_flags(path, flags):
+    """Appends flags to a CSV file (TIMESTAMP, address, rule, column, value), with a header if new."""
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow([reader.TIMESTAMP_FIELD, "address", "rule", "column", "value"])
+        for timestamp, address, rule, column, value in flags:
+            writer.writerow([_time_str(timestamp), address, rule, column or "", "" if value is None else f"{value:g}"])
+
+
+def format_report(state, flags):
+    """Renders the flags of one run per address and rule, with each sensor's NAN run and last good record."""
+    counts = {address: dict.fromkeys(RULES, 0) for address in state["addresses"]}
+    for _, address, rule, _, _ in flags:
+        counts[address][rule] += 1
+    lines = [f"QC of {state['table']}: {len(flags)} flag(s); {state['records']} records checked so far "
+             f"(last {state['last_timestamp']}), {state['late']} late record(s) skipped.",
+             f"  {'Sensor':<8}" + "".join(f"{rule:>11}" for rule in RULES) + f"{'NAN run':>9}  Last good"]
+    for address, address_counts in counts.items():
+        address_state = state["addresses"][address]
+        lines.append(f"  {address or 'Logger':<8}" + "".join(f"{address_counts[rule]:>11}" for rule in RULES)
+                     + f"{address_state['nan_run']:>9}  {address_state['last_good'] or '-'}")
+    return "\n".join(lines)
@@ -0,0 +1,283 @@
+# src/reader.py
+
+import itertools
+import os
+
+import numpy as np
+
+from src import merge, profiles
+
+# Readers for the data files the generated programs produce, as written by
+# LoggerNet/PC400: TOA5 (quoted CSV with a 4-line header) and TOB1 (a 5-line
+# ASCII header followed by fixed-size binary records).
+#
+# The column schema comes from the generators' own table_layout(), i.e. from
+# STANDARD_MEASUREMENTS (CR200X) and DESIRED_MEASUREMENTS_CONFIG (CR300), so a
+# file is checked against the program that wrote it instead of being mapped by
+# hand. Both readers return the same structured array: TIMESTAMP
+# (datetime64[ns]), RECORD, then one float32 column per field.
+
+TIMESTAMP_FIELD = "TIMESTAMP"
+RECORD_FIELD = "RECORD"
+VALUE_DTYPE = np.float32
+
+TOA5_HEADER_LINES = 4 # File info, field names, units, processing
+TOB1_HEADER_LINES = 5 # File info, field names, units, processing, data types
+DEFAULT_CHUNK_ROWS = 100_000
+
+# TOB1 storage types -> NumPy dtypes. FP2 is Campbell's 2-byte big-endian float
+# and is decoded by decode_fp2(); TOB1 timestamps are seconds (and nanoseconds)
+# since 1990-01-01.
+TOB1_DTYPES = {
+    "IEEE4": "<f4", "IEEE4L": "<f4", "IEEE4B": ">f4",
+    "FP2": ">u2",
+    "ULONG": "<u4", "LONG": "<i4", "UINT4": "<u4", "INT4": "<i4",
+    "UINT2": "<u2", "INT2": "<i2", "BOOL": "<i4",
+}
+TOB1_EPOCH = np.datetime64("1990-01-01T00:00:00", "ns")
+TOB1_TIME_FIELDS = ("SECONDS", "NANOSECONDS")
+
+
+# --- Schema ---
+
+def table_schema(logger_type, table_name, num_sensors, measure_interval_min, **generator_args):
+    """
+    Column schema of one table written by a generated program.
+
+    Args:
+        logger_type (str): "CR200X" or "CR300".
+        table_name (str): e.g. "SapFlowAll" or "Table_S0". For the CR200X,
+            "SapFlowAll" is the table merged from its Table_S{n} files (merge.py).
+        num_sensors, measure_interval_min, **generator_args: The configuration the
+            program was generated with (as passed to generate_code).
+
+    Returns:
+        dict: 'table', 'interval_min', 'fields' (the table_layout() field dicts:
+        name, data_type, unit, sensor, measurement) and 'columns' (all column
+        names in file order, TIMESTAMP and RECORD first).
+
+    Raises:
+        ValueError: If the program writes no table of that name.
+    """
+    if logger_type == "CR200X" and table_name == merge.TABLE_NAME:
+        return layout_schema(merge.merged_table_layout(num_sensors, measure_interval_min))
+    module = profiles.load_generator(logger_type)
+    tables = module.table_layout(num_sensors, measure_interval_min, **generator_args)
+    for table in tables:
+        if table["name"] == table_name:
+            return layout_schema(table)
+    raise ValueError(f"The {logger_type} program writes no table '{table_name}'. "
+                     f"Tables: {', '.join(table['name'] for table in tables)}")
+
+
+def layout_schema(table):
+    """Schema of a table described in table_layout() form (e.g. merge.merged_table_layout())."""
+    return {
+        "table": table["name"],
+        "interval_min": table["interval_min"],
+        "fields": table["fields"],
+        "columns": [TIMESTAMP_FIELD, RECORD_FIELD] + [field["name"] for field in table["fields"]],
+    }
+
+
+def output_dtype(schema):
+    """Structured dtype of the arrays the readers return for a schema."""
+    return np.dtype([(TIMESTAMP_FIELD, "M8[ns]"), (RECORD_FIELD, np.int64)]
+                    + [(field["name"], VALUE_DTYPE) for field in schema["fields"]])
+
+
+def sensor_columns(schema):
+    """Maps each sensor address to {measurement: column name} for the sensor's fields."""
+    columns = {}
+    for field in schema["fields"]:
+        if field["sensor"] is not None and field["measurement"] is not None:
+            columns.setdefault(field["sensor"], {})[field["measurement"]] = field["name"]
+    return columns
+
+
+def _check_columns(path, schema, names):
+    """Raises ValueError if a file's field names are not the schema's columns."""
+    if names == schema["columns"]:
+        return
+    missing = [name for name in schema["columns"] if name not in names]
+    unexpected = [name for name in names if name not in schema["columns"]]
+    details = []
+    if missing:
+        details.append(f"missing {', '.join(missing)}")
+    if unexpected:
+        details.append(f"unexpected {', '.join(unexpected)}")
+    raise ValueError(f"'{path}' does not match the {schema['table']} schema: "
+                     f"{'; '.join(details) or 'columns are in a different order'}")
+
+
+def _split_header_line(line):
+    return [item.strip().strip('"') for item in line.strip().split(",")]
+
+
+def file_format(path):
+    """'TOA5' or 'TOB1', from the first header field."""
+    with open(path, "rb") as f:
+        first = f.readline().decode("ascii", errors="replace")
+    return _split_header_line(first)[0]
+
+
+# --- TOA5 ---
+
+def iter_toa5_chunks(path, schema, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Parses a TOA5 file in chunks of rows, so memory stays bounded for large files.
+
+    Yields:
+        numpy.ndarray: Structured arrays of up to chunk_rows records (output_dtype).
+    """
+    dtype = output_dtype(schema)
+    with open(path, newline="") as f:
+        header = [f.readline() for _ in range(TOA5_HEADER_LINES)]
+        if _split_header_line(header[0])[0] != "TOA5":
+            raise ValueError(f"'{path}' is not a TOA5 file.")
+        _check_columns(path, schema, _split_header_line(header[1]))
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=",", quotechar='"', dtype=dtype, ndmin=1)
+
+
+def read_toa5(path, schema, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Reads a whole TOA5 file into one structured array (output_dtype)."""
+    chunks = list(iter_toa5_chunks(path, schema, chunk_rows))
+    if not chunks:
+        return np.empty(0, dtype=output_dtype(schema))
+    return np.concatenate(chunks)
+
+
+# --- TOB1 ---
+
+def _tob1_dtype(type_names):
+    dtype = []
+    for name, type_name in type_names:
+        if type_name.startswith("ASCII(") and type_name.endswith(")"):
+            dtype.append((name, f"S{int(type_name[6:-1])}"))
+        elif type_name in TOB1_DTYPES:
+            dtype.append((name, TOB1_DTYPES[type_name]))
+        else:
+            raise ValueError(f"Unsupported TOB1 data type '{type_name}' for field '{name}'.")
+    return np.dtype(dtype)
+
+
+def open_tob1(path, schema):
+    """
+    Memory-maps the records of a TOB1 file without reading or decoding them.
+
+    Returns:
+        tuple: (numpy.memmap of raw records with the file's own structured dtype,
+        list of the file's data type names per field).
+    """
+    with open(path, "rb") as f:
+        header = [f.readline().decode("ascii") for _ in range(TOB1_HEADER_LINES)]
+        offset = f.tell()
+    if _split_header_line(header[0])[0] != "TOB1":
+        raise ValueError(f"'{path}' is not a TOB1 file.")
+    names = _split_header_line(header[1])
+    type_names = _split_header_line(header[4])
+    dtype = _tob1_dtype(list(zip(names, type_names)))
+
+    # TOB1 stores the timestamp as SECONDS/NANOSECONDS in place of TIMESTAMP
+    data_names = names[2:] if tuple(names[:2]) == TOB1_TIME_FIELDS else names
+    _check_columns(path, schema, [TIMESTAMP_FIELD] + data_names)
+
+    num_records = (os.path.getsize(path) - offset) // dtype.itemsize
+    if num_records == 0:
+        return np.empty(0, dtype=dtype), type_names
+    records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(num_records,))
+    return records, type_names
+
+
+def decode_fp2(raw):
+    """
+    Decodes Campbell FP2 values (sign bit, 2-bit negative decimal exponent,
+    13-bit mantissa) to float32, including the NAN and +/-INF codes.
+    """
+    raw = np.asarray(raw, dtype=np.uint16)
+    mantissa = (raw & 0x1FFF).astype(np.float32)
+    exponent = (raw >> 13) & 0x3
+    negative = (raw >> 15) == 1
+    values = mantissa / np.float32(10.0) ** exponent.astype(np.float32)
+    values[negative] *= -1
+    values[(exponent == 0) & (mantissa == 8191)] = np.inf
+    values[negative & (exponent == 0) & (mantissa == 8191)] = -np.inf
+    values[(exponent == 0) & (mantissa == 8190)] = np.nan
+    return values.astype(np.float32)
+
+
+def read_tob1(path, schema, start=0, stop=None):
+    """
+    Reads records [start, stop) of a TOB1 file into a structured array (output_dtype),
+    decoding FP2 fields and the timestamp. Only the requested records are read
+    from the memory map.
+    """
+    records, type_names = open_tob1(path, schema)
+    records = records[start:stop]
+    result = np.empty(len(records), dtype=output_dtype(schema))
+    fields = records.dtype.names
+    if fields[:2] == TOB1_TIME_FIELDS:
+        result[TIMESTAMP_FIELD] = (TOB1_EPOCH + records["SECONDS"].astype("m8[s]")
+                                   + records["NANOSECONDS"].astype("m8[ns]"))
+    for name, type_name in zip(fields, type_names):
+        if name in TOB1_TIME_FIELDS:
+            continue
+        if type_name == "FP2":
+            result[name] = decode_fp2(records[name])
+        else:
+            result[name] = records[name]
+    return result
+
+
+# --- Any format ---
+
+def read_table(path, schema, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Reads a TOA5 or TOB1 file (detected from its header) into a structured array."""
+    kind = file_format(path)
+    if kind == "TOA5":
+        return read_toa5(path, schema, chunk_rows)
+    if kind == "TOB1":
+        return read_tob1(path, schema)
+    raise ValueError(f"'{path}' is neither a TOA5 nor a TOB1 file (found '{kind}').")
+
+
+def iter_table_chunks(path, schema, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Reads a TOA5 or TOB1 file in chunks of up to chunk_rows records, so a
+    processing stage can run over files of any size in bounded memory.
+
+    Yields:
+        numpy.ndarray: Structured arrays (output_dtype).
+    """
+    kind = file_format(path)
+    if kind == "TOA5":
+        yield from iter_toa5_chunks(path, schema, chunk_rows)
+    elif kind == "TOB1":
+        num_records = len(open_tob1(path, schema)[0])
+        for start in range(0, num_records, chunk_rows):
+            yield read_tob1(path, schema, start, start + chunk_rows)
+    else:
+        raise ValueError(f"'{path}' is neither a TOA5 nor a TOB1 file (found '{kind}').")
+
+
+def read_archive(paths, schema, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Reads several files of one table (e.g. a station's yearly files) into one
+    structured array, sorted by TIMESTAMP. Records present in more than one file
+    (same TIMESTAMP and RECORD) are kept once.
+    """
+    arrays = [read_table(path, schema, chunk_rows) for path in paths]
+    if not arrays:
+        return np.empty(0, dtype=output_dtype(schema))
+    data = np.concatenate(arrays)
+    order = np.lexsort((data[RECORD_FIELD], data[TIMESTAMP_FIELD]))
+    data = data[order]
+    if len(data) > 1:
+        duplicate = ((data[TIMESTAMP_FIELD][1:] == data[TIMESTAMP_FIELD][:-1])
+                     & (data[RECORD_FIELD][1:] == data[RECORD_FIELD][:-1]))
+        data = data[np.concatenate(([True], ~duplicate))]
+    return data
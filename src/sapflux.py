@@ -0,0 +1,289 @@
+# src/sapflux.py
+
+import math
+import tomllib
+
+import numpy as np
+
+from src import reader
+
+# Heat-pulse processing of the logged Implexx values: heat velocity by the heat
+# ratio method (HRM) or the Tmax method, chosen per record (dual method
+# approach), wound and probe-spacing corrections, sap flux density and tree
+# water use. All steps are NumPy array operations over a chunk of records.
+#
+# The inputs are found by measurement name through the generators' table
+# layouts, so the same code serves the CR300 SapFlowAll table (AlpOut, BetInn,
+# tMxTout, ...), the CR200X Table_S{n} tables (AlphaOut, BetaIn, tMaxTout, ...)
+# and the merged CR200X table.
+
+# Logged measurement names of each input, per depth: (CR200X name, SapFlowAll name)
+HEAT_RATIO_INPUTS = {
+    "Out": {"alpha": ("AlphaOut", "AlpOut"), "beta": ("BetaOut", "BetOut"), "tmax": ("tMaxTout", "tMxTout")},
+    "Inn": {"alpha": ("AlphaIn", "AlpInn"), "beta": ("BetaIn", "BetInn"), "tmax": ("tMaxTin", "tMxTinn")},
+}
+DEPTHS = list(HEAT_RATIO_INPUTS)
+
+# Method codes in the S{n}_Meth{depth} output columns
+METHOD_HRM = 0
+METHOD_TMAX = 1
+METHOD_NONE = -1 # No velocity for the record (missing or unusable inputs)
+
+# Dual method approach: the HRM is used while beta (ln of the ratio of the
+# downstream to upstream maximum temperature rises) is at most BETA_MAX_HRM and
+# alpha is within the range where the HRM resolves flow; faster flows use Tmax.
+BETA_MAX_HRM = 1.0
+ALPHA_MAX_HRM = 2.0
+
+SECONDS_PER_HOUR = 3600
+SAP_SPECIFIC_HEAT_J_KG_K = 4182      # c_s
+WOOD_SPECIFIC_HEAT_J_KG_K = 1200     # c_w, dry wood matrix
+SAP_DENSITY_KG_M3 = 1000             # rho_s
+
+# Wound correction Vc = b*Vh + c*Vh^2 + d*Vh^3 (Vh in cm/h) for 0.6 cm probe
+# spacing, by wound diameter in cm (Burgess et al. 2001). The nearest listed
+# diameter is used.
+WOUND_COEFFICIENTS = {
+    0.17: (1.6565, -0.0014, 0.0002), 0.18: (1.7023, -0.0013, 0.0002),
+    0.19: (1.7585, -0.0015, 0.0002), 0.20: (1.8265, -0.0018, 0.0002),
+    0.21: (1.8905, -0.0019, 0.0002), 0.22: (1.9572, -0.0021, 0.0002),
+    0.23: (2.0267, -0.0023, 0.0003), 0.24: (2.0991, -0.0025, 0.0003),
+    0.26: (2.2521, -0.0031, 0.0003), 0.28: (2.4205, -0.0036, 0.0004),
+    0.30: (2.6056, -0.0043, 0.0005),
+}
+
+# Per-sensor probe and tree parameters. A tree file overrides them per sensor.
+#   zero_offset_*_cm_h - heat velocity logged at zero flow (probe misalignment),
+#                        subtracted before the wound correction
+#   split_depth_cm     - sapwood depth where the outer annulus ends and the inner begins
+DEFAULT_TREE_PARAMS = {
+    "thermal_diffusivity_cm2_s": 0.0025,
+    "probe_spacing_cm": 0.6,
+    "heat_pulse_s": 3.0,
+    "wound_diameter_cm": 0.20,
+    "zero_offset_out_cm_h": 0.0,
+    "zero_offset_inn_cm_h": 0.0,
+    "wood_density_kg_m3": 500.0,
+    "water_content": 1.0,
+    "stem_diameter_cm": 20.0,
+    "bark_thickness_cm": 0.5,
+    "sapwood_depth_cm": 3.0,
+    "split_depth_cm": 1.5,
+}
+
+DEFAULT_CHUNK_ROWS = reader.DEFAULT_CHUNK_ROWS
+
+
+def load_tree_params(path):
+    """
+    Reads per-sensor tree parameters from a TOML file: an optional [defaults]
+    table and one [sensors."<address>"] table per sensor, with keys from
+    DEFAULT_TREE_PARAMS, e.g.:
+
+        [defaults]
+        wood_density_kg_m3 = 550
+
+        [sensors."0"]
+        stem_diameter_cm = 32.5
+
+    Returns:
+        dict: {"defaults": {...}, "sensors": {address: {...}}}.
+
+    Raises:
+        ValueError: On an unknown parameter name.
+    """
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    trees = {"defaults": config.get("defaults", {}),
+             "sensors": {str(address): params for address, params in config.get("sensors", {}).items()}}
+    for where, params in [("defaults", trees["defaults"])] + list(trees["sensors"].items()):
+        unknown = [key for key in params if key not in DEFAULT_TREE_PARAMS]
+        if unknown:
+            raise ValueError(f"Unknown tree parameter(s) for {where} in '{path}': {', '.join(unknown)}")
+    return trees
+
+
+def sensor_params(trees, address):
+    """DEFAULT_TREE_PARAMS overridden by the tree file's defaults and the sensor's own entry."""
+    trees = trees or {}
+    return {**DEFAULT_TREE_PARAMS, **trees.get("defaults", {}), **trees.get("sensors", {}).get(address, {})}
+
+
+# --- Heat velocity ---
+
+def hrm_velocity(alpha, params):
+    """Heat ratio method: Vh = k/x * alpha, in cm/h."""
+    k = params["thermal_diffusivity_cm2_s"]
+    x = params["probe_spacing_cm"]
+    return k / x * alpha * SECONDS_PER_HOUR
+
+
+def tmax_velocity(tmax, params):
+    """
+    Tmax method for a pulse of finite length t0 (Kluitenberg & Ham 2004):
+    Vh = sqrt(4k/t0 * ln(1 - t0/tm) + x^2 / (tm * (tm - t0))), in cm/h.
+    Records with tm <= t0 or no real solution are NaN.
+    """
+    k = params["thermal_diffusivity_cm2_s"]
+    x = params["probe_spacing_cm"]
+    t0 = params["heat_pulse_s"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid = tmax > t0
+        tm = np.where(valid, tmax, np.nan)
+        radicand = 4 * k / t0 * np.log(1 - t0 / tm) + x ** 2 / (tm * (tm - t0))
+        return np.where(radicand >= 0, np.sqrt(radicand), np.nan) * SECONDS_PER_HOUR
+
+
+def choose_method(alpha, beta):
+    """METHOD_HRM where the HRM is valid for the record (see BETA_MAX_HRM), else METHOD_TMAX."""
+    with np.errstate(invalid="ignore"):
+        use_tmax = (beta > BETA_MAX_HRM) | (alpha > ALPHA_MAX_HRM)
+    return np.where(use_tmax, METHOD_TMAX, METHOD_HRM).astype(np.int8)
+
+
+def wound_correct(velocity, params):
+    """Burgess et al. (2001) wound correction with the nearest WOUND_COEFFICIENTS entry."""
+    diameter = min(WOUND_COEFFICIENTS, key=lambda d: abs(d - params["wound_diameter_cm"]))
+    b, c, d = WOUND_COEFFICIENTS[diameter]
+    return velocity * (b + velocity * (c + velocity * d))
+
+
+def sap_flux_density(velocity, params):
+    """Sap flux density (cm3 cm-2 h-1) from the corrected heat velocity (Barrett et al. 1995)."""
+    return velocity * (params["wood_density_kg_m3"]
+                       * (WOOD_SPECIFIC_HEAT_J_KG_K + params["water_content"] * SAP_SPECIFIC_HEAT_J_KG_K)
+                       / (SAP_DENSITY_KG_M3 * SAP_SPECIFIC_HEAT_J_KG_K))
+
+
+def sapwood_areas(params):
+    """
+    Conducting areas (cm2) the outer and inner measurements represent: the
+    sapwood annuli from the cambium to split_depth_cm, and from there to
+    sapwood_depth_cm.
+    """
+    radius = params["stem_diameter_cm"] / 2 - params["bark_thickness_cm"]
+    sapwood = min(params["sapwood_depth_cm"], radius)
+    split = min(params["split_depth_cm"], sapwood)
+
+    def annulus(start, end):
+        return math.pi * ((radius - start) ** 2 - (radius - end) ** 2)
+
+    return {"Out": annulus(0, split), "Inn": annulus(split, sapwood)}
+
+
+# --- Pipeline ---
+
+def find_inputs(schema):
+    """
+    Locates each sensor's alpha/beta/tmax columns in a reader schema.
+
+    Returns:
+        dict: address -> {depth: {"alpha": column, "beta": column, "tmax": column}}
+        for every sensor that logs all of them.
+
+    Raises:
+        ValueError: If no sensor in the table logs the heat-ratio inputs.
+    """
+    inputs = {}
+    for address, measurements in reader.sensor_columns(schema).items():
+        sensor_inputs = {}
+        for depth, names in HEAT_RATIO_INPUTS.items():
+            columns = {}
+            for quantity, candidates in names.items():
+                column = next((measurements[name] for name in candidates if name in measurements), None)
+                if column is not None:
+                    columns[quantity] = column
+            if len(columns) == len(names):
+                sensor_inputs[depth] = columns
+        if len(sensor_inputs) == len(HEAT_RATIO_INPUTS):
+            inputs[address] = sensor_inputs
+    if not inputs:
+        raise ValueError(f"Table {schema['table']} has no sensor logging alpha, beta and tMax values.")
+    return inputs
+
+
+def output_columns(addresses):
+    """Result columns per sensor, after TIMESTAMP and RECORD: (name, unit)."""
+    columns = []
+    for address in addresses:
+        for depth in DEPTHS:
+            columns += [(f"S{address}_Vh{depth}", "cm/h"), (f"S{address}_Meth{depth}", "")]
+        for depth in DEPTHS:
+            columns.append((f"S{address}_Js{depth}", "cm3/cm2/h"))
+        columns.append((f"S{address}_Flow", "L/h"))
+    return columns
+
+
+def result_dtype(addresses):
+    return np.dtype([(reader.TIMESTAMP_FIELD, "M8[ns]"), (reader.RECORD_FIELD, np.int64)]
+                    + [(name, np.int8 if "_Meth" in name else np.float32)
+                       for name, _ in output_columns(addresses)])
+
+
+def process_chunk(data, inputs, trees=None):
+    """
+    Computes heat velocity, method, sap flux density and tree flow for one chunk.
+
+    Args:
+        data (numpy.ndarray): Records as returned by the reader (output_dtype).
+        inputs (dict): From find_inputs() for the table's schema.
+        trees (dict): From load_tree_params(), or None for DEFAULT_TREE_PARAMS.
+
+    Returns:
+        numpy.ndarray: Structured array (result_dtype) with one row per record.
+    """
+    result = np.empty(len(data), dtype=result_dtype(list(inputs)))
+    result[reader.TIMESTAMP_FIELD] = data[reader.TIMESTAMP_FIELD]
+    result[reader.RECORD_FIELD] = data[reader.RECORD_FIELD]
+    for address, sensor_inputs in inputs.items():
+        params = sensor_params(trees, address)
+        areas = sapwood_areas(params)
+        flow = np.zeros(len(data))
+        for depth, columns in sensor_inputs.items():
+            alpha = data[columns["alpha"]].astype(np.float64)
+            beta = data[columns["beta"]].astype(np.float64)
+            method = choose_method(alpha, beta)
+            velocity = np.where(method == METHOD_HRM, hrm_velocity(alpha, params),
+                                tmax_velocity(data[columns["tmax"]].astype(np.float64), params))
+            velocity = wound_correct(velocity - params[f"zero_offset_{depth.lower()}_cm_h"], params)
+            flux = sap_flux_density(velocity, params)
+            flow += flux * areas[depth] / 1000 # cm3/h -> L/h
+            result[f"S{address}_Vh{depth}"] = velocity
+            result[f"S{address}_Meth{depth}"] = np.where(np.isnan(velocity), METHOD_NONE, method)
+            result[f"S{address}_Js{depth}"] = flux
+        result[f"S{address}_Flow"] = flow
+    return result
+
+
+def iter_processed_chunks(paths, schema, trees=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Runs process_chunk() over data files (TOA5 or TOB1) chunk by chunk.
+
+    Yields:
+        numpy.ndarray: Result chunks (result_dtype), in file order.
+    """
+    inputs = find_inputs(schema)
+    for path in paths:
+        for chunk in reader.iter_table_chunks(path, schema, chunk_rows):
+            yield process_chunk(chunk, inputs, trees)
+
+
+def iter_result_lines(chunks, addresses, environment):
+    """
+    Renders result chunks as a TOA5 file: 4 header lines (environment is the
+    list of first-line fields), then one item of lines per chunk, with NaN as
+    "NAN".
+    """
+    columns = output_columns(addresses)
+    yield ",".join(f'"{item}"' for item in environment)
+    yield ",".join(f'"{name}"' for name in ["TIMESTAMP", "RECORD"] + [name for name, _ in columns])
+    yield ",".join(f'"{unit}"' for unit in ["TS", "RN"] + [unit for _, unit in columns])
+    yield ",".join(['""', '""'] + ['"Smp"'] * len(columns))
+    line_format = '"%s",%d,' + ",".join("%d" if "_Meth" in name else "%.6g" for name, _ in columns)
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        timestamps = np.char.replace(np.datetime_as_string(chunk[reader.TIMESTAMP_FIELD], unit="s"), "T", " ")
+        values = [timestamps.tolist(), chunk[reader.RECORD_FIELD].tolist()]
+        values += [chunk[name].tolist() for name, _ in columns]
+        yield "\n".join(line_format % row for row in zip(*values)).replace("nan", '"NAN"')
@@ -0,0 +1,161 @@
+# src/scan_budget.py
+
+import math
+
+# Worst-case scan-time model for the generated programs.
+#
+# SDI12Recorder blocks the scan for the whole exchange with a sensor: the
+# measurement command and its "atttn" reply, the "ttt" seconds the sensor asks
+# the logger to wait, and the D0!/D1! data retrievals. If the sum over one scan
+# exceeds the scan interval, the logger skips scans.
+
+# Worst-case seconds the Implexx sensor asks the logger to wait per command
+# (the "ttt" of its "atttn" reply). M! fires the heat pulse and takes ~100 s;
+# M1!/M2!/M5! return values derived from that pulse. The concurrent C commands
+# take as long as their M counterparts.
+SENSOR_MEASUREMENT_WAIT_S = {"M!": 100.0, "M1!": 1.0, "M2!": 1.0, "M5!": 1.0}
+SENSOR_MEASUREMENT_WAIT_S.update({"C" + cmd[1:]: wait for cmd, wait in SENSOR_MEASUREMENT_WAIT_S.items()})
+
+# A concurrent program waits once per C command for the slowest sensor: the
+# wait rounded up to whole seconds plus this margin, before collecting
+CONCURRENT_WAIT_MARGIN_S = 1
+
+# Number of D commands needed to retrieve each command's values
+# (M! returns 9 values split over D0!/D1!; the others fit in D0!).
+DATA_COMMANDS = {"M!": 2, "M1!": 1, "M2!": 1, "M5!": 1}
+DATA_COMMANDS.update({"C" + cmd[1:]: count for cmd, count in DATA_COMMANDS.items()})
+
+# Per logger profile:
+#   command_s   - break, command and "atttn" acknowledgement for one measurement command
+#   data_s      - one D command and its reply (up to ~35 characters at 1200 baud)
+#   overhead_s  - everything else in the scan (Battery, PanelTemp, CallTable, ...)
+LATENCY_PROFILES = {
+    "CR200X": {"command_s": 0.10, "data_s": 0.35, "overhead_s": 0.50},
+    "CR300": {"command_s": 0.08, "data_s": 0.35, "overhead_s": 0.25},
+}
+
+
+def command_latency(logger_type, command):
+    """Worst-case seconds one blocking SDI12Recorder call for 'command' holds the scan."""
+    profile = LATENCY_PROFILES[logger_type]
+    return (profile["command_s"] + SENSOR_MEASUREMENT_WAIT_S[command]
+            + DATA_COMMANDS[command] * profile["data_s"])
+
+
+def concurrent_wait_s(command):
+    """Seconds a concurrent program waits after starting a C command on its sensors."""
+    return math.ceil(SENSOR_MEASUREMENT_WAIT_S[command]) + CONCURRENT_WAIT_MARGIN_S
+
+
+def estimate_scan(logger_type, commands, measure_interval_min):
+    """
+    Estimates the worst-case duration of one scan.
+
+    Args:
+        logger_type (str): Key into LATENCY_PROFILES (e.g., "CR300").
+        commands (list): (port, address_char, command) tuples in issue order, as
+            returned by a generator module's scan_commands(). Each port is its own
+            bus and runs in parallel with the others; on a port, a run of the same
+            concurrent command (C!, C1!, ...) across sensors shares one wait.
+        measure_interval_min (int): The scan interval in minutes.
+
+    Returns:
+        dict: 'sensors' maps each address to {'port', 'commands': [...], 'seconds'};
+        'ports' maps each port to {'sensors': [...], 'concurrent_waits':
+        [(command, seconds), ...], 'seconds'}; also 'overhead_s', 'total_s'
+        (overhead plus the slowest port), 'interval_s', 'fits' and
+        'min_interval_min' (the smallest whole-minute interval the scan fits in).
+    """
+    sensors = {}
+    ports = {}
+    previous_command = {}
+    for port, address, command in commands:
+        port_load = ports.setdefault(port, {"sensors": [], "concurrent_waits": [], "seconds": 0.0})
+        if address not in sensors:
+            sensors[address] = {"port": port, "commands": [], "seconds": 0.0}
+            port_load["sensors"].append(address)
+        sensor = sensors[address]
+        sensor["commands"].append(command)
+        seconds = command_latency(logger_type, command)
+        if command.startswith("C"):
+            # The sensor measures while the others are started; the program
+            # then waits once for the slowest sensor of the run.
+            seconds -= SENSOR_MEASUREMENT_WAIT_S[command]
+            wait_s = concurrent_wait_s(command)
+            waits = port_load["concurrent_waits"]
+            if command != previous_command.get(port):
+                waits.append((command, wait_s))
+                port_load["seconds"] += wait_s
+            elif wait_s > waits[-1][1]:
+                port_load["seconds"] += wait_s - waits[-1][1]
+                waits[-1] = (command, wait_s)
+        sensor["seconds"] += seconds
+        port_load["seconds"] += seconds
+        previous_command[port] = command
+
+    overhead_s = LATENCY_PROFILES[logger_type]["overhead_s"]
+    total_s = overhead_s + max((load["seconds"] for load in ports.values()), default=0.0)
+    interval_s = measure_interval_min * 60
+    return {
+        "logger_type": logger_type,
+        "sensors": sensors,
+        "ports": ports,
+        "overhead_s": overhead_s,
+        "total_s": total_s,
+        "interval_s": interval_s,
+        "fits": total_s <= interval_s,
+        "min_interval_min": max(1, math.ceil(total_s / 60)),
+    }
+
+
+def balance_ports(sensor_seconds, ports):
+    """
+    Partitions sensors across SDI-12 ports so the per-port measurement times are
+    as even as possible (longest sensor first onto the least loaded port).
+
+    Args:
+        sensor_seconds (dict): Expected seconds per scan for each address, in
+            address order.
+        ports (list): Available port names, e.g. ["C1", "C2"].
+
+    Returns:
+        dict: port -> list of addresses (in their original order). Ports left
+        without sensors are omitted.
+    """
+    loads = {port: 0.0 for port in ports}
+    assigned = {port: [] for port in ports}
+    for address in sorted(sensor_seconds, key=lambda a: -sensor_seconds[a]):
+        port = min(ports, key=lambda p: loads[p]) # First listed port wins ties
+        loads[port] += sensor_seconds[address]
+        assigned[port].append(address)
+    order = {address: i for i, address in enumerate(sensor_seconds)}
+    return {port: sorted(addresses, key=order.get)
+            for port, addresses in assigned.items() if addresses}
+
+
+def format_budget(budget):
+    """Renders an estimate_scan() result as a per-sensor and per-port breakdown table."""
+    lines = [f"Worst-case scan time ({budget['logger_type']}, "
+             f"{budget['interval_s'] // 60} min interval = {budget['interval_s']} s):",
+             f"  {'Sensor':<8}{'Port':<6}{'Commands':<22}{'Seconds':>9}"]
+    for address, sensor in budget["sensors"].items():
+        lines.append(f"  {address:<8}{sensor['port']:<6}{' '.join(sensor['commands']):<22}"
+                     f"{sensor['seconds']:>9.1f}")
+    for port, load in budget["ports"].items():
+        for command, wait_s in load["concurrent_waits"]:
+            lines.append(f"  {'Concurrent wait ' + command + ' (' + port + ')':<36}{wait_s:>9.1f}")
+    if len(budget["ports"]) > 1:
+        for port, load in budget["ports"].items():
+            lines.append(f"  {f'Port {port} load ({len(load['sensors'])} sensors)':<36}"
+                         f"{load['seconds']:>9.1f}")
+    lines.append(f"  {'Logger overhead':<36}{budget['overhead_s']:>9.1f}")
+    lines.append(f"  {'Total':<36}{budget['total_s']:>9.1f}  "
+                 f"({100 * budget['total_s'] / budget['interval_s']:.0f}% of the interval)")
+    return "\n".join(lines)
+
+
+def overrun_message(budget):
+    """Error message for a configuration whose scan does not fit its interval."""
+    return (f"Error: The worst-case scan takes {budget['total_s']:.0f} s but the measurement "
+            f"interval is {budget['interval_s'] // 60} min ({budget['interval_s']} s); the logger "
+            f"would skip scans. Smallest feasible interval: {budget['min_interval_min']} min.")
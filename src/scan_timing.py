@@ -0,0 +1,136 @@
+# src/scan_timing.py
+
+import numpy as np
+
+from src import cr300_generator, reader
+
+# Analysis of the ScanDiag table an instrumented program (instrument=True) logs
+# on every scan: per-sensor SDI-12 call latency (Lat_S{n}, ms), scan process
+# time (ProcTime_ms) and the logger's SkippedScan / WatchdogErr counters.
+#
+# For each address it reports latency percentiles, how often the sensor was the
+# slowest of the scan, and the latency trend (least-squares slope and monthly
+# medians), so the sensors that set the scan time stand out.
+
+INSTRUMENT_TABLE_NAME = cr300_generator.INSTRUMENT_TABLE_NAME # The CR200X uses the same name
+LATENCY_PREFIX = "Lat_S"
+PERCENTILES = (50, 90, 99)
+COUNTER_FIELDS = ("SkippedScan", "WatchdogErr")
+NS_PER_DAY = 86400 * 10**9
+
+
+def instrument_schema(logger_type, num_sensors, measure_interval_min, **generator_args):
+    """Reader schema of an instrumented program's ScanDiag table."""
+    return reader.table_schema(logger_type, INSTRUMENT_TABLE_NAME, num_sensors, measure_interval_min,
+                               instrument=True, **generator_args)
+
+
+def counter_increase(values):
+    """
+    Total increase of a logger counter over the records. Drops (the counter was
+    reset, e.g. by a program reload) start a new run instead of counting negative.
+    """
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return 0
+    steps = np.diff(values)
+    return int(steps[steps > 0].sum())
+
+
+def latency_trend(timestamps, latencies):
+    """Least-squares latency slope in ms per day (NaN with fewer than 2 valid records)."""
+    valid = ~np.isnan(latencies)
+    if valid.sum() < 2:
+        return float("nan")
+    days = (timestamps[valid] - timestamps[valid][0]).astype(np.int64) / NS_PER_DAY
+    if days[-1] == days[0]:
+        return float("nan")
+    return float(np.polyfit(days, latencies[valid], 1)[0])
+
+
+def analyze(data, measure_interval_min):
+    """
+    Summarizes ScanDiag records.
+
+    Args:
+        data (numpy.ndarray): ScanDiag records as returned by the reader, in time order.
+        measure_interval_min (int): The program's scan interval.
+
+    Returns:
+        dict: 'records', 'first', 'last', 'interval_ms', 'proc_time' (percentiles
+        and max, ms), 'counters' (increase of each COUNTER_FIELDS counter),
+        'months' (list of 'YYYY-MM'), and 'sensors': address -> {'percentiles',
+        'max', 'mean', 'slowest_share', 'trend_ms_per_day', 'monthly_median'},
+        ordered by 90th percentile latency, slowest first.
+    """
+    timestamps = data[reader.TIMESTAMP_FIELD]
+    columns = [name for name in data.dtype.names if name.startswith(LATENCY_PREFIX)]
+    latencies = np.column_stack([data[name].astype(np.float64) for name in columns]) if columns else \
+        np.empty((len(data), 0))
+    months = np.datetime_as_string(timestamps.astype("M8[M]"))
+    month_keys = sorted(set(months.tolist()))
+
+    # Which sensor held the bus longest in each scan
+    with np.errstate(invalid="ignore"):
+        has_value = ~np.all(np.isnan(latencies), axis=1) if columns else np.zeros(len(data), dtype=bool)
+        slowest = np.full(len(data), -1)
+        slowest[has_value] = np.nanargmax(latencies[has_value], axis=1)
+
+    sensors = {}
+    for k, name in enumerate(columns):
+        values = latencies[:, k]
+        valid = values[~np.isnan(values)]
+        if not len(valid):
+            continue
+        sensors[name[len(LATENCY_PREFIX):]] = {
+            "percentiles": {p: float(np.percentile(valid, p)) for p in PERCENTILES},
+            "max": float(valid.max()),
+            "mean": float(valid.mean()),
+            "slowest_share": float((slowest == k).sum() / max(1, has_value.sum())),
+            "trend_ms_per_day": latency_trend(timestamps, values),
+            "monthly_median": {month: float(np.nanmedian(values[months == month]))
+                               if np.any(~np.isnan(values[months == month])) else float("nan")
+                               for month in month_keys},
+        }
+    sensors = dict(sorted(sensors.items(), key=lambda item: -item[1]["percentiles"][90]))
+
+    proc_time = data["ProcTime_ms"].astype(np.float64)
+    proc_time = proc_time[~np.isnan(proc_time)]
+    return {
+        "records": len(data),
+        "first": str(timestamps[0].astype("M8[s]")) if len(data) else None,
+        "last": str(timestamps[-1].astype("M8[s]")) if len(data) else None,
+        "interval_ms": measure_interval_min * 60 * 1000,
+        "proc_time": ({**{p: float(np.percentile(proc_time, p)) for p in PERCENTILES},
+                       "max": float(proc_time.max())} if len(proc_time) else {}),
+        "counters": {name: counter_increase(data[name].astype(np.float64)) for name in COUNTER_FIELDS},
+        "months": month_keys,
+        "sensors": sensors,
+    }
+
+
+def format_report(report):
+    """Renders an analyze() result: scan summary, per-address latency table, monthly medians."""
+    lines = [f"Scan timing: {report['records']} scans from {report['first']} to {report['last']}"]
+    proc_time = report["proc_time"]
+    if proc_time:
+        lines.append(f"  Process time (ms): p50 {proc_time[50]:.0f}, p90 {proc_time[90]:.0f}, "
+                     f"p99 {proc_time[99]:.0f}, max {proc_time['max']:.0f} "
+                     f"({100 * proc_time['max'] / report['interval_ms']:.0f}% of the interval)")
+    lines.append("  " + ", ".join(f"{name}: +{count}" for name, count in report["counters"].items()))
+    lines.append("")
+    lines.append("SDI-12 latency per address (ms), slowest first:")
+    lines.append(f"  {'Addr':<6}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES)
+                 + f"{'Max':>9}{'Slowest':>9}{'Trend/day':>11}")
+    for address, sensor in report["sensors"].items():
+        lines.append(f"  {address:<6}" + "".join(f"{sensor['percentiles'][p]:>9.0f}" for p in PERCENTILES)
+                     + f"{sensor['max']:>9.0f}{100 * sensor['slowest_share']:>8.0f}%"
+                     + f"{sensor['trend_ms_per_day']:>+11.1f}")
+    if len(report["months"]) > 1:
+        lines.append("")
+        lines.append("Monthly median latency (ms):")
+        lines.append(f"  {'Addr':<6}" + "".join(f"{month:>9}" for month in report["months"]))
+        for address, sensor in report["sensors"].items():
+            lines.append(f"  {address:<6}" + "".join(f"{sensor['monthly_median'][month]:>9.0f}"
+                                                     for month in report["months"]))
+    return "\n".join(lines)
@@ -0,0 +1,408 @@
+# src/service.py
+
+import asyncio
+import collections
+import json
+import math
+import os
+import time
+from http import HTTPStatus
+
+from src import profiles
+from src.main import (MANIFEST_STATION_KEYS, GENERATOR_OPTION_KEYS, LIST_OPTION_KEYS, POWER_OPTION_KEYS,
+                      check_power, check_scan_budget, check_storage, is_generator_error, join_messages,
+                      list_option, station_generator_args, station_power_args)
+from src.profiles import LOGGER_TYPES, check_sensor_config
+from src.verifier import ProgramLimitError, ProgramVerifier
+
+# Long-running local provisioning service.
+#
+# A small HTTP/1.1 server (asyncio, standard library only) on a localhost port
+# or a Unix socket. Programs are generated in a pool of worker processes, each
+# of which loads every logger profile (generator module and compiled emission
+# templates) once when it starts; the event loop only parses requests and
+# hands them to the pool, so concurrent requests do not wait for each other.
+# Repeated requests are answered from an in-memory cache of recent responses.
+#
+# Endpoints (JSON in and out):
+#   POST /generate  - a request object, or a list of them (e.g. a whole site),
+#                     with the keys of a batch manifest station except 'output':
+#                     logger_type, num_sensors, measure_interval, and optionally
+#                     GENERATOR_OPTION_KEYS and POWER_OPTION_KEYS. Each response
+#                     holds 'ok', 'program', 'metadata', 'warning' and 'error'.
+#   GET /metrics    - request counts, latency percentiles and throughput
+#   GET /health     - liveness and the logger types served
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 1024 * 1024
+MAX_CACHED_RESPONSES = 256
+LATENCY_WINDOW = 1000      # Most recent programs the latency percentiles cover
+THROUGHPUT_WINDOW_S = 60.0 # Programs per second are counted over this window
+LATENCY_PERCENTILES = (50, 90, 99)
+REQUEST_KEYS = tuple(key for key in MANIFEST_STATION_KEYS if key != "output") + GENERATOR_OPTION_KEYS \
+    + POWER_OPTION_KEYS
+
+
+class RequestError(ValueError):
+    """A request the service rejects, with the HTTP status to answer it with."""
+
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(message)
+
+
+# --- Generation (runs in the worker processes) ---
+
+def warm_worker(logger_types):
+    """Worker initializer: loads the profiles of the logger types, once per process."""
+    for logger_type in logger_types:
+        profiles.load_profile(logger_type)
+
+
+def _finite(value):
+    """JSON has no infinity (e.g. tables that never wrap): None instead."""
+    return None if value is None or math.isinf(value) else value
+
+
+def render_program(request):
+    """
+    Generates the program of one validated request.
+
+    Returns:
+        dict: 'ok', 'program' (the CRBasic source or None), 'metadata' (sizes and
+        model estimates, or None), 'warning' and 'error' (messages or None).
+    """
+    start = time.perf_counter()
+    response = {"ok": False, "program": None, "metadata": None, "warning": None, "error": None}
+    logger_type = request["logger_type"]
+    error, response["warning"] = check_sensor_config(logger_type, request["num_sensors"], request["measure_interval"],
+                                                     request.get("layout"))
+    if error:
+        response["error"] = error
+        return response
+    try:
+        loaded = profiles.load_profile(logger_type)
+        module = loaded["module"]
+        generator_args = station_generator_args(request)
+        budget, budget_error = check_scan_budget(logger_type, module, generator_args)
+        if budget_error:
+            response["error"] = budget_error
+            return response
+        estimate, storage_warning = check_storage(logger_type, module, generator_args)
+        energy, power_warning = check_power(logger_type, module, generator_args, station_power_args(request))
+        verifier = ProgramVerifier(logger_type)
+        lines = list(verifier.watch(module.iter_code(**generator_args)))
+        if not lines:
+            response["error"] = "Error: Code generation failed for an unknown reason."
+            return response
+        if is_generator_error(lines[0]):
+            response["error"] = f"Error from generator module: {lines[0]}"
+            return response
+        report = verifier.check()
+    except ProgramLimitError as e:
+        response["error"] = str(e)
+        return response
+    except Exception as e:
+        response["error"] = f"Error during code generation: {e}"
+        return response
+
+    program = "\n".join(lines)
+    tables = module.table_layout(**generator_args)
+    response.update(ok=True, program=program,
+                    warning=join_messages(response["warning"], storage_warning, power_warning))
+    response["metadata"] = {
+        "logger_type": logger_type,
+        "num_sensors": request["num_sensors"],
+        "measure_interval": request["measure_interval"],
+        "file_extension": loaded["profile"]["file_extension"],
+        "lines": program.count("\n") + 1,
+        "bytes": len(program.encode()),
+        "program_bytes": report["program_bytes"], # As the verifier counts them (no comments)
+        "tables": len(tables),
+        "fields": sum(len(table["fields"]) for table in tables),
+        "variables": report["variables"],
+        "aliases": report["aliases"],
+        "scan_s": round(budget["total_s"], 2),
+        "kb_per_day": round(estimate["bytes_per_day"] / 1024, 2),
+        "wrap_days": _finite(round(estimate["days_until_wrap"], 1)),
+        "ah_per_day": round(energy["ah_per_day"], 4),
+        "runtime_days": _finite(energy["runtime_days"]),
+        "generate_ms": round((time.perf_counter() - start) * 1000, 3),
+        "cached": False,
+    }
+    return response
+
+
+# --- Service ---
+
+def validate_request(request):
+    """
+    Checks a request's keys and types before it is queued.
+
+    Returns:
+        dict: The request with 'logger_type' upper-cased and comma-separated
+        list options split (see main.list_option()).
+
+    Raises:
+        RequestError: 400 with the problem.
+    """
+    if not isinstance(request, dict):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Each request must be a JSON object.")
+    unknown = sorted(set(request) - set(REQUEST_KEYS))
+    if unknown:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Unknown request key(s): {', '.join(unknown)}. "
+                                                   f"Allowed: {', '.join(REQUEST_KEYS)}.")
+    missing = [key for key in REQUEST_KEYS[:3] if key not in request]
+    if missing:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Missing request key(s): {', '.join(missing)}.")
+    for key in ("num_sensors", "measure_interval"):
+        if isinstance(request[key], bool) or not isinstance(request[key], int):
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"'{key}' must be an integer.")
+    request = {**request, "logger_type": str(request["logger_type"]).upper()}
+    for key in LIST_OPTION_KEYS:
+        if request.get(key) is not None:
+            try:
+                request[key] = list_option(key, request[key])
+            except ValueError as e:
+                raise RequestError(HTTPStatus.BAD_REQUEST, str(e)) from None
+    return request
+
+
+def _percentile(ordered, percent):
+    """Nearest-rank percentile of an ordered list."""
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class ServiceMetrics:
+    """Counts, latencies and completion times of the programs the service answers."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.programs = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.in_flight = 0
+        self.by_logger = collections.Counter()
+        self.latencies_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self.completed = collections.deque() # monotonic completion times within THROUGHPUT_WINDOW_S
+
+    def record(self, logger_type, seconds, ok, cached):
+        now = time.monotonic()
+        self.programs += 1
+        self.errors += not ok
+        self.cache_hits += cached
+        self.by_logger[logger_type] += 1
+        self.latencies_ms.append(seconds * 1000)
+        self.completed.append(now)
+        while self.completed and self.completed[0] < now - THROUGHPUT_WINDOW_S:
+            self.completed.popleft()
+
+    def snapshot(self):
+        """The metrics as a JSON-ready dict."""
+        now = time.monotonic()
+        while self.completed and self.completed[0] < now - THROUGHPUT_WINDOW_S:
+            self.completed.popleft()
+        window_s = min(THROUGHPUT_WINDOW_S, now - self.started)
+        ordered = sorted(self.latencies_ms)
+        return {
+            "uptime_s": round(now - self.started, 1),
+            "requests": self.requests,
+            "programs": self.programs,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "in_flight": self.in_flight,
+            "by_logger_type": dict(self.by_logger),
+            "latency_ms": {**{f"p{p}": round(_percentile(ordered, p), 3) for p in LATENCY_PERCENTILES},
+                           "max": round(ordered[-1], 3)} if ordered else None,
+            "latency_window": len(ordered),
+            "programs_per_s": round(len(self.completed) / window_s, 2) if window_s > 0 else 0.0,
+        }
+
+
+class ProvisioningService:
+    """
+    Answers program requests from a pool of warm workers.
+
+    Args:
+        workers (int): Worker processes (default: one per CPU). 0 generates in a
+            thread of this process instead.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.metrics = ServiceMetrics()
+        self._cache = collections.OrderedDict() # request JSON -> response
+        self._executor = None
+
+    def start(self):
+        """Starts the worker pool and loads every profile in each worker."""
+        if self.workers == 0:
+            from concurrent.futures import ThreadPoolExecutor
+            warm_worker(LOGGER_TYPES)
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker,
+                                                 initargs=(LOGGER_TYPES,))
+            # Start every worker now rather than on the first requests
+            for future in [self._executor.submit(warm_worker, LOGGER_TYPES) for _ in range(self.workers)]:
+                future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def generate(self, request):
+        """Answers one validated request, from the cache or a worker."""
+        start = time.perf_counter()
+        key = json.dumps(request, sort_keys=True)
+        response = self._cache.get(key)
+        cached = response is not None
+        if cached:
+            self._cache.move_to_end(key)
+            response = {**response, "metadata": {**response["metadata"], "cached": True}}
+        else:
+            self.metrics.in_flight += 1
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(self._executor, render_program, request)
+            finally:
+                self.metrics.in_flight -= 1
+            if response["ok"]:
+                self._cache[key] = response
+                if len(self._cache) > MAX_CACHED_RESPONSES:
+                    self._cache.popitem(last=False)
+        self.metrics.record(request["logger_type"], time.perf_counter() - start, response["ok"], cached)
+        return response
+
+    async def handle(self, method, path, body):
+        """
+        Routes one HTTP request.
+
+        Returns:
+            tuple: (HTTPStatus, JSON-ready payload).
+        """
+        self.metrics.requests += 1
+        if path == "/health" and method == "GET":
+            return HTTPStatus.OK, {"ok": True, "logger_types": LOGGER_TYPES, "workers": self.workers}
+        if path == "/metrics" and method == "GET":
+            return HTTPStatus.OK, self.metrics.snapshot()
+        if path != "/generate":
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No endpoint {path}; use POST /generate, GET /metrics or GET /health.")
+        if method != "POST":
+            raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST /generate.")
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}") from None
+        if isinstance(payload, list):
+            requests = [validate_request(request) for request in payload]
+            responses = await asyncio.gather(*(self.generate(request) for request in requests))
+            status = HTTPStatus.OK if all(response["ok"] for response in responses) else HTTPStatus.UNPROCESSABLE_ENTITY
+            return status, responses
+        response = await self.generate(validate_request(payload))
+        return (HTTPStatus.OK if response["ok"] else HTTPStatus.UNPROCESSABLE_ENTITY), response
+
+
+# --- HTTP ---
+
+async def _read_request(reader):
+    """
+    Reads one HTTP/1.1 request.
+
+    Returns:
+        tuple: (method, path, headers, body), or None when the client closed the connection.
+
+    Raises:
+        RequestError: On a malformed or oversized request.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+    if int(length) > MAX_BODY_BYTES:
+        raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Request body over {MAX_BODY_BYTES} bytes.")
+    body = await reader.readexactly(int(length)) if int(length) else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    writer.write((f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                  "Content-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + body)
+
+
+async def _serve_connection(service, reader, writer):
+    """Answers the requests of one connection (kept alive unless the client asks otherwise)."""
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await service.handle(method, path, body)
+            except RequestError as e:
+                keep_alive = False
+                status, payload = e.status, {"ok": False, "error": str(e)}
+            _write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, workers=None, ready=None):
+    """
+    Runs the service until cancelled.
+
+    Args:
+        unix_socket (str): Listen on this Unix socket path instead of host:port.
+        workers (int): See ProvisioningService.
+        ready (callable): Called with a description of the address once listening.
+    """
+    service = ProvisioningService(workers)
+    service.start()
+
+    async def on_connection(reader, writer):
+        await _serve_connection(service, reader, writer)
+
+    try:
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket) # Left behind by an earlier run
+            server = await asyncio.start_unix_server(on_connection, unix_socket)
+            address = f"unix:{unix_socket}"
+        else:
+            server = await asyncio.start_server(on_connection, host, port)
+            address = f"http://{host}:{server.sockets[0].getsockname()[1]}"
+        if ready is not None:
+            workers = f"{service.workers} worker{'s' if service.workers != 1 else ''}" if service.workers else "in-process"
+            ready(f"{address} ({workers})")
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
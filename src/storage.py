@@ -0,0 +1,82 @@
+# src/storage.py
+
+# Storage and telemetry footprint of a generated program.
+#
+# Every table is declared DataTable(..., True, -1): a ring buffer whose size the
+# logger auto-allocates. Auto-allocated tables share the free data memory so
+# that they all fill at the same time, after which the oldest records are
+# overwritten. Records not collected by then are lost.
+
+# Bytes one value takes in final storage, per storage type
+DATA_TYPE_BYTES = {"IEEE4": 4, "FP2": 2, "Long": 4}
+
+# Per logger profile:
+#   data_bytes             - final storage memory shared by the auto-allocated tables
+#   record_overhead_bytes  - timestamp and record number stored with every record
+STORAGE_PROFILES = {
+    "CR200X": {"data_bytes": 128 * 1024, "record_overhead_bytes": 8},
+    "CR300": {"data_bytes": 30 * 1024 * 1024, "record_overhead_bytes": 12},
+}
+
+# A configuration whose tables wrap sooner than this gets a warning
+WRAP_WARNING_DAYS = 30
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def estimate_storage(logger_type, tables):
+    """
+    Estimates record sizes, daily data volume and ring-buffer lifetime.
+
+    Args:
+        logger_type (str): Key into STORAGE_PROFILES (e.g., "CR300").
+        tables (list): Table dicts as returned by a generator module's table_layout().
+
+    Returns:
+        dict: 'tables' (one dict per table with 'name', 'fields', 'bytes_per_record',
+        'records_per_day' and 'bytes_per_day'), the totals 'bytes_per_day' (the
+        daily collection volume), 'data_bytes', and 'days_until_wrap'.
+    """
+    profile = STORAGE_PROFILES[logger_type]
+    table_estimates = []
+    for table in tables:
+        bytes_per_record = profile["record_overhead_bytes"] + sum(
+            DATA_TYPE_BYTES[field["data_type"]] for field in table["fields"])
+        records_per_day = MINUTES_PER_DAY / table["interval_min"]
+        table_estimates.append({
+            "name": table["name"],
+            "fields": len(table["fields"]),
+            "bytes_per_record": bytes_per_record,
+            "records_per_day": records_per_day,
+            "bytes_per_day": bytes_per_record * records_per_day,
+        })
+    bytes_per_day = sum(table["bytes_per_day"] for table in table_estimates)
+    return {
+        "logger_type": logger_type,
+        "tables": table_estimates,
+        "bytes_per_day": bytes_per_day,
+        "data_bytes": profile["data_bytes"],
+        "days_until_wrap": profile["data_bytes"] / bytes_per_day if bytes_per_day else float("inf"),
+    }
+
+
+def format_storage(estimate):
+    """Renders an estimate_storage() result as a per-table table with totals."""
+    lines = [f"Storage footprint ({estimate['logger_type']}, "
+             f"{estimate['data_bytes'] / 1024:.0f} KB of data memory):",
+             f"  {'Table':<14}{'Fields':>7}{'Bytes/rec':>11}{'Rec/day':>9}{'KB/day':>9}"]
+    for table in estimate["tables"]:
+        lines.append(f"  {table['name']:<14}{table['fields']:>7}{table['bytes_per_record']:>11}"
+                     f"{table['records_per_day']:>9.0f}{table['bytes_per_day'] / 1024:>9.1f}")
+    lines.append(f"  {'Daily collection volume':<41}{estimate['bytes_per_day'] / 1024:>9.1f} KB")
+    lines.append(f"  {'Days until the ring buffers wrap':<41}{estimate['days_until_wrap']:>9.0f}")
+    return "\n".join(lines)
+
+
+def wrap_warning(estimate):
+    """Warning message if the tables wrap within WRAP_WARNING_DAYS, else None."""
+    if estimate["days_until_wrap"] >= WRAP_WARNING_DAYS:
+        return None
+    return (f"Warning: The data tables wrap after {estimate['days_until_wrap']:.1f} days "
+            f"({estimate['bytes_per_day'] / 1024:.1f} KB/day); collect the data more often "
+            f"than that or the oldest records are overwritten.")
@@ -0,0 +1,242 @@
+# src/verifier.py
+
+import re
+
+# Static checks of a generated CRBasic program against the resource limits of
+# its logger, so a program the compiler would reject is caught in milliseconds
+# instead of after a round trip through crbrs.
+#
+# The program is parsed line by line as it is written: Const values (for array
+# sizes), Public/Dim declarations, Alias lines, and the output instructions
+# between DataTable and EndTable. Limits set to None are not checked.
+
+# Per logger profile:
+#   max_tables            - DataTable blocks in one program
+#   max_fields_per_table  - fields one table may hold (sum of the output instructions' reps)
+#   max_table_name_chars  - length of a DataTable name
+#   max_variables         - declared Public/Dim values (each array element counts)
+#   max_aliases           - Alias declarations
+#   max_program_bytes     - program source size, comments and blank lines excluded
+# The CR200X table limits are the reason for MAX_SENSORS_CR200X_ONE_TABLE_PER_SENSOR
+# (one table per sensor); the CR300 has no practical table or field limit.
+LIMIT_PROFILES = {
+    "CR200X": {
+        "max_tables": 8,
+        "max_fields_per_table": 16,
+        "max_table_name_chars": 12,
+        "max_variables": 256,
+        "max_aliases": 128,
+        "max_program_bytes": 16 * 1024,
+    },
+    "CR300": {
+        "max_tables": None,
+        "max_fields_per_table": None,
+        "max_table_name_chars": 20,
+        "max_variables": 4096,
+        "max_aliases": 2048,
+        "max_program_bytes": 512 * 1024,
+    },
+}
+
+# Output processing instructions whose first parameter is the number of fields they write
+OUTPUT_INSTRUCTIONS = ("Sample", "Average", "Maximum", "Minimum", "Totalize", "StdDev", "Median")
+
+_CONST_RE = re.compile(r"Const\s+(\w+)\s*=\s*(.+)", re.IGNORECASE)
+_DECLARATION_RE = re.compile(r"(?:Public|Dim)\s+(.+)", re.IGNORECASE)
+_VARIABLE_RE = re.compile(r"(\w+)\s*(?:\(([^)]*)\))?", re.IGNORECASE)
+_ALIAS_RE = re.compile(r"Alias\s", re.IGNORECASE)
+_DATATABLE_RE = re.compile(r"DataTable\s*\(\s*(\w+)", re.IGNORECASE)
+_ENDTABLE_RE = re.compile(r"EndTable\b", re.IGNORECASE)
+_OUTPUT_RE = re.compile(rf"({'|'.join(OUTPUT_INSTRUCTIONS)})\s*\(\s*([^,]+),", re.IGNORECASE)
+
+
+class ProgramLimitError(ValueError):
+    """Raised by ProgramVerifier.check() when a program breaks its logger's limits."""
+
+    def __init__(self, report):
+        self.report = report
+        super().__init__(format_violations(report))
+
+
+def _split_outside_quotes(text, separator):
+    """Splits 'text' on 'separator' characters that are not inside "quotes" or (parentheses)."""
+    parts, current, in_quotes, depth = [], [], False, 0
+    for char in text:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif not in_quotes and char == "(":
+            depth += 1
+        elif not in_quotes and char == ")":
+            depth -= 1
+        elif char == separator and not in_quotes and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _strip_comment(line):
+    """Removes a trailing ' comment (an apostrophe outside quotes)."""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == "'" and not in_quotes:
+            return line[:i]
+    return line
+
+
+class ProgramVerifier:
+    """
+    Incremental checker of one generated program against LIMIT_PROFILES[logger_type].
+
+    Feed it the program with feed() or by streaming the lines through watch(),
+    then call report() or check().
+    """
+
+    def __init__(self, logger_type):
+        self.logger_type = logger_type
+        self.limits = LIMIT_PROFILES[logger_type]
+        self.constants = {}
+        self.tables = {} # table name -> field count, in program order
+        self.variables = 0
+        self.aliases = 0
+        self.program_bytes = 0
+        self.unresolved = [] # Array sizes that could not be evaluated
+        self._table = None
+
+    # --- Parsing ---
+
+    def watch(self, lines):
+        """Passes program lines (items may hold several lines) through, verifying each."""
+        for item in lines:
+            self.feed(item)
+            yield item
+
+    def feed(self, text):
+        for line in text.split("\n"):
+            code = _strip_comment(line).strip()
+            if not code:
+                continue
+            self.program_bytes += len(code.encode()) + 1
+            for statement in _split_outside_quotes(code, ":"):
+                self._parse_statement(statement.strip())
+
+    def _parse_statement(self, statement):
+        match = _CONST_RE.match(statement)
+        if match:
+            value = self._evaluate(match.group(2))
+            if value is not None:
+                self.constants[match.group(1).upper()] = value
+            return
+        match = _DECLARATION_RE.match(statement)
+        if match:
+            for declaration in _split_outside_quotes(match.group(1), ","):
+                self.variables += self._declared_values(declaration.strip())
+            return
+        if _ALIAS_RE.match(statement):
+            self.aliases += 1
+            return
+        match = _DATATABLE_RE.match(statement)
+        if match:
+            self._table = match.group(1)
+            self.tables[self._table] = 0
+            return
+        if _ENDTABLE_RE.match(statement):
+            self._table = None
+            return
+        if self._table is not None:
+            match = _OUTPUT_RE.match(statement)
+            if match:
+                reps = self._evaluate(match.group(2))
+                if reps is None:
+                    self.unresolved.append(statement)
+                    reps = 1
+                self.tables[self._table] += reps
+
+    def _evaluate(self, expression):
+        """Value of an integer literal, a Const name, or a product of them (e.g. NUM_SENSORS * 9)."""
+        value = 1
+        for term in expression.split("*"):
+            term = term.strip()
+            if term.isdigit():
+                value *= int(term)
+            elif term.upper() in self.constants:
+                value *= self.constants[term.upper()]
+            else:
+                return None
+        return value
+
+    def _declared_values(self, declaration):
+        """Number of values one 'Name', 'Name(n)' or 'Name(n, m) As Type' declaration holds."""
+        match = _VARIABLE_RE.match(declaration)
+        if not match or not match.group(2):
+            return 1
+        values = 1
+        for size in match.group(2).split(","):
+            size_value = self._evaluate(size)
+            if size_value is None:
+                self.unresolved.append(declaration)
+                return 1
+            values *= size_value
+        return values
+
+    # --- Results ---
+
+    def report(self):
+        """
+        Checks everything fed so far against the logger's limits.
+
+        Returns:
+            dict: 'logger_type', 'tables' (name -> fields), 'variables', 'aliases',
+            'program_bytes', and 'violations' (list of messages; empty if the
+            program is within limits).
+        """
+        limits = self.limits
+        violations = []
+
+        def over(limit_key, value, what):
+            limit = limits[limit_key]
+            if limit is not None and value > limit:
+                violations.append(f"{what}: {value} (limit {limit})")
+
+        over("max_tables", len(self.tables), "Data tables")
+        for name, fields in self.tables.items():
+            over("max_fields_per_table", fields, f"Fields in table '{name}'")
+            over("max_table_name_chars", len(name), f"Length of table name '{name}'")
+        over("max_variables", self.variables, "Declared variable values")
+        over("max_aliases", self.aliases, "Alias declarations")
+        over("max_program_bytes", self.program_bytes, "Program size in bytes")
+        for statement in self.unresolved:
+            violations.append(f"Cannot evaluate the size in: {statement}")
+        return {
+            "logger_type": self.logger_type,
+            "tables": dict(self.tables),
+            "variables": self.variables,
+            "aliases": self.aliases,
+            "program_bytes": self.program_bytes,
+            "violations": violations,
+        }
+
+    def check(self):
+        """Raises ProgramLimitError if the program breaks a limit; returns the report otherwise."""
+        report = self.report()
+        if report["violations"]:
+            raise ProgramLimitError(report)
+        return report
+
+
+def verify_program(logger_type, generated_code):
+    """Verifies a complete program string. Returns the ProgramVerifier.report() dict."""
+    verifier = ProgramVerifier(logger_type)
+    verifier.feed(generated_code)
+    return verifier.report()
+
+
+def format_violations(report):
+    """Error message listing every limit a program breaks."""
+    lines = [f"Error: The generated program exceeds {report['logger_type']} limits:"]
+    lines += [f"  - {violation}" for violation in report["violations"]]
+    return "\n".join(lines)
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from src import cr200x_generator, main, verifier
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_cli(*args):
+    """Runs 'python -m src.main' from the repository root. Returns the CompletedProcess."""
+    return subprocess.run([sys.executable, "-m", "src.main", *args], cwd=REPO_ROOT,
+                          capture_output=True, text=True)
+
+
+class PackedMeasurementsTest(unittest.TestCase):
+
+    def test_cli_accepts_mixed_case_alias_prefixes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "packed.cr2")
+            result = run_cli("--logger-type", "CR200X", "-n", "2", "-t", "30", "--layout", "packed",
+                             "--measurements", "SapFlwTot,TpDsOut", "--no-cache", "-o", output)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(output) as f:
+                program = f.read()
+        self.assertIn("Alias SDIData_Sensor0(1) = SapFlwTot0", program)
+        self.assertIn("Alias SDIDataM1_Sensor1(1) = TpDsOut1", program)
+
+    def test_manifest_comma_string_resolves(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = os.path.join(tmp, "manifest.json")
+            with open(manifest, "w") as f:
+                json.dump({"stations": [{"logger_type": "CR200X", "num_sensors": 3, "measure_interval": 30,
+                                         "layout": "packed", "measurements": "sapflwtot, M5",
+                                         "output": os.path.join(tmp, "a.cr2")}]}, f)
+            station = main.load_manifest(manifest)[0]
+        generator_args = main.station_generator_args(station)
+        logged, error = cr200x_generator.resolve_measurements(generator_args["measurements"])
+        self.assertIsNone(error)
+        self.assertEqual(logged, ["SapFlwTot", "tMxTUsO", "tMxTUsI"])
+
+
+class PackedInstrumentTest(unittest.TestCase):
+
+    def test_scandiag_over_the_field_limit_is_rejected(self):
+        for num_sensors in (14, 20):
+            with self.subTest(num_sensors=num_sensors):
+                tables, error = cr200x_generator.plan_tables(num_sensors, 30, ["SapFlwTot"], instrument=True)
+                self.assertEqual(tables, [])
+                self.assertIn(cr200x_generator.INSTRUMENT_TABLE_NAME, error)
+                program = cr200x_generator.generate_code(num_sensors, 30, layout="packed",
+                                                         measurements=["SapFlwTot"], instrument=True)
+                self.assertTrue(program.startswith("' Error"))
+
+    def test_largest_instrumented_program_verifies(self):
+        program = cr200x_generator.generate_code(13, 30, layout="packed", measurements=["SapFlwTot"],
+                                                 instrument=True)
+        report = verifier.verify_program("CR200X", program)
+        self.assertEqual(report["violations"], [])
+        self.assertEqual(report["tables"][cr200x_generator.INSTRUMENT_TABLE_NAME], 16)
+
+
+
+class PackedLimitsTest(unittest.TestCase):
+
+    def largest_planned(self, measurements, instrument=False):
+        """The largest sensor count plan_tables accepts, and the planner's error one sensor past it."""
+        for num_sensors in range(1, cr200x_generator.MAX_SENSORS_CR200X_PACKED + 1):
+            _, error = cr200x_generator.plan_tables(num_sensors, 30, measurements, instrument=instrument)
+            if error:
+                return num_sensors - 1, error
+        return cr200x_generator.MAX_SENSORS_CR200X_PACKED, None
+
+    def test_largest_programs_verify(self):
+        for measurements in (["SapFlwTot"], None, ["SapFlwTot", "TpDsOut"], ["all"]):
+            for instrument in (False, True):
+                with self.subTest(measurements=measurements, instrument=instrument):
+                    num_sensors, _ = self.largest_planned(measurements, instrument)
+                    program = cr200x_generator.generate_code(num_sensors, 30, layout="packed",
+                                                             measurements=measurements, instrument=instrument)
+                    self.assertEqual(verifier.verify_program("CR200X", program)["violations"], [])
+
+    def test_variable_limit_rejects_before_verification(self):
+        num_sensors, error = self.largest_planned(["SapFlwTot"])
+        self.assertEqual(num_sensors, 28)
+        self.assertIn("variables", error)
+        self.assertEqual(cr200x_generator.packed_variable_count(28, ["SapFlwTot"]), 255)
+        result = run_cli("--logger-type", "CR200X", "-n", "36", "-t", "120", "--layout", "packed",
+                         "--measurements", "SapFlwTot", "--no-cache", "-o", os.devnull)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("327 variables", result.stdout + result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
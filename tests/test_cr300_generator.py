@@ -0,0 +1,43 @@
+import re
+import unittest
+
+from src import cr300_generator
+
+SAMPLE_RE = re.compile(r"^\s*Sample \((\d+), (\w+)(?:\(1\))?, (\w+)\)")
+
+
+def table_samples(program, table_name):
+    """(count, variable, data type) of each Sample line in one DataTable of a program."""
+    samples = []
+    in_table = False
+    for line in program.split("\n"):
+        if line.startswith(f"DataTable ({table_name},"):
+            in_table = True
+        elif in_table and line.strip() == "EndTable":
+            break
+        elif in_table:
+            match = SAMPLE_RE.match(line)
+            if match:
+                samples.append((int(match.group(1)), match.group(2), match.group(3)))
+    return samples
+
+
+class InstrumentTableTest(unittest.TestCase):
+
+    def test_layout_types_match_emitted_samples(self):
+        for layout in ("unrolled", "rolled"):
+            with self.subTest(layout=layout):
+                num_sensors = 5
+                program = "\n".join(cr300_generator.iter_code(num_sensors, 30, instrument=True, layout=layout))
+                table = next(table for table in cr300_generator.table_layout(num_sensors, 30, instrument=True)
+                             if table["name"] == cr300_generator.INSTRUMENT_TABLE_NAME)
+                emitted = []
+                for count, _, data_type in table_samples(program, cr300_generator.INSTRUMENT_TABLE_NAME):
+                    emitted += [data_type] * count
+                self.assertEqual(emitted, [field["data_type"] for field in table["fields"]])
+                self.assertEqual([field["data_type"] for field in table["fields"]
+                                  if field["name"] in cr300_generator.INSTRUMENT_STATUS_FIELDS], ["Long", "Long"])
+
+
+if __name__ == "__main__":
+    unittest.main()